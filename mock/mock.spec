@@ -170,7 +170,7 @@ Filesystem layout and group for Mock.
 
 %prep
 %setup -q
-for file in py/mock.py py/mock-parse-buildlog.py; do
+for file in py/mock.py py/mock-parse-buildlog.py py/mockd.py; do
   sed -i 1"s|#!/usr/bin/python3 |#!%{__python} |" $file
 done
 
@@ -206,6 +206,7 @@ install -d %{buildroot}%{_libexecdir}/mock
 install mockchain %{buildroot}%{_bindir}/mockchain
 install py/mock-hermetic-repo.py %{buildroot}%{_bindir}/mock-hermetic-repo
 install py/mock-parse-buildlog.py %{buildroot}%{_bindir}/mock-parse-buildlog
+install py/mockd.py %{buildroot}%{_bindir}/mockd
 install py/mock.py %{buildroot}%{_libexecdir}/mock/mock
 ln -s consolehelper %{buildroot}%{_bindir}/mock
  
@@ -280,6 +281,7 @@ pylint-3 py/mockbuild/ py/*.py py/mockbuild/plugins/* || :
 %{_bindir}/mockchain
 %{_bindir}/mock-hermetic-repo
 %{_bindir}/mock-parse-buildlog
+%{_bindir}/mockd
 %{_libexecdir}/mock
 
 # python stuff
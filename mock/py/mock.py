@@ -235,6 +235,9 @@ def command_parse():
                       help="if more than one pkg and it fails to build, try to build the rest and come back to it")
     parser.add_option('--tmp_prefix', default=None, dest='tmp_prefix',
                       help="tmp dir prefix - will default to username-pid if not specified")
+    parser.add_option('--chain-jobs', default=1, type=int, dest='chain_jobs', metavar='N',
+                      help="build up to N packages in parallel, each in its own buildroot, "
+                           "respecting the BuildRequires between the packages (--chain mode only)")
     # options
     parser.add_option("-r", "--root", action="store", type=str, dest="chroot",
                       help="chroot config file name or path. Taken as a path if it ends "
@@ -472,6 +475,14 @@ def command_parse():
         raise mockbuild.exception.BadCmdline(
             "Only --chain mode supports --continue build algorithm")
 
+    if options.chain_jobs != 1 and options.mode != 'chain':
+        raise mockbuild.exception.BadCmdline(
+            "The --chain-jobs option works only with --chain")
+
+    if options.chain_jobs < 1:
+        raise mockbuild.exception.BadCmdline(
+            "The --chain-jobs option requires a positive number")
+
     if options.spec:
         options.spec = os.path.expanduser(options.spec)
     if options.sources:
@@ -886,6 +897,11 @@ def main():
         buildroot.finalize()
         if bootstrap_buildroot is not None:
             bootstrap_buildroot.finalize()
+        if options.mode == 'chain' and config_opts.get('local_repo_dir'):
+            # the per-package timings are already in the package resultdirs,
+            # the rest (e.g. the whole 'run') goes next to them
+            buildroot.resultdir = config_opts['local_repo_dir']
+        buildroot.write_timings()
     return result
 
 
@@ -12,6 +12,8 @@ import shutil
 import sys
 import tempfile
 import getpass
+import time
+import subprocess
 
 # 3rd party imports
 import rpm
@@ -20,6 +22,7 @@ from mockbuild.mounts import BindMountPoint
 from . import file_util
 from . import text
 from . import util
+from .chain import ChainScheduler, child_mock_command
 from .external import ExternalDeps
 from .file_downloader import FileDownloader
 from .exception import PkgError, Error, RootError, BuildError
@@ -92,35 +95,38 @@ class Commands(object):
                     if scrub == 'all':
                         self.buildroot.root_log.info("scrubbing everything for %s", self.config_name)
                         self.buildroot.delete()
-                        file_util.rmtree(self.buildroot.cachedir, selinux=self.buildroot.selinux)
+                        file_util.rmtree(self.buildroot.cachedir, selinux=self.buildroot.selinux, parallel=True)
                         if self.bootstrap_buildroot is not None:
                             self.bootstrap_buildroot.delete()
                             file_util.rmtree(self.bootstrap_buildroot.cachedir,
-                                             selinux=self.bootstrap_buildroot.selinux)
+                                             selinux=self.bootstrap_buildroot.selinux, parallel=True)
                     elif scrub == 'chroot':
                         self.buildroot.root_log.info("scrubbing chroot for %s", self.config_name)
                         self.buildroot.delete()
                     elif scrub == 'cache':
                         self.buildroot.root_log.info("scrubbing cache for %s", self.config_name)
-                        file_util.rmtree(self.buildroot.cachedir, selinux=self.buildroot.selinux)
+                        file_util.rmtree(self.buildroot.cachedir, selinux=self.buildroot.selinux, parallel=True)
                     elif scrub == 'c-cache':
                         self.buildroot.root_log.info("scrubbing c-cache for %s", self.config_name)
                         file_util.rmtree(os.path.join(self.buildroot.cachedir, 'ccache'),
-                                         selinux=self.buildroot.selinux)
+                                         selinux=self.buildroot.selinux, parallel=True)
                     elif scrub == 'root-cache':
                         self.buildroot.root_log.info("scrubbing root-cache for %s", self.config_name)
                         file_util.rmtree(os.path.join(self.buildroot.cachedir, 'root_cache'),
-                                         selinux=self.buildroot.selinux)
+                                         selinux=self.buildroot.selinux, parallel=True)
                     elif scrub in ['yum-cache', 'dnf-cache']:
                         self.buildroot.root_log.info("scrubbing yum-cache and dnf-cache for %s", self.config_name)
                         file_util.rmtree(os.path.join(self.buildroot.cachedir, 'yum_cache'),
-                                         selinux=self.buildroot.selinux)
+                                         selinux=self.buildroot.selinux, parallel=True)
                         file_util.rmtree(os.path.join(self.buildroot.cachedir, 'dnf_cache'),
-                                         selinux=self.buildroot.selinux)
+                                         selinux=self.buildroot.selinux, parallel=True)
+                        for index in ['yum_cache.index.json', 'dnf_cache.index.json']:
+                            file_util.unlink_if_exists(os.path.join(self.buildroot.cachedir, index))
                     elif scrub == 'bootstrap' and self.bootstrap_buildroot is not None:
                         self.buildroot.root_log.info("scrubbing bootstrap for %s", self.config_name)
                         self.bootstrap_buildroot.delete()
-                        file_util.rmtree(self.bootstrap_buildroot.cachedir, selinux=self.bootstrap_buildroot.selinux)
+                        file_util.rmtree(self.bootstrap_buildroot.cachedir, selinux=self.bootstrap_buildroot.selinux,
+                                         parallel=True)
 
             except IOError as e:
                 getLog().warning("parts of chroot do not exist: %s", e)
@@ -200,6 +206,9 @@ class Commands(object):
             self.uid_manager.becomeUser(0, 0)
 
             deps = self.getPreconfiguredDeps(srpms)
+            if self._buildrequires_satisfied(srpms, deps):
+                return
+
             if deps:
                 self.buildroot.pkg_manager.install(*deps, check=True)
 
@@ -208,6 +217,41 @@ class Commands(object):
         finally:
             self.uid_manager.restorePrivs()
 
+    def _buildrequires_satisfied(self, srpms, deps):
+        """
+        Return True if all the BuildRequires of SRPMS and the additional DEPS
+        are already provided by the installed packages, so the package
+        manager doesn't need to be called at all.  Rich dependencies and
+        BuildConflicts are left to the package manager.
+        """
+        if not self.config['skip_satisfied_buildrequires']:
+            return False
+        requires = list(deps)
+        for hdr in util.yieldSrpmHeaders(srpms, plainRpmOk=1):
+            # pylint: disable=no-member
+            if hdr[rpm.RPMTAG_CONFLICTNAME]:
+                return False
+            srpm_requires = rpm.ds(hdr, "requires")
+            for i in range(len(srpm_requires)):  # pylint: disable=consider-using-enumerate
+                requirement = text._to_text(srpm_requires[i][2:])
+                if requirement.startswith("("):
+                    return False
+                if not requirement.startswith("rpmlib("):
+                    requires.append(requirement)
+
+        missing = self.buildroot.missing_provides(requires)
+        if missing is None:
+            self.buildroot.root_log.debug("Can not check the installed BuildRequires")
+            return False
+        if missing:
+            self.buildroot.root_log.debug("BuildRequires not installed yet: %s",
+                                          ", ".join(missing))
+            return False
+        self.buildroot.root_log.info(
+            "All %d BuildRequires are already installed, skipping %s builddep",
+            len(requires), self.buildroot.pkg_manager.name)
+        return True
+
     @traceLog()
     def installSpecDeps(self, spec_file):
         try:
@@ -281,7 +325,7 @@ class Commands(object):
             # times so that cases like #1652 are covered
             max_loops = int(self.config.get('static_buildrequires_max_loops'))
             for _ in range(max_loops):
-                packages_before = self.buildroot.all_chroot_packages()
+                rpmdb_before = self.buildroot.rpmdb_fingerprint()
                 rebuilt_srpm = self.rebuild_installed_srpm(spec_path, timeout)
 
                 # Check if we will have dynamic BuildRequires, but do not allow it
@@ -297,8 +341,7 @@ class Commands(object):
                 self.install_external(requires)
                 # Install the (static) BuildRequires
                 self.installSrpmDeps(rebuilt_srpm)
-                packages_after = self.buildroot.all_chroot_packages()
-                if packages_after == packages_before:
+                if self.buildroot.rpmdb_fingerprint() == rpmdb_before:
                     break
 
             self.state.finish(buildsetup)
@@ -443,7 +486,10 @@ class Commands(object):
                             bootstrap=buildroot.bootstrap_buildroot)
 
         with self.uid_manager:
-            util.createrepo(self.config, self.config['local_repo_dir'])
+            self._chain_createrepo()
+
+        if options.chain_jobs > 1:
+            return self._chain_parallel(args, options, local_baseurl)
 
         built_pkgs = []
         skipped_pkgs = []
@@ -496,6 +542,9 @@ class Commands(object):
                     log.warning(e.msg)
                     failed.append(pkg)
                 log.info("End chain build: %s", pkg_location)
+                if build_ret_code != 2:
+                    # the timings of this package into its resultdir
+                    self.buildroot.write_timings(reset=True)
 
                 with self.uid_manager:
                     if build_ret_code == 1:
@@ -511,7 +560,7 @@ class Commands(object):
                         built_pkgs.append(pkg)
                         file_util.touch(success_file)
                         # createrepo with the new pkgs
-                        util.createrepo(self.config, self.config['local_repo_dir'])
+                        self._chain_createrepo()
                     elif build_ret_code == 2:
                         log.info("Skipping already built pkg %s", os.path.basename(pkg))
                         skipped_pkgs.append(pkg)
@@ -535,7 +584,154 @@ class Commands(object):
                     return_code = 4
 
         FileDownloader.cleanup()
+        self._chain_summary(built_pkgs, skipped_pkgs, failed)
+        return return_code
+
+    @traceLog()
+    def _chain_parallel(self, args, options, local_baseurl):
+        """
+        Build the ARGS packages in up to options.chain_jobs parallel
+        'mock --rebuild' processes, each in its own --uniqueext buildroot.
+        Package is started as soon as all its BuildRequires (from within the
+        chain) landed in the local repository.
+        """
+        log = getLog()
+        built_pkgs = []
+        skipped_pkgs = []
+        unusable = []
+        return_code = 0
+
+        srpms = []
+        for pkg in args:
+            if not pkg.endswith('.rpm'):
+                log.error("%s doesn't appear to be an rpm - skipping", pkg)
+                unusable.append(pkg)
+                continue
+            with self.uid_manager:
+                local_pkg = FileDownloader.get(pkg)
+            if not local_pkg:
+                unusable.append(pkg)
+                continue
+            srpms.append(local_pkg)
+        failed = list(unusable)
+
+        scheduler = ChainScheduler.from_srpms(srpms)
+        for node in scheduler.nodes:
+            resultdir = self._chain_resultdir(node.pkg)
+            if os.path.exists(os.path.join(resultdir, 'success')):
+                log.info("Skipping already built pkg %s", os.path.basename(node.pkg))
+                skipped_pkgs.append(node.pkg)
+                scheduler.finish(node, True)
+            elif node.deps:
+                log.info("Package %s waits for: %s", node.name,
+                         ", ".join(sorted(dep.name for dep in node.deps)))
+
+        base_cmd = child_mock_command(sys.argv[1:], args)
+        free_slots = list(range(options.chain_jobs))
+        running = {}
+        num_of_tries = 1
+        round_built = 0
+
+        while not scheduler.done():
+            if not (failed and not options.cont):
+                for node in scheduler.ready():
+                    if not free_slots:
+                        break
+                    slot = free_slots.pop(0)
+                    running[node] = (self._chain_spawn(node, slot, base_cmd, local_baseurl), slot)
+                    scheduler.start(node)
+            elif not running:
+                log.error("Stopping the --chain build because --continue "
+                          "isn't specified and the package '%s' failed "
+                          "to build", failed[0])
+                break
+
+            node, returncode = self._chain_wait(running)
+            free_slots.append(running.pop(node)[1])
+            log.info("End chain build: %s", FileDownloader.original_name(node.pkg))
+            resultdir = self._chain_resultdir(node.pkg)
+            scheduler.finish(node, returncode == 0)
+            with self.uid_manager:
+                if returncode == 0:
+                    log.info("Success building %s", os.path.basename(node.pkg))
+                    built_pkgs.append(node.pkg)
+                    round_built += 1
+                    file_util.touch(os.path.join(resultdir, 'success'))
+                    # createrepo with the new pkgs
+                    self._chain_createrepo()
+                else:
+                    failed.append(node.pkg)
+                    log.info("Error building %s.", os.path.basename(node.pkg))
+                    if options.recurse:
+                        log.info("Will try to build again (if some other package will succeed).")
+                    else:
+                        log.info("See logs/results in %s", resultdir)
+                        file_util.touch(os.path.join(resultdir, 'fail'))
+
+            if scheduler.done() and scheduler.failed() and options.recurse:
+                if round_built:
+                    log.info('Some package succeeded, some failed.')
+                    log.info('Trying to rebuild %s failed pkgs, because --recurse is set.',
+                             len(scheduler.failed()))
+                    scheduler.retry_failed()
+                    failed = list(unusable)
+                    round_built = 0
+                    num_of_tries += 1
+                else:
+                    log.info("Tried %s times - following pkgs could not be successfully built:",
+                             num_of_tries)
+                    for pkg in failed:
+                        log.info(FileDownloader.original_name(pkg))
+
+        if failed:
+            return_code = 4
+
+        FileDownloader.cleanup()
+        self._chain_summary(built_pkgs, skipped_pkgs, failed)
+        return return_code
 
+    def _chain_createrepo(self):
+        """
+        Incrementally update the local repo metadata, keeping the checksum
+        cache across the chain, and publish them atomically so the builds
+        running in parallel never see incomplete metadata.
+        """
+        local_repo_dir = self.config['local_repo_dir']
+        util.createrepo(self.config, local_repo_dir, atomic=True,
+                        cachedir=os.path.join(local_repo_dir, '.createrepo-cache'))
+
+    def _chain_resultdir(self, pkg):
+        pdn = os.path.basename(pkg).replace('.src.rpm', '')
+        return os.path.join(self.config['local_repo_dir'], pdn)
+
+    @traceLog()
+    def _chain_spawn(self, node, slot, base_cmd, local_baseurl):
+        log = getLog()
+        resultdir = self._chain_resultdir(node.pkg)
+        with self.uid_manager:
+            file_util.mkdirIfAbsent(resultdir)
+            output = open(os.path.join(resultdir, 'chain.log'), 'w')
+        cmd = base_cmd + [
+            '--uniqueext', '{0}-{1}'.format(self.config['uniqueext'], slot),
+            '--resultdir', resultdir,
+            '--addrepo', local_baseurl,
+            '--rebuild', node.pkg,
+        ]
+        log.info("Start chain build: %s (slot %s)", FileDownloader.original_name(node.pkg), slot)
+        log.debug("Executing command: %s", cmd)
+        with output:
+            return subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=output,
+                                    stderr=subprocess.STDOUT)
+
+    @staticmethod
+    def _chain_wait(running):
+        """ Wait till any of the RUNNING child builds finishes """
+        processes = {process: node for node, (process, _) in running.items()}
+        process = util.wait_any(list(processes))
+        return processes[process], process.returncode
+
+    def _chain_summary(self, built_pkgs, skipped_pkgs, failed):
+        log = getLog()
         log.info("Results out to: %s", self.config['local_repo_dir'])
         if skipped_pkgs:
             log.info("Packages skipped: %s", len(skipped_pkgs))
@@ -550,7 +746,6 @@ class Commands(object):
                 log.info("Packages successfully built in this order:")
             for pkg in built_pkgs:
                 log.info(pkg)
-        return return_code
 
     #
     # UNPRIVILEGED:
@@ -747,43 +942,7 @@ class Commands(object):
         bd_out = self.make_chroot_path(self.buildroot.builddir)
         dynamic_buildrequires = dynamic_buildrequires and self.config.get('dynamic_buildrequires')
         if dynamic_buildrequires:
-            max_loops = int(self.config.get('dynamic_buildrequires_max_loops'))
-            success = False
-            br_mode = ['-br']
-            while not success and max_loops > 0:
-                # run rpmbuild+installSrpmDeps until
-                # * it fails
-                # * installSrpmDeps does nothing
-                # * or we run out of dynamic_buildrequires_max_loops tries
-                packages_before = self.buildroot.all_chroot_packages()
-                command = get_command(br_mode)
-                (output, returncode) = \
-                    self.buildroot.doChroot(command,
-                                            shell=False, logger=self.buildroot.build_log, timeout=timeout,
-                                            uid=self.buildroot.chrootuid, gid=self.buildroot.chrootgid,
-                                            user=self.buildroot.chrootuser,
-                                            unshare_net=self.private_network, raiseExc=False,
-                                            printOutput=self.config['print_main_output'])
-                if returncode > 0 and returncode != 11:
-                    # we treat exit status 11 as success, as well as exit
-                    # status 0, see issue#434
-                    raise BuildError("Command failed: \n # %s\n%s" % (command, output))
-                max_loops -= 1
-                self.buildroot.build_log.info("Dynamic buildrequires detected")
-                self.buildroot.build_log.info("Going to install missing buildrequires. See root.log for details.")
-                self.buildroot.root_log.info("Going to install missing dynamic buildrequires")
-                buildreqs = glob.glob(bd_out + '/SRPMS/*.buildreqs.nosrc.rpm')
-                self.installSrpmDeps(*buildreqs)
-                packages_after = self.buildroot.all_chroot_packages()
-                if packages_after == packages_before:
-                    success = True
-                for f_buildreqs in buildreqs:
-                    if not (success and calculatedeps):
-                        # we want to keep the nosrc.rpm file
-                        os.remove(f_buildreqs)
-                # The first rpmbuild -br already did %prep, so we don't need waste time
-                if '--noprep' not in br_mode:
-                    br_mode += ['--noprep']
+            self._resolve_dynamic_buildrequires(get_command, bd_out, timeout, calculatedeps)
             if not sc:
                 # We want to (re-)write src.rpm with dynamic BuildRequires,
                 # but with short-circuit it doesn't matter
@@ -818,6 +977,100 @@ class Commands(object):
         self.buildroot.final_rpm_list = [os.path.basename(result) for result in results]
         return results
 
+    @staticmethod
+    def _generated_buildrequires(buildreqs):
+        """
+        The set of requires in the BUILDREQS (.buildreqs.nosrc.rpm files),
+        None if they can not be read.
+        """
+        requires = set()
+        try:
+            for hdr in util.yieldSrpmHeaders(buildreqs, plainRpmOk=1):
+                # pylint: disable=no-member
+                hdr_requires = rpm.ds(hdr, "requires")
+                for i in range(len(hdr_requires)):  # pylint: disable=consider-using-enumerate
+                    requires.add(text._to_text(hdr_requires[i][2:]))
+        except Error:
+            return None
+        return requires
+
+    def _resolve_dynamic_buildrequires(self, get_command, bd_out, timeout, calculatedeps):
+        """
+        Run rpmbuild -br and install the generated BuildRequires until they
+        converge:
+        * the generated requires are the same (or a subset of) those
+          installed in the previous round, so the package manager is not
+          called at all,
+        * or installing them changed nothing in the rpmdb,
+        * or we run out of dynamic_buildrequires_max_loops tries.
+        Each round is recorded as a state, so it has its timing in
+        timings.json, and is summarized in build.log.
+        """
+        max_loops = int(self.config.get('dynamic_buildrequires_max_loops'))
+        br_mode = ['-br']
+        previous = None
+        success = False
+        for loop in range(1, max_loops + 1):
+            round_state = "dynamic buildrequires round {0}".format(loop)
+            self.state.start(round_state)
+            try:
+                start = time.monotonic()
+                command = get_command(br_mode)
+                (output, returncode) = \
+                    self.buildroot.doChroot(command,
+                                            shell=False, logger=self.buildroot.build_log, timeout=timeout,
+                                            uid=self.buildroot.chrootuid, gid=self.buildroot.chrootgid,
+                                            user=self.buildroot.chrootuser,
+                                            unshare_net=self.private_network, raiseExc=False,
+                                            printOutput=self.config['print_main_output'])
+                if returncode > 0 and returncode != 11:
+                    # we treat exit status 11 as success, as well as exit
+                    # status 0, see issue#434
+                    raise BuildError("Command failed: \n # %s\n%s" % (command, output))
+                rpmbuild_time = time.monotonic() - start
+
+                buildreqs = glob.glob(bd_out + '/SRPMS/*.buildreqs.nosrc.rpm')
+                generated = self._generated_buildrequires(buildreqs)
+                new = generated
+                if generated is not None and previous is not None:
+                    new = generated - previous
+
+                start = time.monotonic()
+                if previous is not None and generated is not None and not new:
+                    # all installed in the previous round
+                    success = True
+                else:
+                    self.buildroot.build_log.info("Dynamic buildrequires detected")
+                    self.buildroot.build_log.info("Going to install missing buildrequires. See root.log for details.")
+                    if new is not None and previous is not None:
+                        self.buildroot.root_log.info("New dynamic buildrequires: %s",
+                                                     ", ".join(sorted(new)))
+                    self.buildroot.root_log.info("Going to install missing dynamic buildrequires")
+                    rpmdb_before = self.buildroot.rpmdb_fingerprint()
+                    self.installSrpmDeps(*buildreqs)
+                    success = self.buildroot.rpmdb_fingerprint() == rpmdb_before
+                install_time = time.monotonic() - start
+                previous = generated
+
+                self.buildroot.build_log.info(
+                    "Dynamic buildrequires round %d: %s requires (%s new), "
+                    "rpmbuild -br %.1fs, install %.1fs%s", loop,
+                    "?" if generated is None else len(generated),
+                    "?" if new is None else len(new), rpmbuild_time, install_time,
+                    ", converged" if success else "")
+
+                for f_buildreqs in buildreqs:
+                    if not (success and calculatedeps):
+                        # we want to keep the nosrc.rpm file
+                        os.remove(f_buildreqs)
+            finally:
+                self.state.finish(round_state)
+            if success:
+                break
+            # The first rpmbuild -br already did %prep, so we don't need waste time
+            if '--noprep' not in br_mode:
+                br_mode += ['--noprep']
+
     @traceLog()
     def copy_build_results(self, results):
         self.buildroot.root_log.debug("Copying packages to result dir")
@@ -16,13 +16,18 @@ import tempfile
 import uuid
 from textwrap import dedent
 
+from . import caching_proxy
+from . import compressed_log
 from . import file_util
 from . import mounts
+from . import state as state_module
 from . import text
+from . import trash
 from . import uid
 from . import util
 from .exception import (BuildRootLocked, Error, ResultDirNotAccessible,
                         BadCmdline, BootstrapError, RootError)
+from .memoized_dictionary import MemoizedTemplatedDictionary
 from .package_manager import package_manager
 from .trace_decorator import getLog, traceLog
 from .podman import Podman, PodmanError
@@ -31,6 +36,9 @@ from .shadow_utils import ShadowUtils
 
 # pylint: disable=too-many-lines
 
+# rpmdb locations in chroot, see Buildroot.rpmdb_fingerprint()
+RPMDB_DIRS = ("var/lib/rpm", "usr/lib/sysimage/rpm")
+
 
 def noop_in_bootstrap(f):
     # pylint: disable=inconsistent-return-statements
@@ -107,6 +115,8 @@ class Buildroot(object):
         self.chrootgroup = config['chrootgroup']
         self.env = config['environment']
         self.env['HOME'] = self.homedir
+        if config['caching_proxy'] and not caching_proxy.ensure_running(config, self.uid_manager):
+            config['caching_proxy'] = False
         proxy_env = util.get_proxy_environment(config)
         self.env.update(proxy_env)
         os.environ.update(proxy_env)
@@ -128,6 +138,8 @@ class Buildroot(object):
         self.chroot_was_initialized = False
 
         self._homedir_bindmounts = {}
+        # (rpmdb_fingerprint(), all_chroot_packages()) of the last rpm -qa
+        self._chroot_packages = None
         additional_packages = [self.wrap_host_file(f) for f in
                                config["additional_packages"] or []]
 
@@ -365,8 +377,12 @@ class Buildroot(object):
                 update_state = "{0} update".format(self.pkg_manager.name)
                 self.state.start(update_state)
                 packages_before = self.all_chroot_packages()
+                rpmdb_before = self.rpmdb_fingerprint()
                 self.pkg_manager.update()
-                packages_after = self.all_chroot_packages()
+                # no transaction => no need to query the packages again
+                packages_after = packages_before
+                if rpmdb_before != self.rpmdb_fingerprint():
+                    packages_after = self.all_chroot_packages()
                 if packages_before != packages_after:
                     new_packages = "\n".join(packages_after - packages_before)
                     self.root_log.info("Calling postupdate hooks because there "
@@ -462,14 +478,70 @@ class Buildroot(object):
             returnOutput=returnOutput,
         )
 
+    def rpmdb_fingerprint(self):
+        """
+        Cheap fingerprint of the rpmdb in the buildroot (inode, size and
+        mtime of the database files), changed by every RPM transaction.  To
+        check if anything was (un)installed, compare the fingerprints taken
+        before and after instead of the all_chroot_packages() sets.  When
+        the rpmdb files are not found (non-default %_dbpath), the package set
+        is the fingerprint.
+        """
+        return self._rpmdb_stat() or frozenset(self.all_chroot_packages())
+
+    def _rpmdb_stat(self):
+        fingerprint = []
+        for dbdir in RPMDB_DIRS:
+            try:
+                with os.scandir(self.make_chroot_path(dbdir)) as it:
+                    for entry in it:
+                        # lock files and the BDB environment (nuke_rpm_db),
+                        # changed by mere reading
+                        if entry.name.startswith("__db") or \
+                                entry.name.endswith(("-shm", ".lock")):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        fingerprint.append((dbdir, entry.name, st.st_ino, st.st_size,
+                                            st.st_mtime_ns))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return tuple(sorted(fingerprint))
+
     def all_chroot_packages(self):
         """package set, result of rpm -qa in the buildroot"""
+        fingerprint = self._rpmdb_stat()
+        if self._chroot_packages and self._chroot_packages[0] == fingerprint:
+            return set(self._chroot_packages[1])
         self.nuke_rpm_db()
         command = [self.config['rpm_command'], "-qa",
                    "--root", self.make_chroot_path()]
         out, _ = self.doOutChroot(command, returnOutput=True, printOutput=False,
                                   shell=False)
-        return set(out.splitlines())
+        packages = set(out.splitlines())
+        if fingerprint:
+            self._chroot_packages = (fingerprint, frozenset(packages))
+        return packages
+
+    def missing_provides(self, requires):
+        """
+        Return the subset of REQUIRES (dependency strings like "foo >= 1.0"
+        or "/usr/bin/foo") not provided by the packages installed in the
+        buildroot, using one batched rpm -q --whatprovides query.  Return
+        None if the query failed.
+        """
+        if not requires:
+            return []
+        self.nuke_rpm_db()
+        command = [self.config['rpm_command'], "-q", "--whatprovides",
+                   "--root", self.make_chroot_path(), "--qf", "%{NAME}\n"]
+        command += requires
+        out, status = self.doOutChroot(command, returnOutput=True, printOutput=False,
+                                       shell=False, raiseExc=False)
+        prefix = "no package provides "
+        missing = [line[len(prefix):] for line in out.splitlines() if line.startswith(prefix)]
+        if status and not missing:
+            return None
+        return missing
 
     @traceLog()
     def _copy_config(self, filename, symlink=False, warn=True):
@@ -678,6 +750,11 @@ class Buildroot(object):
 
         self.create_resultdir()
 
+        compression = None
+        if self.config['plugin_conf']['compress_logs_enable']:
+            compress_opts = self.config['plugin_conf']['compress_logs_opts']
+            compression = compress_opts.get('stream')
+
         with self.uid_manager:
             # attach logs to log files.
             # This happens in addition to anything that
@@ -692,7 +769,18 @@ class Buildroot(object):
                         handler.close()
                         log.removeHandler(handler)
                 fullPath = os.path.join(self.resultdir, filename)
-                fh = logging.FileHandler(fullPath, "a+")
+                fh = None
+                if compression:
+                    try:
+                        fh = compressed_log.CompressedFileHandler(
+                            fullPath, compression,
+                            flush_interval=compress_opts.get('stream_flush_interval', 5))
+                    except ValueError as e:
+                        getLog().warning("Writing uncompressed logs: %s", e)
+                        # compressed after the build by the compress_logs plugin
+                        compression = compress_opts['stream'] = None
+                if fh is None:
+                    fh = logging.FileHandler(fullPath, "a+")
                 formatter = logging.Formatter(fmt_str)
                 fh.setFormatter(formatter)
                 fh.setLevel(logging.NOTSET)
@@ -1040,6 +1128,46 @@ class Buildroot(object):
                 pass
             finally:
                 self._unlock_buildroot()
+        if self.config['deferred_cleanup']:
+            # the old chroots left by the killed mock processes, or from
+            # before reboot
+            trash_dir = trash.trash_dir(self.basedir)
+            if trash.pending(trash_dir):
+                with self.uid_manager.elevated_privileges():
+                    trash.start_reaper(trash_dir, self.selinux)
+
+    @traceLog()
+    def write_timings(self, reset=False):
+        """
+        Write the per-phase timings and plugin hook statistics of this
+        buildroot (and its bootstrap), and the config template rendering
+        statistics into the result directory.  With RESET (after each
+        --chain package) only the finished phases are written, and the
+        statistics are started over for the next package.
+        """
+        if not self.config['write_timings'] or not os.path.isdir(self.resultdir):
+            return
+        buildroots = [self]
+        if self.bootstrap_buildroot is not None:
+            buildroots.append(self.bootstrap_buildroot)
+        try:
+            with self.uid_manager:
+                state_module.write_timings([buildroot.state for buildroot in buildroots],
+                                           self.resultdir, finished_only=reset)
+                self.plugins.write_hook_stats(self.resultdir)
+                if self.bootstrap_buildroot is not None:
+                    self.bootstrap_buildroot.plugins.write_hook_stats(
+                        self.resultdir, prefix="bootstrap-")
+                if isinstance(self.config, MemoizedTemplatedDictionary):
+                    self.config.write_render_stats(os.path.join(self.resultdir, "config-renders.json"))
+        except OSError as e:
+            getLog().warning("Can not write timings into %s: %s", self.resultdir, e)
+        if reset:
+            for buildroot in buildroots:
+                buildroot.state.drop_finished_timings()
+                buildroot.plugins.hook_stats.clear()
+            if isinstance(self.config, MemoizedTemplatedDictionary):
+                self.config.reset_render_stats()
 
     @traceLog()
     def wrap_host_file(self, filename):
@@ -1121,12 +1249,24 @@ class Buildroot(object):
             if subv:
                 util.do(["btrfs", "subv", "delete", "/" + subv])
             if not self.rootdir.startswith(self.basedir):
-                file_util.rmtree(self.rootdir, selinux=self.selinux)
-            file_util.rmtree(self.basedir, selinux=self.selinux)
+                self._remove_tree(self.rootdir)
+            self._remove_tree(self.basedir)
         self.chroot_was_initialized = False
         self.plugins.call_hooks('postclean')
         # intentionally we do not call bootstrap hook here - it does not have sense
 
+    def _remove_tree(self, path):
+        """
+        Remove the directory tree PATH, or with deferred_cleanup just move it
+        into the trash to be removed in background.
+        """
+        if self.config['deferred_cleanup']:
+            trash_dir = trash.move_to_trash(path)
+            if trash_dir:
+                trash.start_reaper(trash_dir, self.selinux)
+                return
+        file_util.rmtree(path, selinux=self.selinux, parallel=True)
+
     @property
     def uses_bootstrap_image(self):
         return self.is_bootstrap and self.use_chroot_image
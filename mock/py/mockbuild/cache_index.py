@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+Index of the files in a cache directory, with age and LRU size budget
+cleanup, used by the yum_cache plugin and by the caching proxy.
+"""
+
+import collections
+import errno
+import heapq
+import json
+import os
+import shutil
+import time
+
+from .trace_decorator import traceLog
+
+
+class CacheIndex:
+    """
+    Index of the files in the cache directory TOP, stored in the INDEX_FILE
+    (JSON).  For each directory it keeps the mtime, the subdirectories, and
+    the size, change time, last use time and inode of each file.  update()
+    only stat()s the indexed directories, and re-reads just those changed
+    since the last update; the files already indexed there are not stat()ed
+    again.
+
+    The last use time is the atime, so with the relatime mounts it is precise
+    to ~one day (good enough for LRU), and it is refreshed for the eviction
+    candidates before they are removed.  The LRU eviction removes whole units
+    (see unit()), and the hardlinked files are counted only once.
+    """
+
+    VERSION = 2
+
+    def __init__(self, top, index_file):
+        self.top = top
+        self.index_file = index_file
+        # relative dir => [mtime, [subdirs], {file name: [size, ctime, last used, inode]}]
+        self.dirs = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION or data.get("top") != self.top:
+            return
+        self.dirs = data["dirs"]
+
+    def save(self):
+        tmp = self.index_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": self.VERSION, "top": self.top, "dirs": self.dirs}, f,
+                      separators=(",", ":"))
+        os.replace(tmp, self.index_file)
+
+    @property
+    def files(self):
+        """ Relative path => [size, ctime, last used, inode] of all the indexed files """
+        return {os.path.normpath(os.path.join(reldir, name)): entry
+                for reldir, (_, _, files) in self.dirs.items()
+                for name, entry in files.items()}
+
+    @staticmethod
+    def _file_entry(st):
+        return [st.st_size, st.st_ctime, st.st_atime, st.st_ino]
+
+    @traceLog()
+    def update(self):
+        """ Re-read the directories changed since the last update """
+        dirs = {}
+        stack = ["."]
+        while stack:
+            reldir = stack.pop()
+            path = os.path.join(self.top, reldir)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                old = self.dirs.get(reldir)
+                if old is not None and old[0] == mtime:
+                    entry = old
+                else:
+                    entry = self._scan(path, mtime, old[2] if old else {})
+            except FileNotFoundError:
+                continue
+            dirs[reldir] = entry
+            stack += [os.path.normpath(os.path.join(reldir, name)) for name in entry[1]]
+        self.dirs = dirs
+
+    def _scan(self, path, mtime, old_files):
+        subdirs, files = [], {}
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif not entry.is_file(follow_symlinks=False):
+                    continue
+                elif entry.name in old_files and old_files[entry.name][3] == entry.inode():
+                    files[entry.name] = old_files[entry.name]
+                else:
+                    try:
+                        files[entry.name] = self._file_entry(entry.stat(follow_symlinks=False))
+                    except FileNotFoundError:
+                        continue
+        return [mtime, subdirs, files]
+
+    def size(self):
+        """ Total size of the indexed files, hardlinks counted once """
+        return sum({entry[3]: entry[0] for entry in self.files.values()}.values())
+
+    def unit(self, relpath):
+        """
+        The file or directory RELPATH is evicted with, the file itself by
+        default; None if it must not be evicted
+        """
+        return relpath
+
+    def _forget(self, relpath):
+        reldir, name = os.path.split(relpath)
+        return self.dirs.get(reldir or ".", (None, None, {}))[2].pop(name, None)
+
+    def remove(self, relpath):
+        """ Remove the file from cache, return its size """
+        entry = self._forget(relpath)
+        size = entry[0] if entry else 0
+        try:
+            os.unlink(os.path.join(self.top, relpath))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return size
+
+    def _remove_unit(self, unit, relpaths):
+        if unit not in self.dirs:
+            for relpath in relpaths:
+                self.remove(relpath)
+            return
+        try:
+            shutil.rmtree(os.path.join(self.top, unit))
+        except FileNotFoundError:
+            pass
+        for reldir in list(self.dirs):
+            if reldir == unit or reldir.startswith(unit + "/"):
+                del self.dirs[reldir]
+        parent, name = os.path.split(unit)
+        self.dirs[parent or "."][1].remove(name)
+
+    def _last_used(self, relpaths):
+        """ Refresh the index entries of RELPATHS, return their last use time """
+        last_used = None
+        for relpath in relpaths:
+            try:
+                entry = self._file_entry(os.stat(os.path.join(self.top, relpath)))
+            except FileNotFoundError:
+                self._forget(relpath)
+                continue
+            reldir, name = os.path.split(relpath)
+            self.dirs[reldir or "."][2][name] = entry
+            last_used = max(last_used or entry[2], entry[2])
+        return last_used
+
+    @traceLog()
+    def prune(self, max_age_days, max_metadata_age_days, metadata_exts, max_size=0):
+        """
+        Remove the files older than MAX_AGE_DAYS (metadata files older than
+        MAX_METADATA_AGE_DAYS), and then the least recently used units
+        until the cache fits into MAX_SIZE bytes (0 means no limit).
+        Return the number and the size of the removed files.
+        """
+        removed = freed = 0
+        now = time.time()
+        for relpath, (_, ctime, _, _) in self.files.items():
+            file_age_days = (now - ctime) / (60 * 60 * 24)
+            # prune repodata so yum redownloads.
+            # prevents certain errors where yum gets stuck due to bad metadata
+            if file_age_days > max_age_days or \
+                    (relpath.endswith(metadata_exts) and file_age_days > max_metadata_age_days):
+                freed += self.remove(relpath)
+                removed += 1
+
+        files = self.files
+        total = self.size()
+        if not max_size or total <= max_size:
+            return removed, freed
+
+        units = {}
+        for relpath in files:
+            unit = self.unit(relpath)
+            if unit is not None:
+                units.setdefault(unit, []).append(relpath)
+        links = collections.Counter(entry[3] for entry in files.values())
+        heap = [(max(files[relpath][2] for relpath in relpaths), unit)
+                for unit, relpaths in units.items()]
+        heapq.heapify(heap)
+        while heap and total > max_size:
+            used, unit = heapq.heappop(heap)
+            relpaths = units[unit]
+            last_used = self._last_used(relpaths)
+            if last_used is not None and last_used > used:
+                # used since the last update, re-queue
+                heapq.heappush(heap, (last_used, unit))
+                continue
+            if last_used is not None:
+                # otherwise removed by someone else meanwhile
+                self._remove_unit(unit, relpaths)
+                removed += len(relpaths)
+            for relpath in relpaths:
+                size, _, _, inode = files[relpath]
+                links[inode] -= 1
+                if not links[inode]:
+                    # the last link is gone
+                    total -= size
+                    freed += size if last_used is not None else 0
+        return removed, freed
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+Host-level caching HTTP proxy for the repository traffic.
+
+With config_opts['caching_proxy'] enabled, mock starts (or reuses an already
+running) proxy listening on 127.0.0.1:<caching_proxy_port>, and points the
+package managers to it through the http_proxy environment variable (see
+util.get_proxy_environment).  All the concurrent mock processes on the host
+then share one download of each package.
+
+The proxy runs as config_opts['caching_proxy_user'], and a listener on the
+port owned by any other user is never used - the build then downloads the
+packages directly.
+
+Only the packages and the repodata files with checksum in their names are
+cached; repomd.xml, metalinks and everything else is forwarded to the server
+on each request.  HTTPS traffic doesn't go through the proxy, so it is never
+cached.  Concurrent requests of the same URL are served by a single upstream
+fetch, Range requests are served from the cached file.  Before a cached
+package is served, the server is asked (HEAD) for its Content-Length and
+Last-Modified, and the cached copy is dropped if they differ (e.g. a package
+rebuilt with the same NVR).  When the cache exceeds the size budget
+(config_opts['caching_proxy_max_size']), the least recently used objects are
+evicted.
+
+The hit/miss statistics are available on http://127.0.0.1:<port>/stats.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pwd
+import re
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .cache_index import CacheIndex
+from .trace_decorator import getLog
+
+CACHEABLE = re.compile(r"^http://[^?#]*(\.d?rpm|/repodata/[0-9a-f]{32,}-[^/?#]+)$")
+
+# cached URLs revalidated on each hit, the others have checksum in the name
+REVALIDATED = re.compile(r"\.d?rpm$")
+
+FORWARDED_HEADERS = ("Content-Type", "Last-Modified", "ETag")
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# /proc/net/tcp state of a listening socket, and 127.0.0.1 as printed there
+_TCP_LISTEN = "0A"
+_LOCALHOST = struct.unpack("=I", socket.inet_aton("127.0.0.1"))[0]
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) inclusive byte range requested by the Range
+    HEADER for a file of SIZE, None for the full file (missing, unsupported
+    or multi-range header) and False when unsatisfiable.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # suffix range, the last END bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class _ObjectIndex(CacheIndex):
+    """ CacheIndex of the proxy objects, evicted together with their metadata """
+
+    def unit(self, relpath):
+        if relpath.endswith(".tmp"):
+            # being downloaded
+            return None
+        return relpath[:-len(".json")] if relpath.endswith(".json") else relpath
+
+
+class ProxyCache:
+    """
+    The on-disk cache of the proxy, and the statistics.  The least recently
+    used objects are evicted when the cache exceeds MAX_SIZE bytes (0 means
+    no limit).
+    """
+
+    def __init__(self, cache_dir, upstream=None, max_size=0):
+        self.cache_dir = cache_dir
+        handlers = [urllib.request.ProxyHandler({"http": upstream} if upstream else {})]
+        self.opener = urllib.request.build_opener(*handlers)
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "deduplicated": 0, "uncached": 0,
+                      "stale": 0, "evicted_files": 0, "errors": 0, "bytes_served": 0,
+                      "bytes_fetched": 0}
+        self.max_size = max_size
+        self.index = _ObjectIndex(os.path.join(cache_dir, "objects"),
+                                  os.path.join(cache_dir, "index.json"))
+        self._prune_lock = threading.Lock()
+        # pruned after the first fetch, then each max_size/10 bytes fetched
+        self._fetched = max_size
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def object_path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "objects", key[:2], key)
+
+    def lookup(self, url):
+        """ Return (path, metadata) of the cached URL, or None """
+        path = self.object_path(url)
+        try:
+            with open(path + ".json") as f:
+                return path, json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fetch(self, url):
+        path = self.object_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{0}.{1}.tmp".format(path, threading.get_ident())
+        try:
+            with self.opener.open(url, timeout=60) as response, open(tmp, "wb") as f:
+                shutil.copyfileobj(response, f, 1 << 20)
+                meta = {"url": url, "size": f.tell(),
+                        "headers": {key: response.headers[key] for key in FORWARDED_HEADERS
+                                    if response.headers[key]}}
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".json.tmp", path + ".json")
+        self.count("bytes_fetched", meta["size"])
+        self._fetched_bytes(meta["size"])
+        return path, meta
+
+    def _fetched_bytes(self, size):
+        if not self.max_size:
+            return
+        with self.lock:
+            self._fetched += size
+            if self._fetched < self.max_size // 10:
+                return
+            self._fetched = 0
+        threading.Thread(target=self.prune, daemon=True).start()
+
+    def prune(self):
+        """ Evict the least recently used objects to fit into max_size """
+        if not self._prune_lock.acquire(blocking=False):
+            # already pruning
+            return
+        try:
+            self.index.update()
+            removed, freed = self.index.prune(float("inf"), float("inf"), (), self.max_size)
+            self.index.save()
+            self.count("evicted_files", removed)
+            if removed:
+                getLog().info("evicted %s files (%s bytes) from the cache", removed, freed)
+        except OSError as e:
+            getLog().warning("can not prune the cache: %s", e)
+        finally:
+            self._prune_lock.release()
+
+    def _unchanged(self, url, meta):
+        """
+        Ask the server whether the cached URL with META is still the same
+        (Content-Length and Last-Modified); when it can't tell, it is
+        """
+        if not REVALIDATED.search(url):
+            return True
+        try:
+            with self.opener.open(urllib.request.Request(url, method="HEAD"),
+                                  timeout=10) as response:
+                headers = response.headers
+        except (OSError, urllib.error.URLError):
+            return True
+        length = headers.get("Content-Length")
+        if length is not None and length.isdigit() and int(length) != meta["size"]:
+            return False
+        modified = headers.get("Last-Modified")
+        cached_modified = meta["headers"].get("Last-Modified")
+        return not (modified and cached_modified and modified != cached_modified)
+
+    def drop(self, url):
+        """ Remove the cached URL """
+        path = self.object_path(url)
+        for name in (path + ".json", path):
+            try:
+                os.unlink(name)
+            except FileNotFoundError:
+                pass
+
+    def get(self, url):
+        """
+        Return (path, metadata, status) of the cached URL, downloading it
+        first if needed; the status is "HIT" or "MISS".  Concurrent calls for
+        the same URL wait for the first one to download it.
+        """
+        cached = self.lookup(url)
+        if cached and not self._unchanged(url, cached[1]):
+            self.drop(url)
+            self.count("stale")
+            cached = None
+        if cached:
+            self.count("hits")
+            return cached + ("HIT",)
+
+        with self.lock:
+            event = self.inflight.get(url)
+            owner = event is None
+            if owner:
+                event = self.inflight[url] = threading.Event()
+
+        if not owner:
+            event.wait()
+            cached = self.lookup(url)
+            if cached:
+                self.count("deduplicated")
+                return cached + ("HIT",)
+            # the first fetch failed, try on our own
+
+        try:
+            result = self._fetch(url)
+            self.count("misses")
+            return result + ("MISS",)
+        finally:
+            if owner:
+                with self.lock:
+                    del self.inflight[url]
+                event.set()
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        getLog().debug("%s: " + format, self.client_address[0], *args)
+
+    def _send(self, code, headers, body=b""):
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_cached(self, path, meta, status):
+        # opened first, the object might have been evicted meanwhile
+        with open(path, "rb") as f:
+            self._send_file(f, meta, status)
+
+    def _send_file(self, f, meta, status):
+        size = meta["size"]
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is False:
+            self._send(416, {"Content-Range": "bytes */{0}".format(size)})
+            return
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        for key, value in meta["headers"].items():
+            self.send_header(key, value)
+        if byte_range:
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, size))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("X-Cache", status)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+        self.server.cache.count("bytes_served", end - start + 1)
+
+    def _forward(self, url):
+        """ Pass the request to the server, without caching """
+        request = urllib.request.Request(url, method=self.command)
+        for key in ("Range", "If-Modified-Since", "If-None-Match", "Accept"):
+            if self.headers.get(key):
+                request.add_header(key, self.headers[key])
+        try:
+            response = self.server.cache.opener.open(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            response = e
+        with response:
+            body = response.read()
+            headers = {key: value for key, value in response.headers.items()
+                       if key.lower() not in ("connection", "transfer-encoding",
+                                              "content-length", "keep-alive")}
+            headers["X-Cache"] = "PASS"
+            self._send(response.getcode(), headers, body)
+        self.server.cache.count("uncached")
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        cache = self.server.cache
+        url = self.path
+        if url == "/stats":
+            with cache.lock:
+                body = json.dumps(cache.stats).encode()
+            self._send(200, {"Content-Type": "application/json"}, body)
+            return
+        if not url.startswith("http://"):
+            self._send(400, {}, b"only http:// proxy requests are supported\n")
+            return
+        try:
+            if not CACHEABLE.match(url):
+                self._forward(url)
+                return
+            self._send_cached(*cache.get(url))
+        except urllib.error.HTTPError as e:
+            cache.count("errors")
+            self._send(e.code, {}, str(e).encode())
+        except (OSError, urllib.error.URLError) as e:
+            if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                # client gone
+                return
+            cache.count("errors")
+            self._send(502, {}, str(e).encode())
+
+    do_HEAD = do_GET
+
+
+class CachingProxy(socketserver.ThreadingMixIn, HTTPServer):
+    """ The proxy server, serving the requests from CACHE """
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        self.cache = cache
+        super().__init__(address, _ProxyHandler)
+
+
+def proxy_url(config):
+    return "http://127.0.0.1:{0}/".format(config['caching_proxy_port'])
+
+
+def listener_uid(port):
+    """
+    Return the uid owning the socket listening on 127.0.0.1:PORT (according
+    to /proc/net/tcp), or None if there's no such listener.
+    """
+    with open("/proc/net/tcp") as f:
+        next(f)
+        for line in f:
+            fields = line.split()
+            address, local_port = fields[1].split(":")
+            if fields[3] != _TCP_LISTEN or int(local_port, 16) != port:
+                continue
+            if int(address, 16) in (0, _LOCALHOST):
+                return int(fields[7])
+    return None
+
+
+def is_running(port, uid, timeout=1):
+    """
+    Return True if the caching proxy owned by UID accepts the connections on
+    127.0.0.1:PORT.  A listener owned by anyone else is not trusted.
+    """
+    if listener_uid(port) != uid:
+        return False
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _start(config, user):
+    port = config['caching_proxy_port']
+    cache_dir = config['caching_proxy_dir']
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.stat(cache_dir).st_uid != user.pw_uid:
+        for path, dirs, files in os.walk(cache_dir):
+            for name in [path] + [os.path.join(path, entry) for entry in dirs + files]:
+                os.lchown(name, user.pw_uid, user.pw_gid)
+
+    env = dict(os.environ)
+    upstream = config.get('http_proxy') or os.getenv('http_proxy')
+    env.pop('http_proxy', None)
+    if upstream and upstream.rstrip("/") != proxy_url(config).rstrip("/"):
+        env['http_proxy'] = upstream
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def _become_user():
+        os.setgroups([])
+        os.setgid(user.pw_gid)
+        os.setuid(user.pw_uid)
+
+    with open(os.path.join(cache_dir, "proxy.log"), "a") as log:
+        os.fchown(log.fileno(), user.pw_uid, user.pw_gid)
+        # pylint: disable=subprocess-popen-preexec-fn
+        subprocess.Popen([sys.executable, "-m", "mockbuild.caching_proxy",
+                          "--port", str(port), "--cache-dir", cache_dir,
+                          "--max-size", str(config['caching_proxy_max_size'])],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log, env=env,
+                         start_new_session=True, preexec_fn=_become_user)
+    for _ in range(50):
+        if is_running(port, user.pw_uid, timeout=0.1):
+            getLog().info("started caching proxy on %s", proxy_url(config))
+            return True
+        time.sleep(0.1)
+    getLog().warning("caching proxy did not start, see %s",
+                     os.path.join(cache_dir, "proxy.log"))
+    return False
+
+
+def ensure_running(config, uid_manager):
+    """
+    Start the caching proxy for CONFIG in background, unless it is already
+    running.  The proxy always runs as config_opts['caching_proxy_user'], no
+    matter who started it, and forwards the requests to the configured
+    http_proxy (if any).  Return False if the proxy is not available, and the
+    packages should be downloaded directly.
+    """
+    log = getLog()
+    port = config['caching_proxy_port']
+    try:
+        user = pwd.getpwnam(config['caching_proxy_user'])
+        owner = listener_uid(port)
+        if owner is not None:
+            if owner != user.pw_uid:
+                log.warning("127.0.0.1:%s is not owned by the caching proxy user %s, not using it",
+                            port, user.pw_name)
+                return False
+            if is_running(port, user.pw_uid):
+                return True
+        with uid_manager.elevated_privileges():
+            return _start(config, user)
+    except (KeyError, OSError) as e:
+        log.warning("caching proxy not available, downloading directly: %s", e)
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="mockbuild.caching_proxy", description=__doc__)
+    parser.add_argument("--port", type=int, default=3129)
+    parser.add_argument("--cache-dir", required=True)
+    parser.add_argument("--max-size", type=int, default=0)
+    args = parser.parse_args()
+    server = CachingProxy(("127.0.0.1", args.port),
+                          ProxyCache(args.cache_dir, os.environ.get("http_proxy"), args.max_size))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+Dependency-aware scheduling of the `mock --chain` builds.
+
+The SRPM headers only tell us the BuildRequires and the name of the source
+package, not the list of binary packages it is going to produce.  We therefore
+approximate the provides of each SRPM by its name: a BuildRequire 'foo' or
+'foo-devel' is satisfied by the SRPM 'foo' (the longest matching SRPM name
+wins).  Edges we miss are still handled by the --recurse retry loop.
+"""
+
+import os
+import sys
+
+from . import util
+from .trace_decorator import traceLog
+
+# options of the parent 'mock --chain' process which must not be passed down
+# to the per-package 'mock --rebuild' processes;  value is True if the option
+# takes an argument
+_CHAIN_ONLY_OPTIONS = {
+    '--chain': False,
+    '--chain-jobs': True,
+    '-c': False,
+    '--continue': False,
+    '--recurse': False,
+    '--localrepo': True,
+    '--tmp_prefix': True,
+    '--resultdir': True,
+    '--uniqueext': True,
+}
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class ChainNode:
+    """ One SRPM in the chain build """
+
+    def __init__(self, pkg, name, buildrequires):
+        self.pkg = pkg
+        self.name = name
+        self.buildrequires = set(buildrequires)
+        self.deps = set()
+        self.state = PENDING
+
+    def __repr__(self):
+        return "<ChainNode {0} {1}>".format(self.name, self.state)
+
+
+class ChainScheduler:
+    """
+    Keep the dependency DAG of the SRPMs and hand out the packages which can be
+    built right now - those whose build dependencies (from within the chain)
+    already landed in the local repository (or definitely failed).
+    """
+
+    def __init__(self):
+        self.nodes = []
+
+    def add(self, pkg, name, buildrequires):
+        """ Add SRPM PKG named NAME, requiring BUILDREQUIRES """
+        node = ChainNode(pkg, name, buildrequires)
+        self.nodes.append(node)
+        return node
+
+    @classmethod
+    @traceLog()
+    def from_srpms(cls, srpms):
+        """ Create the scheduler from the SRPM headers """
+        # pylint: disable=import-outside-toplevel
+        import rpm
+        scheduler = cls()
+        for srpm, hdr in zip(srpms, util.yieldSrpmHeaders(srpms)):
+            name = hdr[rpm.RPMTAG_NAME]
+            requires = hdr[rpm.RPMTAG_REQUIRENAME] or []
+            scheduler.add(srpm, _to_str(name), [_to_str(r) for r in requires])
+        scheduler.resolve()
+        return scheduler
+
+    def _provider(self, requirement):
+        best = None
+        for node in self.nodes:
+            if requirement == node.name or requirement.startswith(node.name + '-'):
+                if best is None or len(node.name) > len(best.name):
+                    best = node
+        return best
+
+    def resolve(self):
+        """ Calculate the dependency edges between the added nodes """
+        for node in self.nodes:
+            node.deps = set()
+            for requirement in node.buildrequires:
+                provider = self._provider(requirement)
+                if provider is not None and provider is not node:
+                    node.deps.add(provider)
+
+    def _blocked(self, node):
+        return any(dep.state in (PENDING, RUNNING) for dep in node.deps)
+
+    def ready(self):
+        """
+        Return the list of pending nodes which can be started, in the order
+        given by user.  If nothing runs and nothing is ready (dependency
+        cycle), the first pending node is released to break the cycle.
+        """
+        pending = [node for node in self.nodes if node.state == PENDING]
+        ready = [node for node in pending if not self._blocked(node)]
+        if not ready and pending and not self.running():
+            ready = pending[:1]
+        return ready
+
+    def running(self):
+        """ Return the list of nodes being built now """
+        return [node for node in self.nodes if node.state == RUNNING]
+
+    def failed(self):
+        """ Return the list of nodes which failed to build """
+        return [node for node in self.nodes if node.state == FAILED]
+
+    def start(self, node):
+        """ Mark NODE as being built """
+        node.state = RUNNING
+
+    def finish(self, node, success):
+        """ Mark NODE as built (successfully or not) """
+        node.state = SUCCEEDED if success else FAILED
+
+    def retry_failed(self):
+        """ Move the failed nodes back to the pending state """
+        for node in self.failed():
+            node.state = PENDING
+
+    def done(self):
+        """ True if there's nothing to build, and nothing is being built """
+        return all(node.state in (SUCCEEDED, FAILED) for node in self.nodes)
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def child_mock_command(argv, srpms):
+    """
+    Transform the 'mock --chain' command line ARGV (without the program name)
+    into a command line usable for the per-package 'mock --rebuild' processes
+    (dropping the chain-only options and the list of SRPMS).
+    """
+    to_drop = list(srpms)
+    result = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+            continue
+        option = arg.split('=', 1)[0]
+        if option in _CHAIN_ONLY_OPTIONS:
+            skip_next = _CHAIN_ONLY_OPTIONS[option] and '=' not in arg
+            continue
+        if arg in to_drop:
+            to_drop.remove(arg)
+            continue
+        result.append(arg)
+    return [sys.executable, os.path.abspath(sys.argv[0])] + result
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+Log handler writing compressed log files directly (the 'stream' option of
+the compress_logs plugin), so the multi-GB build.log is never written to
+disk uncompressed and re-read by the post-build compression.
+
+The records are buffered, and at each flush point (the buffer is full, or
+the flush interval elapsed) compressed as a separate gzip member, xz stream
+or zstd frame appended to the file.  Concatenated members are a valid
+compressed file for zcat/xzcat/zstdcat, so the log is readable up to the
+last flush point even if mock is killed.
+"""
+
+import gzip
+import logging
+import lzma
+import subprocess
+import threading
+import time
+import weakref
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+
+def _zstd_compress(data):
+    if zstd is not None:
+        return zstd.compress(data)
+    return subprocess.run(["zstd", "-q", "-c"], input=data, stdout=subprocess.PIPE,
+                          check=True).stdout
+
+
+# compression => (file suffix, function compressing the bytes)
+COMPRESSORS = {
+    "gzip": (".gz", gzip.compress),
+    "xz": (".xz", lzma.compress),
+    "zstd": (".zst", _zstd_compress),
+}
+
+# the handlers flushed periodically by the background thread
+_HANDLERS = weakref.WeakSet()
+_FLUSHER = None
+_FLUSHER_LOCK = threading.Lock()
+
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        for handler in list(_HANDLERS):
+            try:
+                handler.flush(only_expired=True)
+            except Exception:  # pylint: disable=broad-except
+                # the records stay buffered, and are retried at the next
+                # flush point (or reported by close())
+                pass
+
+
+def _start_flusher(interval):
+    global _FLUSHER  # pylint: disable=global-statement
+    with _FLUSHER_LOCK:
+        if _FLUSHER is None:
+            _FLUSHER = threading.Thread(target=_flush_loop, args=(interval,),
+                                        name="compressed-log-flusher", daemon=True)
+            _FLUSHER.start()
+
+
+class CompressedFileHandler(logging.Handler):
+    """
+    Append the records to FILENAME + the COMPRESSION suffix (e.g.
+    build.log.xz), compressed at the flush points: each FLUSH_SIZE bytes of
+    log, and at latest FLUSH_INTERVAL seconds after the last flush point.
+    ValueError is raised if the COMPRESSION is not available.
+    """
+
+    def __init__(self, filename, compression, flush_interval=5, flush_size=1 << 20):
+        super().__init__()
+        if compression not in COMPRESSORS:
+            raise ValueError("unsupported log compression: {0}".format(compression))
+        suffix, self._compress = COMPRESSORS[compression]
+        try:
+            self._compress(b"")
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise ValueError("{0} log compression not available: {1}".format(compression, e))
+        self.baseFilename = filename + suffix
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.stream = open(self.baseFilename, "ab")
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        _HANDLERS.add(self)
+        _start_flusher(max(flush_interval / 2, 0.1))
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + "\n").encode("utf-8", "replace")
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.flush_size:
+                self._write()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def _write(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer or self.stream is None:
+            return
+        data = self._compress(b"".join(self._buffer))
+        # dropped only once compressed, a failed flush is retried later
+        self._buffer = []
+        self._buffered = 0
+        self.stream.write(data)
+        self.stream.flush()
+
+    def flush(self, only_expired=False):
+        """ Write the buffered records (if older than flush_interval, with ONLY_EXPIRED) """
+        with self.lock:
+            if only_expired and time.monotonic() - self._last_flush < self.flush_interval:
+                return
+            self._write()
+
+    def close(self):
+        with self.lock:
+            try:
+                self._write()
+            except Exception:  # pylint: disable=broad-except
+                self.handleError(None)
+            finally:
+                if self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+                _HANDLERS.discard(self)
+                super().close()
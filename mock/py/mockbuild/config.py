@@ -4,26 +4,30 @@
 
 from __future__ import print_function
 
+import ast
 from ast import literal_eval
 from glob import glob
+import hashlib
 import json
 import grp
 import logging
 import os
 import os.path
+import pickle
 import pwd
 import re
 import shlex
 import socket
 import sys
+import tempfile
 import uuid
 import warnings
 
-from templated_dictionary import TemplatedDictionary
 from . import exception
 from . import text
 from .constants import MOCKCONFDIR, PKGPYTHONDIR, VERSION
 from .file_util import is_in_dir
+from .memoized_dictionary import MemoizedTemplatedDictionary
 from .trace_decorator import getLog, traceLog
 from .uid import getresuid, getresgid
 from .util import set_use_nspawn, setup_operations_timeout
@@ -64,7 +68,7 @@ def setup_default_config_opts():
 
     alt_opts["dnf4_system_command"].append("system_dnf_command")
 
-    config_opts = TemplatedDictionary(alias_spec=alt_opts)
+    config_opts = MemoizedTemplatedDictionary(alias_spec=alt_opts)
 
     config_opts['config_paths'] = []
     config_opts['version'] = VERSION
@@ -170,12 +174,21 @@ def setup_default_config_opts():
         'yum_cache_opts': {
             'max_age_days': 30,
             'max_metadata_age_days': 30,
+            'max_size': 0,
+            'rpm_pool': False,
+            'rpm_pool_dir': "{{cache_topdir}}/rpm_pool/",
             'online': True},
         'root_cache_enable': True,
         'root_cache_opts': {
             'age_check': True,
             'max_age_days': 15,
             'dir': "{{cache_topdir}}/{{root}}/root_cache/",
+            'format': 'tar',
+            'zstd_threads': 0,
+            'zstd_level': 3,
+            'store_dir': "{{cache_topdir}}/root_cache_store/",
+            'store_link_mode': 'auto',
+            'clone_link_mode': 'auto',
             'compress_program': 'pigz',
             'decompress_program': None,
             'exclude_dirs': ["./proc", "./sys", "./dev", "./tmp/ccache", "./var/cache/yum", "./var/cache/dnf",
@@ -222,6 +235,7 @@ def setup_default_config_opts():
             ],
             'only_failed': True,
             'write_tar': False,
+            'include_roots': ['/'],
         },
         'sign_enable': False,
         'sign_opts': {
@@ -240,6 +254,8 @@ def setup_default_config_opts():
         'compress_logs_enable': False,
         'compress_logs_opts': {
             'command': 'gzip',
+            'stream': None,
+            'stream_flush_interval': 5,
         },
         'rpkg_preprocessor_enable': False,
         'rpkg_preprocessor_opts': {
@@ -409,6 +425,15 @@ def setup_default_config_opts():
     config_opts['opstimeout'] = 0
 
     config_opts['stderr_line_prefix'] = ""
+    config_opts['caching_proxy'] = False
+    config_opts['caching_proxy_port'] = 3129
+    config_opts['caching_proxy_dir'] = "{{cache_topdir}}/caching_proxy"
+    config_opts['caching_proxy_user'] = "nobody"
+    config_opts['caching_proxy_max_size'] = 10 * 1024 ** 3
+    config_opts['deferred_cleanup'] = False
+    config_opts['skip_satisfied_buildrequires'] = True
+    config_opts['write_timings'] = False
+    config_opts['profile_hooks'] = False
 
     # Packages from this option are baked into the root-cache tarball.
     config_opts['chroot_additional_packages'] = []
@@ -1031,8 +1056,131 @@ def simple_load_config(name, config_path=None):
     return load_config(config_path, name)
 
 
+# bump when the format of the cached configs changes
+CONFIG_CACHE_VERSION = 2
+
+# options set by setup_default_config_opts() differently for each run
+_VOLATILE_DEFAULTS = ('mock_run_uuid',)
+
+# calls allowed in the configs which can be cached
+_STATIC_CALLS = {'include', 'len', 'str', 'int', 'bool', 'dict', 'list', 'tuple', 'set',
+                 'sorted', 'min', 'max', 'range', 'format', 'sum', 'any', 'all', 'zip'}
+
+
+def _config_cache_dir():
+    return os.path.join(os.path.expanduser('~' + pwd.getpwuid(os.getuid())[0]),
+                        ".cache", "mock", "configs")
+
+
+def _file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _is_static_config(content):
+    """
+    True if the config file CONTENT only assigns constant-like values into
+    config_opts, so the result of exec() depends on nothing else than the
+    file content (no imports, no os.environ, no os.path.exists(), ...).
+    """
+    try:
+        tree = ast.parse(content)
+    except SyntaxError:
+        return False
+    stored = {'config_opts', 'include'}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            stored.add(node.id)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.Lambda,
+                             ast.ClassDef, ast.Global, ast.Nonlocal)):
+            return False
+        if isinstance(node, ast.Name) and node.id not in stored | _STATIC_CALLS:
+            return False
+        if isinstance(node, ast.Call):
+            func = node.func
+            while isinstance(func, (ast.Attribute, ast.Subscript)):
+                func = func.value
+            # method of a config option, of a constant, or a harmless builtin
+            if isinstance(func, ast.Name) and func.id not in stored | _STATIC_CALLS:
+                return False
+    return True
+
+
+def _config_cache_key(config_opts, candidates):
+    """
+    The cache key: the default options (mock version, host, uid, ...), and
+    which of the CANDIDATES config files exist, and where they point to (the
+    cached digests are stored for the resolved paths, so e.g. a retargeted
+    default.cfg symlink must change the key)
+    """
+    defaults = {key: value for key, value in config_opts.items()
+                if key not in _VOLATILE_DEFAULTS}
+
+    def _json_default(obj):
+        if isinstance(obj, (set, frozenset)):
+            return sorted(repr(item) for item in obj)
+        return repr(obj)
+
+    data = json.dumps([CONFIG_CACHE_VERSION, os.getuid(), sys.version, defaults,
+                       [(path, os.path.exists(path) and os.path.realpath(path))
+                        for path in candidates]],
+                      sort_keys=True, default=_json_default)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _load_cached_config(cache_file, config_opts):
+    """
+    Return the config stored in CACHE_FILE if none of the files it was
+    loaded from changed, or None
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            cached = pickle.load(f)
+        for path, digest in cached["files"].items():
+            if _file_digest(path) != digest:
+                return None
+    except Exception:  # pylint: disable=broad-except
+        # missing or corrupted cache file, changed TemplatedDictionary class, ...
+        return None
+    result = cached["config"]
+    for key in _VOLATILE_DEFAULTS:
+        result[key] = config_opts[key]
+    return result
+
+
+def _store_cached_config(cache_file, config_opts):
+    """
+    Store the loaded CONFIG_OPTS into CACHE_FILE, if all the config files
+    it was loaded from are static (see _is_static_config)
+    """
+    files = {}
+    try:
+        for path in config_opts['config_paths']:
+            with open(path, "rb") as f:
+                content = f.read()
+            if not _is_static_config(content):
+                getLog().debug("config %s is not cacheable", path)
+                return
+            files[path] = hashlib.sha256(content).hexdigest()
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_file), delete=False) as f:
+            pickle.dump({"files": files, "config": config_opts}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, cache_file)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+        getLog().debug("can not cache the config: %s", e)
+
+
 @traceLog()
 def load_config(config_path, name):
+    """
+    Load the config NAME (from CONFIG_PATH).  When the MOCK_CONFIG_CACHE
+    environment variable is not "0", the evaluated configuration is cached
+    in ~/.cache/mock/configs/ and re-used while none of the config files
+    changes (the cache is only used for the configs which don't run any
+    code, e.g. don't read environment, see _is_static_config).
+    """
     log = logging.getLogger()
     config_opts = setup_default_config_opts()
 
@@ -1058,24 +1206,39 @@ def load_config(config_path, name):
             chroot_cfg_path = '%s/%s.cfg' % (config_path, name)
     config_opts['config_file'] = chroot_cfg_path
 
+    user_home = os.path.expanduser('~' + pwd.getpwuid(os.getuid())[0])
+    global_cfgs = [os.path.join(config_path, "site-defaults.cfg"),
+                   os.path.join(config_path, "chroot-aliases.cfg")]
+    user_cfgs = [os.path.join(user_home, '.mock/user.cfg'),
+                 os.path.join(user_home, '.config/mock.cfg')]
+
+    cache_file = None
+    if os.environ.get("MOCK_CONFIG_CACHE", "1") != "0":
+        key = _config_cache_key(config_opts, global_cfgs + [chroot_cfg_path] + user_cfgs)
+        cache_file = os.path.join(_config_cache_dir(), key + ".pickle")
+        cached = _load_cached_config(cache_file, config_opts)
+        if cached is not None:
+            log.debug("Using cached configuration %s", cache_file)
+            return _finish_config(log, cached)
+
     # load the global config files
-    for cfg_file in [
-        os.path.join(config_path, "site-defaults.cfg"),
-        os.path.join(config_path, "chroot-aliases.cfg"),
-    ]:
+    for cfg_file in global_cfgs:
         do_update_config(log, config_opts, cfg_file, name)
 
     # load the "chroot" specific config (-r option)
     do_update_config(log, config_opts, chroot_cfg_path, name, skipError=False)
 
     # Read user specific config file
-    cfg = os.path.join(os.path.expanduser(
-        '~' + pwd.getpwuid(os.getuid())[0]), '.mock/user.cfg')
-    do_update_config(log, config_opts, cfg, name)
-    cfg = os.path.join(os.path.expanduser(
-        '~' + pwd.getpwuid(os.getuid())[0]), '.config/mock.cfg')
-    do_update_config(log, config_opts, cfg, name)
+    for cfg_file in user_cfgs:
+        do_update_config(log, config_opts, cfg_file, name)
+
+    if cache_file:
+        _store_cached_config(cache_file, config_opts)
+    return _finish_config(log, config_opts)
+
 
+def _finish_config(log, config_opts):
+    """ The last steps of load_config(), done also for the cached configs """
     if config_opts['use_container_host_hostname'] and '%_buildhost' not in config_opts['macros']:
         config_opts['macros']['%_buildhost'] = socket.getfqdn()
 
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+The 'mockd' service - a pool of warm, pre-initialized buildroots.
+
+For each configured chroot, mockd keeps POOL_SIZE buildroots (separated by
+--uniqueext), initialized in advance and snapshotted right after the
+initialization (this requires a snapshot-capable plugin, like overlayfs or
+lvm_root).  Builds are requested over a local UNIX socket, and each request
+gets a buildroot which was already rolled back to its post-init snapshot.
+After the build, the buildroot is rolled back again in background.
+
+Without snapshot support the pool still serializes the builds per slot, but
+each build cleans and initializes its buildroot as a normal mock run would.
+
+The protocol is one JSON object per line; requests:
+
+    {"command": "build", "config": "fedora-rawhide-x86_64",
+     "srpm": "/abs/path.src.rpm", "resultdir": "/abs/dir", "mock_args": []}
+    {"command": "status"}
+
+and the replies:
+
+    {"returncode": 0, "slot": "mockd-0", "elapsed": 12.3}
+    {"pools": {"fedora-rawhide-x86_64": {"mockd-0": "ready", ...}}}
+
+Only the user running mockd (and root) may connect, the builds run with the
+mockd user's rights.  The "mock_args" are limited to ALLOWED_MOCK_OPTIONS.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import subprocess
+import threading
+import time
+
+from . import exception
+from .trace_decorator import getLog
+
+SNAPSHOT_NAME = "mockd-postinit"
+
+WARMING = "warming"
+READY = "ready"
+BUSY = "busy"
+RESETTING = "resetting"
+BROKEN = "broken"
+
+# mock options accepted in the build requests => whether they take a value
+ALLOWED_MOCK_OPTIONS = {
+    "--with": True,
+    "--without": True,
+    "--define": True,
+    "--nocheck": False,
+}
+
+
+def check_mock_args(mock_args):
+    """ Raise ValueError unless all MOCK_ARGS are in ALLOWED_MOCK_OPTIONS """
+    if not isinstance(mock_args, list) or not all(isinstance(arg, str) for arg in mock_args):
+        raise ValueError("mock_args must be a list of strings")
+    args = iter(mock_args)
+    for arg in args:
+        option, has_value, _ = arg.partition("=")
+        if option not in ALLOWED_MOCK_OPTIONS or has_value and not ALLOWED_MOCK_OPTIONS[option]:
+            raise ValueError("mock option not allowed: " + arg)
+        if ALLOWED_MOCK_OPTIONS[option] and not has_value and next(args, None) is None:
+            raise ValueError("mock option requires a value: " + arg)
+    return mock_args
+
+
+class Slot:
+    """ One buildroot of the pool """
+
+    def __init__(self, uniqueext):
+        self.uniqueext = uniqueext
+        self.state = WARMING
+        self.snapshot = False
+
+
+class BuildrootPool:
+    """ Pool of warm buildroots for one CONFIG """
+
+    def __init__(self, config, size, mock_command=("mock",)):
+        self.config = config
+        self.mock_command = list(mock_command)
+        self.slots = [Slot("mockd-{0}".format(i)) for i in range(size)]
+        self.cond = threading.Condition()
+        self.log = getLog("mockbuild.daemon")
+
+    def _mock(self, slot, *args):
+        cmd = self.mock_command + ["-r", self.config, "--uniqueext", slot.uniqueext] + list(args)
+        self.log.debug("Executing: %s", cmd)
+        return subprocess.call(cmd, stdin=subprocess.DEVNULL)
+
+    def _set_state(self, slot, state):
+        with self.cond:
+            slot.state = state
+            self.cond.notify_all()
+
+    def _background(self, target, slot):
+        try:
+            target(slot)
+        except Exception:  # pylint: disable=broad-except
+            self.log.exception("%s: %s failed", self.config, slot.uniqueext)
+            self._set_state(slot, BROKEN)
+
+    def _warm(self, slot):
+        if self._mock(slot, "--init") != 0:
+            self.log.error("%s: can not initialize %s", self.config, slot.uniqueext)
+            self._set_state(slot, BROKEN)
+            return
+        slot.snapshot = self._mock(slot, "--snapshot", SNAPSHOT_NAME) == 0
+        if not slot.snapshot:
+            self.log.warning("%s: snapshots not supported, %s will be cleaned by each build",
+                             self.config, slot.uniqueext)
+        self._set_state(slot, READY)
+
+    def _reset(self, slot):
+        if slot.snapshot and self._mock(slot, "--rollback-to", SNAPSHOT_NAME) == 0:
+            self._set_state(slot, READY)
+            return
+        if slot.snapshot:
+            self.log.warning("%s: rollback of %s failed, re-initializing",
+                             self.config, slot.uniqueext)
+            self._mock(slot, "--remove-snapshot", SNAPSHOT_NAME)
+            self._mock(slot, "--scrub", "chroot")
+        self._warm(slot)
+
+    def start(self):
+        """ Initialize all the buildroots, in background """
+        for slot in self.slots:
+            threading.Thread(target=self._background, args=(self._warm, slot), daemon=True).start()
+
+    def acquire(self):
+        """ Wait for a ready buildroot """
+        with self.cond:
+            while True:
+                for slot in self.slots:
+                    if slot.state == READY:
+                        slot.state = BUSY
+                        return slot
+                if all(slot.state == BROKEN for slot in self.slots):
+                    return None
+                self.cond.wait()
+
+    def release(self, slot):
+        """ Roll the SLOT back to the post-init snapshot, in background """
+        self._set_state(slot, RESETTING)
+        threading.Thread(target=self._background, args=(self._reset, slot), daemon=True).start()
+
+    def build(self, srpm, resultdir, mock_args=()):
+        """ Rebuild SRPM in a warm buildroot, return the reply dict """
+        start = time.time()
+        slot = self.acquire()
+        if slot is None:
+            return {"returncode": 1, "error": "no usable buildroot for " + self.config}
+        try:
+            args = ["--resultdir", resultdir] + list(mock_args)
+            if slot.snapshot:
+                # already rolled back, don't clean (nor unpack the cache)
+                args += ["--no-clean", "--no-cleanup-after"]
+            returncode = self._mock(slot, "--rebuild", srpm, *args)
+        finally:
+            self.release(slot)
+        return {"returncode": returncode, "slot": slot.uniqueext,
+                "elapsed": time.time() - start}
+
+    def status(self):
+        with self.cond:
+            return {slot.uniqueext: slot.state for slot in self.slots}
+
+
+def _peer_uid(sock):
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, reply):
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        uid = _peer_uid(self.request)
+        if uid not in (0, os.getuid()):
+            getLog("mockbuild.daemon").warning("refused connection from uid %s", uid)
+            # read the request first, so the client doesn't get EPIPE instead of the reply
+            self.request.settimeout(5)
+            try:
+                self.rfile.readline()
+                self._reply({"returncode": 1, "error": "permission denied"})
+            except OSError:
+                pass
+            return
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                reply = self.server.dispatch(request)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                reply = {"returncode": 1, "error": "invalid request: {0}".format(e)}
+            except Exception as e:  # pylint: disable=broad-except
+                getLog("mockbuild.daemon").exception("request failed: %s", line)
+                reply = {"returncode": 1, "error": "request failed: {0}".format(e)}
+            self._reply(reply)
+
+
+def _check_socket_dir(socket_path):
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    st = os.stat(directory)
+    if st.st_uid not in (0, os.getuid()) or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise exception.Error("mockd socket directory {0} is writable by other users, "
+                              "use e.g. $XDG_RUNTIME_DIR".format(directory))
+
+
+class MockDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serve the build requests on a local UNIX socket """
+    daemon_threads = True
+
+    def __init__(self, socket_path, pools):
+        self.pools = pools
+        _check_socket_dir(socket_path)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+    def dispatch(self, request):
+        command = request.get("command", "build")
+        if command == "status":
+            return {"pools": {name: pool.status() for name, pool in self.pools.items()}}
+        if command != "build":
+            return {"returncode": 1, "error": "unknown command: " + command}
+        pool = self.pools.get(request["config"])
+        if pool is None:
+            return {"returncode": 1, "error": "config not served: " + request["config"]}
+        return pool.build(os.path.abspath(request["srpm"]),
+                          os.path.abspath(request["resultdir"]),
+                          check_mock_args(request.get("mock_args", [])))
+
+
+def request(socket_path, message):
+    """ Send MESSAGE (dict) to the mockd on SOCKET_PATH, return the reply """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as f:
+            f.write(json.dumps(message).encode() + b"\n")
+            f.flush()
+            return json.loads(f.readline())
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 # vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+from concurrent.futures import ThreadPoolExecutor
 import errno
+import fcntl
 import os
 import os.path
 import shutil
@@ -10,6 +12,16 @@ import time
 from . import exception
 from .trace_decorator import getLog, traceLog
 
+# linux/fs.h, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# extended attributes not worth preserving when copying chroot files
+SKIP_XATTRS = ('security.selinux',)
+
+# threads used by rmtree(..., parallel=True); the removal mostly waits for
+# the filesystem, so more threads than CPUs help
+RMTREE_WORKERS = min(8, (os.cpu_count() or 1) * 4)
+
 
 @traceLog()
 def mkdirIfAbsent(*args):
@@ -44,14 +56,116 @@ def write_if_changed(filepath, content):
 
 
 @traceLog()
-def rmtree(path, selinux=False, exclude=()):
+def rmtree(path, selinux=False, exclude=(), parallel=False):
     """Version of shutil.rmtree that ignores no-such-file-or-directory errors,
-       tries harder if it finds immutable files and supports excluding paths"""
+       tries harder if it finds immutable files and supports excluding paths.
+       With PARALLEL, large trees (like chroots) are removed faster by several
+       threads, see _parallel_rmtree()."""
     if os.path.islink(path):
         raise OSError("Cannot call rmtree on a symbolic link: %s" % path)
     if path in exclude:
         return
-    _recursive_rmtree(path, selinux, exclude)
+    if parallel and RMTREE_WORKERS > 1:
+        _parallel_rmtree(path, selinux, set(exclude))
+    else:
+        _recursive_rmtree(path, selinux, exclude)
+
+
+def _unlink_entries(path, exclude, dir_fd=None):
+    """
+    Unlink the non-directory entries of the directory PATH (opened as DIR_FD,
+    if given), return the names of the sub-directories to remove.
+    """
+    subdirs = []
+    with os.scandir(path if dir_fd is None else dir_fd) as it:
+        for entry in it:
+            if exclude and os.path.join(path, entry.name) in exclude:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif dir_fd is not None:
+                os.unlink(entry.name, dir_fd=dir_fd)
+            else:
+                os.unlink(os.path.join(path, entry.name))
+    return subdirs
+
+
+def _fd_rmtree_contents(dir_fd, path, exclude):
+    """ Remove the content of directory PATH opened as DIR_FD, relative to it """
+    for name in _unlink_entries(path, exclude, dir_fd):
+        fd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=dir_fd)
+        try:
+            _fd_rmtree_contents(fd, os.path.join(path, name), exclude)
+        finally:
+            os.close(fd)
+        _rmdir(name, exclude, dir_fd=dir_fd)
+
+
+def _rmdir(path, exclude, dir_fd=None):
+    try:
+        os.rmdir(path, dir_fd=dir_fd)
+    except OSError as e:
+        if e.errno == errno.ENOENT or (e.errno == errno.ENOTEMPTY and exclude):
+            return
+        raise
+
+
+def _remove_subtree(path, selinux, exclude):
+    """
+    Remove the directory PATH by the operations relative to the opened
+    directories (no path lookups, no PATH_MAX limit).  Any error not
+    handled here (busy mountpoints, immutable files, concurrent writers) is
+    left to _recursive_rmtree(), with its retries and SELinux handling.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+    except FileNotFoundError:
+        return
+    try:
+        try:
+            _fd_rmtree_contents(fd, path, exclude)
+        finally:
+            os.close(fd)
+        _rmdir(path, exclude)
+    except FileNotFoundError:
+        _recursive_rmtree(path, selinux, exclude)
+    except OSError as e:
+        getLog().debug("falling back to the slow tree removal of %s: %s", path, e)
+        _recursive_rmtree(path, selinux, exclude)
+
+
+def _parallel_rmtree(path, selinux, exclude):
+    """
+    Remove the directory tree PATH using RMTREE_WORKERS threads.  The top
+    levels of the tree are expanded until there are enough independent
+    subtrees, the subtrees are then removed in parallel (each by one
+    thread), and at last the expanded directories, bottom-up.
+    """
+    expanded = []
+    subtrees = [path]
+    try:
+        while subtrees and len(subtrees) < RMTREE_WORKERS * 4 and len(expanded) < 1000:
+            directory = subtrees.pop(0)
+            subtrees += [os.path.join(directory, name)
+                         for name in _unlink_entries(directory, exclude)]
+            expanded.append(directory)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            # let the slow path deal with it
+            getLog().debug("falling back to the slow tree removal of %s: %s", path, e)
+        _recursive_rmtree(path, selinux, exclude)
+        return
+
+    with ThreadPoolExecutor(RMTREE_WORKERS) as executor:
+        for _ in executor.map(lambda subtree: _remove_subtree(subtree, selinux, exclude),
+                              subtrees):
+            pass
+
+    for directory in reversed(expanded):
+        try:
+            _rmdir(directory, exclude)
+        except OSError:
+            _recursive_rmtree(directory, selinux, exclude)
 
 
 def _recursive_rmtree(path, selinux, exclude):  # pylint: disable=too-many-statements
@@ -207,3 +321,63 @@ def update_tree(dest, src):
             dest_subdir = os.path.join(destpath, subdir)
             _best_effort_removal(dest_subdir, use_rmtree=False)
             mkdirIfAbsent(dest_subdir)
+
+
+def reflink(src, dst):
+    """
+    Create DST as a copy-on-write clone of SRC (FICLONE ioctl).  Raises
+    OSError (e.g. EOPNOTSUPP, EXDEV, EINVAL) when the filesystem can not do
+    that, DST is removed in such case.
+    """
+    with open(src, 'rb') as src_fd, open(dst, 'wb') as dst_fd:
+        try:
+            fcntl.ioctl(dst_fd.fileno(), FICLONE, src_fd.fileno())
+        except OSError:
+            os.unlink(dst)
+            raise
+
+
+def copy_data(src, dst):
+    """
+    Copy the content of SRC file into DST, try the reflink first and then
+    the in-kernel copy_file_range(), fall back to the userspace copy.
+    """
+    try:
+        reflink(src, dst)
+        return
+    except OSError:
+        pass
+    with open(src, 'rb') as src_fd, open(dst, 'wb') as dst_fd:
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(src_fd.fileno(), dst_fd.fileno(), 1 << 30):
+                    pass
+                return
+            except OSError:
+                src_fd.seek(0)
+                dst_fd.seek(0)
+                dst_fd.truncate()
+        shutil.copyfileobj(src_fd, dst_fd)
+
+
+def get_xattrs(path):
+    """ Return sorted list of (name, value) extended attributes of PATH """
+    try:
+        names = os.listxattr(path, follow_symlinks=False)
+    except OSError:
+        return []
+    return [(name, os.getxattr(path, name, follow_symlinks=False))
+            for name in sorted(names) if name not in SKIP_XATTRS]
+
+
+def copy_metadata(st, dst, xattrs=()):
+    """
+    Apply ownership, mode, XATTRS and timestamps from the stat result ST to
+    the DST file.  Ownership goes first because chown() drops the setuid bits
+    and file capabilities.
+    """
+    os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+    os.chmod(dst, st.st_mode & 0o7777)
+    for name, value in xattrs:
+        os.setxattr(dst, name, value, follow_symlinks=False)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
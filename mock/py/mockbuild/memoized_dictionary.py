@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+TemplatedDictionary with memoized Jinja expansion, used for config_opts.
+
+The upstream TemplatedDictionary re-renders the Jinja template of a config
+option on each read, compiling the template again each time.  This subclass
+renders the same way, but:
+
+* strings without any Jinja delimiter are returned without calling Jinja
+  (e.g. the '%{...}' RPM macros),
+* compiled templates are cached by their source,
+* the rendered string options are remembered until the option itself or any
+  option its template refers to is assigned (or deleted); templates
+  referring to lists or dicts (mutable in place) are never remembered.
+
+The per-option render counts are collected by render_stats(), and dumped
+into the result directory (config-renders.json) by Buildroot.write_timings().
+"""
+
+import json
+import time
+
+import jinja2
+from jinja2 import meta
+from templated_dictionary import TemplatedDictionary
+
+_JINJA_DELIMITERS = ("{{", "{%", "{#")
+
+# values of the template variables which can't change without assignment
+_SCALARS = (str, int, float, bool, type(None))
+
+_ENVIRONMENT = jinja2.Environment(keep_trailing_newline=True)
+
+# template source => (compiled template, names of the variables it uses)
+_TEMPLATES = {}
+_MAX_TEMPLATES = 4096
+
+
+def _needs_rendering(value):
+    return "\r" in value or any(delimiter in value for delimiter in _JINJA_DELIMITERS)
+
+
+def _compile(source):
+    try:
+        return _TEMPLATES[source]
+    except KeyError:
+        pass
+    ast = _ENVIRONMENT.parse(source)
+    compiled = (_ENVIRONMENT.from_string(ast), frozenset(meta.find_undeclared_variables(ast)))
+    if len(_TEMPLATES) >= _MAX_TEMPLATES:
+        _TEMPLATES.clear()
+    _TEMPLATES[source] = compiled
+    return compiled
+
+
+class MemoizedTemplatedDictionary(TemplatedDictionary):
+    """ TemplatedDictionary with memoized (and counted) Jinja expansion """
+
+    # not in __dict__, which holds the dictionary items
+    __slots__ = ("_memo", "_dependents", "_stats")
+
+    def __init__(self, *args, **kwargs):
+        self._reset_memo()
+        super().__init__(*args, **kwargs)
+
+    def _reset_memo(self):
+        # key => rendered string
+        self._memo = {}
+        # key => keys whose memoized value depends on it
+        self._dependents = {}
+        # key => [renders, memo hits, seconds spent rendering]
+        self._stats = {}
+
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self._reset_memo()
+        self.__dict__.update(state)
+
+    def _invalidate(self, key):
+        if key == "__jinja_expand":
+            self._memo.clear()
+            self._dependents.clear()
+            return
+        self._memo.pop(key, None)
+        for dependent in self._dependents.pop(key, ()):
+            self._memo.pop(dependent, None)
+
+    def __setitem__(self, key, value):
+        key = self._aliases.get(key, key)
+        self._invalidate(key)
+        self.__dict__[key] = value
+
+    def __delitem__(self, key):
+        self._invalidate(key)
+        del self.__dict__[key]
+
+    def __getitem__(self, key):
+        key = self._aliases.get(key, key)
+        value = self.__dict__[key]
+        if not self.__dict__.get('__jinja_expand'):
+            return value
+        if key in self._memo:
+            self._stats.setdefault(key, [0, 0, 0.0])[1] += 1
+            return self._memo[key]
+        if isinstance(value, str) and not _needs_rendering(value):
+            return value
+
+        stats = self._stats.setdefault(key, [0, 0, 0.0])
+        start = time.perf_counter()
+        variables = set()
+        try:
+            value = self._render_value(value, stats, variables)
+        finally:
+            stats[2] += time.perf_counter() - start
+
+        if isinstance(self.__dict__[key], str) and \
+                all(isinstance(self.__dict__.get(name), _SCALARS) for name in variables):
+            self._memo[key] = value
+            for name in variables:
+                self._dependents.setdefault(name, set()).add(key)
+        return value
+
+    def copy(self):
+        return MemoizedTemplatedDictionary(self.__dict__)
+
+    def _render_value(self, value, stats, variables):
+        if isinstance(value, str):
+            return self._render_string(value, stats, variables)
+        if isinstance(value, list):
+            # rendered in place, see TemplatedDictionary
+            for i in range(len(value)):  # pylint: disable=consider-using-enumerate
+                value[i] = self._render_value(value[i], stats, variables)
+            return value
+        if isinstance(value, dict):
+            for k in value.keys():
+                value[k] = self._render_value(value[k], stats, variables)
+            return value
+        return value
+
+    def _render_string(self, value, stats, variables):
+        orig = last = value
+        max_recursion = self.__dict__.get('jinja_max_recursion', 5)
+        for _ in range(max_recursion):
+            if not _needs_rendering(value):
+                # jinja would return it unchanged
+                return value
+            template, names = _compile(value)
+            variables.update(names)
+            stats[0] += 1
+            value = template.render(self.__dict__)
+            if value == last:
+                return value
+            last = value
+        raise ValueError("too deep jinja re-evaluation on '{}'".format(orig))
+
+    def render_stats(self):
+        """
+        Return the number of Jinja renders, memo hits and the time spent
+        rendering of each option which needed rendering, the slowest first
+        """
+        stats = [{"key": key, "renders": renders, "memo_hits": hits, "time": seconds}
+                 for key, (renders, hits, seconds) in self._stats.items() if renders]
+        stats.sort(key=lambda entry: entry["time"], reverse=True)
+        return stats
+
+    def reset_render_stats(self):
+        """ Start counting the renders from zero """
+        self._stats = {}
+
+    def write_render_stats(self, filename):
+        """ Dump render_stats() into FILENAME (JSON) """
+        with open(filename, "w") as f:
+            json.dump(self.render_stats(), f, indent=2)
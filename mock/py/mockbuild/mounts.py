@@ -282,8 +282,9 @@ class Mounts(object):
     @traceLog()
     def _umount_bootstrap(self):
         # Kill leftover processes in the bind-mountpoint, typically these
-        # processes can be started by DNF/RPM via buggy scriptlets.
-        util.orphansKill(self.rootObj.make_chroot_path(), manual_forced=True)
+        # processes can be started by DNF/RPM via buggy scriptlets, i.e. they
+        # are tracked as spawned by us.
+        util.orphansKill(self.rootObj.make_chroot_path(), manual_forced=True, tracked_only=True)
         with self.rootObj.uid_manager.elevated_privileges():
             for m in reversed(self.bootstrap_mounts):
                 m.umount()
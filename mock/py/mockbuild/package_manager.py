@@ -286,7 +286,7 @@ class _PackageManager(object):
 
         # intentionally we do not call bootstrap hook here - it does not have sense
         env = self.config['environment'].copy()
-        env.update(util.get_proxy_environment(self.config))
+        env.update(util.get_proxy_environment(self.config, package_manager=True))
         # installation-time specific homedir
         env['HOME'] = self.buildroot.prepare_installation_time_homedir()
         env['LC_MESSAGES'] = 'C.UTF-8'
@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 # vim: noai:ts=4:sw=4:expandtab
 
+import cProfile
 import importlib.machinery
 import importlib.util
+import json
+import os
 import sys
+import threading
+import time
 
 from .exception import Error
 from .trace_decorator import traceLog
 
 current_api_version = '1.1'
 
+# Only one profiler may be active at a time (since Python 3.12 process-wide),
+# so only the outermost hook (of any thread) is profiled, the nested hooks
+# are just timed.
+_PROFILING = threading.Lock()
+
 
 class Plugins(object):
     @traceLog()
@@ -24,6 +34,10 @@ class Plugins(object):
         self.plugin_conf = config['plugin_conf']
         self.plugin_dir = config['plugin_dir']
 
+        # (stage, hook name) => [calls, seconds, cProfile.Profile or None]
+        self.hook_stats = {}
+        self.profile_hooks = config.get('profile_hooks', False)
+
     def __repr__(self):
         return "<mockbuild.plugin.Plugins: state={0}, _hooks={1}, already_initialized={2}".format(
             self.state, self._hooks, self.already_initialized)
@@ -78,7 +92,46 @@ class Plugins(object):
             raise Error(
                 "Feature {0} is not provided by any of enabled plugins".format(stage))
         for hook in hooks:
-            hook(*args, **kwargs)
+            key = (stage, "{0}.{1}".format(hook.__module__, hook.__qualname__))
+            stats = self.hook_stats.get(key)
+            if stats is None:
+                stats = self.hook_stats[key] = [0, 0.0, None]
+                if self.profile_hooks:
+                    stats[2] = cProfile.Profile()
+            start = time.monotonic()
+            profile = stats[2] is not None and _PROFILING.acquire(blocking=False)
+            try:
+                if profile:
+                    stats[2].runcall(hook, *args, **kwargs)
+                else:
+                    hook(*args, **kwargs)
+            finally:
+                if profile:
+                    _PROFILING.release()
+                stats[0] += 1
+                stats[1] += time.monotonic() - start
+
+    def write_hook_stats(self, resultdir, prefix=""):
+        """
+        Dump the wall time and number of calls of each hook, per stage, into
+        RESULTDIR/<prefix>hooks.json (the slowest first).  With profile_hooks
+        enabled, the cProfile data of each hook are dumped into the
+        RESULTDIR/<prefix>hooks-profile/ directory (see pstats).
+        """
+        if not self.hook_stats:
+            return
+        summary = []
+        for (stage, name), (calls, seconds, profile) in self.hook_stats.items():
+            entry = {"stage": stage, "hook": name, "calls": calls, "time": seconds}
+            if profile:
+                profdir = os.path.join(resultdir, prefix + "hooks-profile")
+                os.makedirs(profdir, exist_ok=True)
+                entry["profile"] = os.path.join(profdir, "{0}-{1}.prof".format(stage, name))
+                profile.dump_stats(entry["profile"])
+            summary.append(entry)
+        summary.sort(key=lambda entry: entry["time"], reverse=True)
+        with open(os.path.join(resultdir, prefix + "hooks.json"), "w") as f:
+            json.dump(summary, f, indent=2)
 
     @traceLog()
     def add_hook(self, stage, function):
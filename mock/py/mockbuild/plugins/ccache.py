@@ -74,7 +74,7 @@ class CCache(object):
 
         file_util.mkdirIfAbsent(self.buildroot.make_chroot_path('/var/tmp/ccache'))
         file_util.mkdirIfAbsent(self.ccachePath)
-        self.buildroot.uid_manager.changeOwner(self.ccachePath, recursive=True)
+        self.buildroot.uid_manager.changeOwner(self.ccachePath, recursive=True, marker=True)
 
     # get some cache stats
     def _ccachePostBuildHook(self):
@@ -9,13 +9,19 @@ import os
 import os.path
 import re
 import shutil
+import stat
+import tarfile
+import tempfile
 
 # our imports
 from mockbuild.trace_decorator import getLog, traceLog
-from mockbuild import util, file_util
+from mockbuild import file_util
 
 requires_api_version = "1.1"
 
+# virtual filesystems in chroot, never scanned
+PRUNED = ("/proc", "/sys", "/dev")
+
 
 # plugin entry point
 @traceLog()
@@ -23,6 +29,66 @@ def init(plugins, conf, buildroot):
     ChrootScan(plugins, conf, buildroot)
 
 
+def scan(chroot, regex, include_roots=("/",)):
+    """
+    Yield the (path, stat) of the regular files in CHROOT below the
+    INCLUDE_ROOTS (paths inside the chroot) with file name matching REGEX.
+    Symlinks are neither followed nor reported.
+    """
+    pruned = {os.path.join(chroot, d.lstrip("/")) for d in PRUNED}
+    roots = sorted({os.path.normpath(os.path.join(chroot, root.lstrip("/")))
+                    for root in include_roots})
+    # don't scan the nested roots twice
+    roots = [root for i, root in enumerate(roots)
+             if not any(root.startswith(parent.rstrip("/") + "/") for parent in roots[:i])]
+    stack = list(reversed(roots))
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in pruned:
+                        subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and regex.search(entry.name):
+                    yield entry.path, entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+        stack += reversed(subdirs)
+
+
+def open_regular_file(chroot, path):
+    """
+    Open the regular file PATH (below CHROOT) for reading, without following
+    any symlink in the path below CHROOT, so a process still running in the
+    chroot can not redirect us elsewhere by swapping a file or directory for
+    a symlink.  Return the file object.
+    """
+    parts = os.path.relpath(path, chroot).split(os.sep)
+    fd = os.open(chroot, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for part in parts[:-1]:
+            parent = fd
+            fd = os.open(part, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=parent)
+            os.close(parent)
+        parent = fd
+        # non-blocking not to hang on a fifo
+        fd = os.open(parts[-1], os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK, dir_fd=parent)
+        os.close(parent)
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            raise OSError("not a regular file: {0}".format(path))
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, "rb")
+    except BaseException:
+        os.close(fd)
+        raise
+
+
 class ChrootScan(object):
     """scan chroot for files of interest, copying to resultdir with relative paths"""
     # pylint: disable=too-few-public-methods
@@ -58,43 +124,106 @@ class ChrootScan(object):
         if (self._only_failed() and is_failed) or not self._only_failed():
             self.__scanChroot()
 
+    def _chown(self, path):
+        if os.geteuid() == 0:
+            os.lchown(path, self.buildroot.uid_manager.unprivUid,
+                      self.buildroot.uid_manager.unprivGid)
+
+    def _copy(self, chroot, srcpath, st, created):
+        """
+        Copy SRCPATH into the resultdir (with the full path as 'cp --parents'
+        does), owned by the mock user and writable by them.  The directories
+        CREATED so far are remembered in the set, not to stat them again.
+        """
+        dest = self.resultdir + srcpath
+        parent = os.path.dirname(dest)
+        missing = []
+        while parent not in created and not os.path.isdir(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        for directory in reversed(missing):
+            os.mkdir(directory, 0o755)
+            self._chown(directory)
+            created.add(directory)
+        created.add(os.path.dirname(dest))
+        with open_regular_file(chroot, srcpath) as src:
+            fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+            with os.fdopen(fd, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+                os.fchmod(fd, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+                if os.geteuid() == 0:
+                    os.fchown(fd, self.buildroot.uid_manager.unprivUid,
+                              self.buildroot.uid_manager.unprivGid)
+
+    def _read_for_tar(self, chroot, srcpath, st):
+        """
+        Return the TarInfo and a temporary copy of SRCPATH, so the tarball
+        member can't get shorter than its header says even if the file is
+        truncated meanwhile
+        """
+        data = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+        try:
+            with open_regular_file(chroot, srcpath) as src:
+                shutil.copyfileobj(src, data)
+            info = tarfile.TarInfo((self.resultdir + srcpath).lstrip("/"))
+            info.size = data.tell()
+            info.mtime = st.st_mtime
+            info.mode = stat.S_IMODE(st.st_mode) | stat.S_IWUSR
+            info.uid = self.buildroot.uid_manager.unprivUid
+            info.gid = self.buildroot.uid_manager.unprivGid
+            data.seek(0)
+            return info, data
+        except BaseException:
+            data.close()
+            raise
+
     def __scanChroot(self):
         regexstr = "|".join(self.scan_opts['regexes'])
         regex = re.compile(regexstr)
         chroot = self.buildroot.make_chroot_path()
+        include_roots = self.scan_opts.get('include_roots') or ["/"]
         self.buildroot.create_resultdir()
-        # self.resultdir != self.buildroot.resultdir
-        file_util.mkdirIfAbsent(self.resultdir)
         count = 0
         logger = getLog()
-        logger.debug("chroot_scan: Starting scan of %s", chroot)
+        logger.debug("chroot_scan: Starting scan of %s (%s)", chroot, ", ".join(include_roots))
         copied = []
-        for root, _, files in os.walk(chroot):
-            for f in files:
-                m = regex.search(f)
-                if m:
-                    srcpath = os.path.join(root, f)
+        tar = None
+        tar_path = self.resultdir + ".tar.gz"
+        created = set()
+        if not self._tarball():
+            # self.resultdir != self.buildroot.resultdir
+            file_util.mkdirIfAbsent(self.resultdir)
+            self._chown(self.resultdir)
+            created.add(self.resultdir)
+        try:
+            for srcpath, st in scan(chroot, regex, include_roots):
+                if self._tarball() and tar is None:
+                    logger.info("chroot_scan: streaming the files into tarball %s", tar_path)
+                    tar = tarfile.open(tar_path, "w:gz")
+                try:
+                    if tar is not None:
+                        member = self._read_for_tar(chroot, srcpath, st)
+                    else:
+                        self._copy(chroot, srcpath, st, created)
+                        member = None
+                except OSError as e:
                     # we intentionally ignore errors here:
                     # https://github.com/rpm-software-management/mock/issues/1455
-                    util.do(["cp", "--preserve=mode", "--parents", srcpath,
-                             self.resultdir], raiseExc=False)
-                    count += 1
-                    copied.append(srcpath)
+                    logger.debug("chroot_scan: can not copy %s: %s", srcpath, e)
+                    member = None
+                if member is not None:
+                    # an error here leaves a broken tarball, so it is fatal
+                    info, data = member
+                    with data:
+                        tar.addfile(info, data)
+                count += 1
+                copied.append(srcpath)
+        finally:
+            if tar is not None:
+                tar.close()
+                self._chown(tar_path)
         logger.debug("chroot_scan: finished with %d files found", count)
         if count:
-            logger.info("chroot_scan: %d files copied to %s", count, self.resultdir)
+            logger.info("chroot_scan: %d files copied to %s", count,
+                        tar_path if tar is not None else self.resultdir)
             logger.info("\n".join(copied))
-            self.buildroot.uid_manager.changeOwner(self.resultdir, recursive=True)
-            # some packages installs 555 perms on dirs,
-            # so user can't delete/move chroot_scan's results
-            util.do(['chmod', '-R', 'u+w', self.resultdir])
-            if self._tarball():
-                tarfile = self.resultdir + ".tar.gz"
-                logger.info("chroot_scan: creating tarball %s", tarfile)
-                __tar_cmd = self.config["tar_binary"]
-                util.do(
-                    [__tar_cmd, "-czf", tarfile, self.resultdir],
-                    shell=False, printOutput=True
-                )
-                shutil.rmtree(self.resultdir)
-                self.buildroot.uid_manager.changeOwner(tarfile)
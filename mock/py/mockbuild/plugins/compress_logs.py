@@ -26,9 +26,12 @@ class CompressLogsPlugin(object):
     @traceLog()
     def _compress_logs(self):
         logger = getLog()
-        for f_name in ('root.log', 'build.log', 'state.log', 'available_pkgs.log',
-                       'installed_pkgs.log', 'hw_info.log', 'procenv.log',
-                       'showrc.log'):
+        f_names = ['available_pkgs.log', 'installed_pkgs.log', 'hw_info.log',
+                   'procenv.log', 'showrc.log']
+        if not self.conf.get('stream'):
+            # with 'stream', these are written compressed already
+            f_names = ['root.log', 'build.log', 'state.log'] + f_names
+        for f_name in f_names:
             f_path = os.path.join(self.buildroot.resultdir, f_name)
             if os.path.exists(f_path):
                 command = "{0} {1}".format(self.command, f_path)
@@ -6,13 +6,16 @@
 
 # python library imports
 import fcntl
+import json
 import os
+import shutil
 import time
 
 # our imports
 from mockbuild.trace_decorator import getLog, traceLog
 import mockbuild.util
 import mockbuild.text
+from mockbuild import root_cache_store
 
 requires_api_version = "1.1"
 
@@ -34,14 +37,35 @@ class RootCache(object):
         self.state = buildroot.state
         self.rootSharedCachePath = self.root_cache_opts['dir'] % self.root_cache_opts
         self.rootCacheFile = os.path.join(self.rootSharedCachePath, "cache.tar")
+        self.rootCacheManifest = os.path.join(self.rootSharedCachePath, "cache.json")
         self.rootCacheLock = None
+        self.format = self.root_cache_opts.get('format', 'tar')
+        extension = self.root_cache_opts['extension']
         self.compressProgram = self.root_cache_opts['compress_program']
-        if self.compressProgram == 'pigz' and not os.path.exists('/bin/pigz'):
+        self.store = None
+        if self.format == 'zstd':
+            self.compressProgram = self._zstd_program()
+            extension = '.zst'
+        elif self.format == 'store':
+            # the files are in the shared store, the tree manifest is the cache
+            self.compressProgram = None
+            self.rootCacheFile = os.path.join(self.rootSharedCachePath, "cache.tree.json.gz")
+            link_mode = self.root_cache_opts.get('store_link_mode', 'auto')
+            if link_mode == 'hardlink':
+                getLog().warning("root_cache store_link_mode is 'hardlink', files modified in place "
+                                 "in the buildroot will modify the shared store as well")
+            self.store = root_cache_store.ObjectStore(
+                self.root_cache_opts['store_dir'] % self.root_cache_opts, link_mode)
+        elif self.format == 'clone':
+            # pristine tree, cloned into the buildroot
+            self.compressProgram = None
+            self.rootCacheFile = os.path.join(self.rootSharedCachePath, "cache.tree.d")
+        elif self.compressProgram == 'pigz' and not os.path.exists('/bin/pigz'):
             getLog().warning("specified 'pigz' as the root cache compress program but not available; using gzip")
             self.compressProgram = 'gzip'
 
         self.decompressProgram = self.root_cache_opts.get('decompress_program')
-        if not self.decompressProgram:
+        if not self.decompressProgram and self.compressProgram:
             if self.config['tar'] == 'bsdtar':
                 # Contrary to GNU tar, BSD tar doesn't automatically add the "-d"
                 # option to the compressing utility while decompressing.
@@ -51,7 +75,7 @@ class RootCache(object):
 
         if self.compressProgram:
             self.compressArgs = ['--use-compress-program', self.compressProgram]
-            self.rootCacheFile = self.rootCacheFile + self.root_cache_opts['extension']
+            self.rootCacheFile = self.rootCacheFile + extension
         else:
             self.compressArgs = []
         if self.decompressProgram:
@@ -69,9 +93,74 @@ class RootCache(object):
         plugins.add_hook("postupdate", self._rootCachePostUpdateHook)
         self.exclude_dirs = self.root_cache_opts['exclude_dirs']
         self.exclude_tar_opts = []
+        self.exclude_paths = []
         for ex_dir in self.exclude_dirs:
             self._tarExcludeOption(ex_dir)
 
+    def _zstd_program(self):
+        """
+        Multithreaded zstd.  Prefer pzstd, which splits the archive into
+        independent frames so that also the decompression runs in parallel.
+        """
+        threads = self.root_cache_opts.get('zstd_threads') or os.cpu_count() or 1
+        level = self.root_cache_opts.get('zstd_level', 3)
+        if shutil.which('pzstd'):
+            return "pzstd -q -p {0} -{1}".format(threads, level)
+        return "zstd -q -T{0} -{1}".format(threads, level)
+
+    def _manifest(self):
+        return {
+            'format': self.format,
+            'file': os.path.basename(self.rootCacheFile),
+            'compress_program': self.compressProgram,
+            'decompress_program': self.decompressProgram,
+            'tar': self.config['tar'],
+            'exclude_dirs': self.exclude_dirs,
+        }
+
+    def _write_manifest(self):
+        manifest = self._manifest()
+        manifest['created'] = time.time()
+        tmp = self.rootCacheManifest + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        os.replace(tmp, self.rootCacheManifest)
+
+    def _manifest_matches(self):
+        """ False if the cache was created with different format settings """
+        try:
+            with open(self.rootCacheManifest) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            # caches created before the manifest was introduced
+            return True
+        current = self._manifest()
+        for key in ('format', 'file', 'tar'):
+            if manifest.get(key) != current[key]:
+                getLog().info("root cache %s changed (%s => %s); cache will be rebuilt",
+                              key, manifest.get(key), current[key])
+                return False
+        return True
+
+    def _remove_other_caches(self):
+        """ Remove the caches left by the previously used format (or compression) """
+        current = os.path.basename(self.rootCacheFile)
+        for name in os.listdir(self.rootSharedCachePath):
+            if name == current or not name.startswith(("cache.tar", "cache.tree.")):
+                continue
+            path = os.path.join(self.rootSharedCachePath, name)
+            getLog().info("removing the old root cache %s", path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                mockbuild.file_util.rmtree(path)
+            else:
+                os.unlink(path)
+
+    def _remove_cache(self):
+        if os.path.isdir(self.rootCacheFile):
+            mockbuild.file_util.rmtree(self.rootCacheFile)
+        else:
+            os.unlink(self.rootCacheFile)
+
     def _tarExcludeOption(self, ex_dir):
         if self.config['tar'] == 'bsdtar':
             anchor = '^'
@@ -79,6 +168,7 @@ class RootCache(object):
             anchor = ''
 
         self.exclude_tar_opts.append('--exclude=' + anchor + ex_dir)
+        self.exclude_paths.append(ex_dir)
 
     # =============
     # 'Private' API
@@ -119,16 +209,18 @@ class RootCache(object):
                 file_age_days = (time.time() - statinfo.st_ctime) / (60 * 60 * 24)
                 if file_age_days > self.root_cache_opts['max_age_days']:
                     getLog().info("root cache aged out! cache will be rebuilt")
-                    os.unlink(self.rootCacheFile)
+                    self._remove_cache()
                 else:
                     # make sure no config file is newer than the cache file
                     for cfg in self.config['config_paths']:
                         if os.stat(cfg).st_mtime > statinfo.st_mtime:
                             getLog().info("%s newer than root cache; cache will be rebuilt", cfg)
-                            os.unlink(self.rootCacheFile)
+                            self._remove_cache()
                             break
             else:
                 getLog().info("skipping root_cache aging check")
+            if os.path.exists(self.rootCacheFile) and not self._manifest_matches():
+                self._remove_cache()
         except OSError:
             pass
 
@@ -150,12 +242,18 @@ class RootCache(object):
                     os.chdir(mockbuild.file_util.find_non_nfs_dir())
                 mockbuild.file_util.mkdirIfAbsent(self.buildroot.make_chroot_path())
 
-                __tar_cmd = self.config["tar_binary"]
-                mockbuild.util.do(
-                    [__tar_cmd] + self.decompressArgs + ["-xf", self.rootCacheFile,
-                                                         "-C", self.buildroot.make_chroot_path()],
-                    shell=False, printOutput=True
-                )
+                if self.store:
+                    root_cache_store.unpack(self.store, self.rootCacheFile,
+                                            self.buildroot.make_chroot_path())
+                elif self.format == 'clone':
+                    self._clone_root_cache()
+                else:
+                    __tar_cmd = self.config["tar_binary"]
+                    mockbuild.util.do(
+                        [__tar_cmd] + self.decompressArgs + ["-xf", self.rootCacheFile,
+                                                             "-C", self.buildroot.make_chroot_path()],
+                        shell=False, printOutput=True
+                    )
                 for item in self.exclude_dirs:
                     mockbuild.file_util.mkdirIfAbsent(self.buildroot.make_chroot_path(item))
 
@@ -212,19 +310,14 @@ class RootCache(object):
                 mockbuild.util.do(["sync"], shell=False)
                 self._root_cache_handle_mounts()
                 self.state.start("creating root cache")
-                __tar_cmd = [self.config["tar_binary"], "--one-file-system"]
-                if self.config['tar'] == 'gnutar':
-                    __tar_cmd += ["--exclude-caches", "--exclude-caches-under"]
-                __tar_cmd += self.compressArgs + \
-                        ["-cf", self.rootCacheFile,
-                         "-C", self.buildroot.make_chroot_path()] + \
-                        self.exclude_tar_opts+ ["."]
-                try:
-                    mockbuild.util.do(__tar_cmd, shell=False)
-                except:
-                    if os.path.exists(self.rootCacheFile):
-                        os.remove(self.rootCacheFile)
-                    raise
+                if self.store:
+                    self._pack_root_cache_store()
+                elif self.format == 'clone':
+                    self._pack_root_cache_clone()
+                else:
+                    self._pack_root_cache_tar()
+                self._write_manifest()
+                self._remove_other_caches()
                 # now create the cache log file
                 with open(os.path.join(self.rootSharedCachePath, "cache.log"), "wb") as cache_log:
                     cache_log.write(self.buildroot.pkg_manager.init_install_output.encode(mockbuild.text.encoding))
@@ -232,6 +325,66 @@ class RootCache(object):
         finally:
             self._rootCacheUnlock()
 
+    def _pack_root_cache_tar(self):
+        __tar_cmd = [self.config["tar_binary"], "--one-file-system"]
+        if self.config['tar'] == 'gnutar':
+            __tar_cmd += ["--exclude-caches", "--exclude-caches-under"]
+        __tar_cmd += self.compressArgs + \
+                ["-cf", self.rootCacheFile,
+                 "-C", self.buildroot.make_chroot_path()] + \
+                self.exclude_tar_opts+ ["."]
+        try:
+            mockbuild.util.do(__tar_cmd, shell=False)
+        except:
+            if os.path.exists(self.rootCacheFile):
+                os.remove(self.rootCacheFile)
+            raise
+
+    def _pack_root_cache_store(self):
+        try:
+            root_cache_store.pack(self.store, self.buildroot.make_chroot_path(),
+                                  self.rootCacheFile, self.exclude_paths)
+        except:
+            if os.path.exists(self.rootCacheFile):
+                os.remove(self.rootCacheFile)
+            raise
+        # drop the objects no longer referenced by any config
+        self.store.gc()
+
+    def _clone_root_cache(self):
+        link_mode = self.root_cache_opts.get('clone_link_mode', 'auto')
+        if link_mode == 'auto':
+            if not root_cache_store.reflink_supported(self.rootSharedCachePath):
+                getLog().info("%s doesn't support reflinks, copying the root cache",
+                              self.rootSharedCachePath)
+            link_mode = 'copy'
+        elif link_mode == 'hardlink':
+            getLog().warning("root_cache clone_link_mode is 'hardlink', files modified in place "
+                             "in the buildroot will modify the root cache as well")
+        root_cache_store.clone_tree(self.rootCacheFile, self.buildroot.make_chroot_path(),
+                                    root_cache_store.FileLinker(link_mode))
+
+    def _pack_root_cache_clone(self):
+        # Populate a new pristine tree aside (reflinked if possible, but
+        # never hardlinked to the live buildroot), and replace the old one.
+        new_tree = self.rootCacheFile + ".new"
+        old_tree = self.rootCacheFile + ".old"
+        for tree in (new_tree, old_tree):
+            if os.path.exists(tree):
+                mockbuild.file_util.rmtree(tree)
+        try:
+            root_cache_store.clone_tree(self.buildroot.make_chroot_path(), new_tree,
+                                        root_cache_store.FileLinker("copy"),
+                                        self.exclude_paths)
+        except:
+            mockbuild.file_util.rmtree(new_tree)
+            raise
+        if os.path.exists(self.rootCacheFile):
+            os.rename(self.rootCacheFile, old_tree)
+        os.rename(new_tree, self.rootCacheFile)
+        if os.path.exists(old_tree):
+            mockbuild.file_util.rmtree(old_tree)
+
     @traceLog()
     def _rootCachePostShellHook(self):
         if self._haveVolatileRoot() and self.config['cache_alterations']:
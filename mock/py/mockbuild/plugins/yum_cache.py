@@ -8,10 +8,11 @@
 import fcntl
 import glob
 import os
-import time
 
 # our imports
+from mockbuild.cache_index import CacheIndex
 from mockbuild.mounts import BindMountPoint
+from mockbuild.rpm_pool import RpmPool
 from mockbuild.trace_decorator import getLog, traceLog
 import mockbuild.util
 
@@ -38,6 +39,26 @@ class CacheDir:
         ))
 
         mockbuild.file_util.mkdirIfAbsent(self.host_cache_path)
+        self.index = RepoCacheIndex(self.host_cache_path, self.host_cache_path + ".index.json")
+
+
+class RepoCacheIndex(CacheIndex):
+    """ CacheIndex of the package manager cache, evicting whole repositories """
+
+    def unit(self, relpath):
+        """
+        The repository directory (with repodata/ subdirectory, or repomd.xml
+        for yum) RELPATH belongs to, so the LRU eviction never leaves a half
+        of a repository in the cache
+        """
+        parts = relpath.split("/")[:-1]
+        # the outermost one, the dnf's repodata/ has repomd.xml too
+        for depth in range(1, len(parts) + 1):
+            reldir = "/".join(parts[:depth])
+            _, subdirs, files = self.dirs.get(reldir, (None, (), {}))
+            if "repodata" in subdirs or "repomd.xml" in files:
+                return reldir
+        return relpath
 
 
 class YumCache(object):
@@ -62,6 +83,9 @@ class YumCache(object):
         ]
         self.yumSharedCachePath = self.cache_dirs[0].host_cache_path
         self.online = self.config['online']
+        self.rpm_pool = None
+        if self.yum_cache_opts['rpm_pool']:
+            self.rpm_pool = RpmPool(self.yum_cache_opts['rpm_pool_dir'] % self.yum_cache_opts)
         plugins.add_hook("preyum", self._yumCachePreYumHook)
         plugins.add_hook("postyum", self._yumCachePostYumHook)
         plugins.add_hook("preinit", self._yumCachePreInitHook)
@@ -84,32 +108,33 @@ class YumCache(object):
             self.state.start("Waiting for yumcache lock")
             fcntl.lockf(self.yumCacheLock.fileno(), fcntl.LOCK_EX)
             self.state.finish("Waiting for yumcache lock")
+        if self.rpm_pool and not self.rpm_pool.disabled:
+            for cdir in self.cache_dirs:
+                linked = self.rpm_pool.expose(cdir.host_cache_path)
+                if linked:
+                    getLog().debug("%s packages linked from RPM pool", linked)
 
     @traceLog()
     def _yumCachePostYumHook(self):
+        # the package manager might have downloaded something
+        if self.rpm_pool and not self.rpm_pool.disabled:
+            for cdir in self.cache_dirs:
+                self.rpm_pool.collect(cdir.host_cache_path)
+        # the index is brought up to date at the next cleanup
         fcntl.lockf(self.yumCacheLock.fileno(), fcntl.LOCK_UN)
 
     @traceLog()
-    def _prune_repo_data(self, directory):
-        for (dirpath, _, filenames) in os.walk(directory):
-            for filename in filenames:
-                fullPath = os.path.join(dirpath, filename)
-                statinfo = os.stat(fullPath)
-                file_age_days = (time.time() - statinfo.st_ctime) / (60 * 60 * 24)
-                # prune repodata so yum redownloads.
-                # prevents certain errors where yum gets stuck due to bad metadata
-                for ext in self.METADATA_EXTS:
-                    if filename.endswith(ext) and file_age_days > self.yum_cache_opts['max_metadata_age_days']:
-                        os.unlink(fullPath)
-                        fullPath = None
-                        break
-
-                if fullPath is None:
-                    continue
-                if file_age_days > self.yum_cache_opts['max_age_days']:
-                    os.unlink(fullPath)
-                    continue
-
+    def _prune_repo_data(self, cdir):
+        cdir.index.update()
+        removed, freed = cdir.index.prune(
+            self.yum_cache_opts['max_age_days'],
+            self.yum_cache_opts['max_metadata_age_days'],
+            self.METADATA_EXTS,
+            self.yum_cache_opts['max_size'])
+        cdir.index.save()
+        if removed:
+            getLog().debug("removed %s files (%s bytes) from %s", removed, freed,
+                           cdir.host_cache_path)
 
     @traceLog()
     def _yumCachePreInitHook(self):
@@ -125,7 +150,9 @@ class YumCache(object):
             state = "cleaning package manager metadata"
             self.state.start(state)
             for cdir in self.cache_dirs:
-                self._prune_repo_data(cdir.host_cache_path)
+                self._prune_repo_data(cdir)
+            if self.rpm_pool:
+                self.rpm_pool.gc()
             self.state.finish(state)
 
         # yum made an rpmdb cache dir in $cachedir/installed for a while;
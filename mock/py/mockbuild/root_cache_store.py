@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+Content-addressed object store for the root_cache plugin ('store' format).
+
+Every regular file of the cached chroot is stored once in the shared store,
+keyed by the hash of its content and metadata (mode, owner, mtime and
+extended attributes).  The chroot itself is described by a "tree" manifest
+listing the directories, symlinks and files (by their object key).  Chroots
+of different configs built from the same RPM payload share the objects, and
+restoring a chroot is mostly a metadata operation on filesystems with
+reflinks - the files are cloned (copy-on-write) from the store.
+
+Layout of the store:
+
+    <store>/objects/ab/cdef...   the file objects
+    <store>/roots/<id>.json.gz   symlinks to tree manifests using the store
+    <store>/store.lock           shared by pack/unpack, exclusive by gc
+
+The same tree walking is used by the 'clone' format, which keeps a pristine
+copy of the chroot and clones it (clone_tree) into the new buildroots.
+"""
+
+import contextlib
+import errno
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import stat
+
+from . import file_util
+from .trace_decorator import getLog, traceLog
+
+TREE_VERSION = 1
+
+# entry types in the tree manifest
+DIRECTORY = "d"
+FILE = "f"
+SYMLINK = "l"
+HARDLINK = "h"
+SPECIAL = "s"
+
+
+class FileLinker:
+    """
+    Create files from their pristine copies.  LINK_MODE is "reflink"
+    (copy-on-write clones only), "copy" or "auto" (reflink if supported,
+    otherwise full copy), or "hardlink".  The reflink support is detected at
+    runtime, on the first file.
+
+    Hardlinked files share the inode with the pristine copy, so any in-place
+    modification in the buildroot changes the pristine copy too; the
+    "hardlink" mode must be requested explicitly.
+    """
+
+    def __init__(self, link_mode="auto"):
+        self.link_mode = link_mode
+        self._can_reflink = link_mode != "hardlink"
+
+    def _copy(self, src, dst):
+        st = os.stat(src)
+        file_util.copy_data(src, dst)
+        file_util.copy_metadata(st, dst, file_util.get_xattrs(src))
+
+    def link(self, src, dst):
+        """ Create DST from SRC """
+        if self._can_reflink:
+            try:
+                file_util.reflink(src, dst)
+                file_util.copy_metadata(os.stat(src), dst, file_util.get_xattrs(src))
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                    raise
+                if self.link_mode == "reflink":
+                    raise
+                getLog().debug("reflink not supported for %s, falling back to copy", dst)
+                self._can_reflink = False
+        if self.link_mode != "hardlink":
+            self._copy(src, dst)
+            return
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EMLINK):
+                raise
+            # different filesystem, or too many links - a plain copy
+            self._copy(src, dst)
+
+
+class ObjectStore:
+    """ The object store shared by all the configs """
+
+    def __init__(self, topdir, link_mode="auto"):
+        self.topdir = topdir
+        self.objects = os.path.join(topdir, "objects")
+        self.roots = os.path.join(topdir, "roots")
+        self.linker = FileLinker(link_mode)
+
+    @contextlib.contextmanager
+    def locked(self, shared=True):
+        """ Lock the store, shared for pack/unpack, exclusive for gc """
+        file_util.mkdirIfAbsent(self.objects, self.roots)
+        with open(os.path.join(self.topdir, "store.lock"), "a+") as lock:
+            fcntl.lockf(lock.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(lock.fileno(), fcntl.LOCK_UN)
+
+    def object_path(self, key):
+        return os.path.join(self.objects, key[:2], key[2:])
+
+    def add(self, path, st):
+        """ Store the regular file PATH (with stat ST), return its key """
+        content = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                content.update(chunk)
+        xattrs = file_util.get_xattrs(path)
+        key = hashlib.sha256("{0}:{1:o}:{2}:{3}:{4}".format(
+            content.hexdigest(), st.st_mode & 0o7777, st.st_uid, st.st_gid,
+            st.st_mtime_ns).encode())
+        for name, value in xattrs:
+            key.update(name.encode() + b"\0" + value)
+        key = key.hexdigest()
+
+        obj = self.object_path(key)
+        if not os.path.exists(obj):
+            file_util.mkdirIfAbsent(os.path.dirname(obj))
+            tmp = "{0}.{1}.tmp".format(obj, os.getpid())
+            file_util.copy_data(path, tmp)
+            file_util.copy_metadata(st, tmp, xattrs)
+            os.replace(tmp, obj)
+        return key
+
+    def materialize(self, key, dst):
+        """ Create DST file from the object KEY """
+        self.linker.link(self.object_path(key), dst)
+
+    def register(self, tree_file):
+        """ Mark objects referenced by TREE_FILE as used (by gc) """
+        ref = os.path.join(self.roots, hashlib.sha256(tree_file.encode()).hexdigest() + ".json.gz")
+        if os.path.lexists(ref):
+            return
+        os.symlink(tree_file, ref)
+
+    @traceLog()
+    def gc(self):
+        """ Remove objects not referenced by any registered tree """
+        with self.locked(shared=False):
+            used = set()
+            for ref in os.listdir(self.roots):
+                ref = os.path.join(self.roots, ref)
+                try:
+                    tree = read_tree(ref)
+                except OSError:
+                    # the tree was removed (e.g. --scrub)
+                    os.unlink(ref)
+                    continue
+                used.update(entry[-1] for entry in tree["entries"] if entry[1] == FILE)
+            removed = 0
+            for prefix in os.listdir(self.objects):
+                for name in os.listdir(os.path.join(self.objects, prefix)):
+                    if prefix + name not in used:
+                        os.unlink(os.path.join(self.objects, prefix, name))
+                        removed += 1
+            getLog().debug("root cache store gc: %s objects removed", removed)
+            return removed
+
+
+def read_tree(tree_file):
+    with gzip.open(tree_file, "rt") as f:
+        return json.load(f)
+
+
+def _excluded(relpath, excludes):
+    return any(relpath == ex or relpath.startswith(ex + "/") for ex in excludes)
+
+
+def _walk_tree(root, excludes, add_file):
+    """
+    Describe the ROOT directory as a list of tree entries, like tar
+    --one-file-system --exclude-caches would archive it.  EXCLUDES is a list
+    of relative (./foo) paths to skip.  ADD_FILE(path, stat) returns the data
+    stored for the regular files.
+    """
+    excludes = [os.path.normpath(ex) for ex in excludes]
+    root_dev = os.lstat(root).st_dev
+    entries = []
+    inodes = {}
+
+    def _walk(relpath):
+        path = os.path.join(root, relpath)
+        with os.scandir(path) as it:
+            children = sorted(it, key=lambda e: e.name)
+        # like tar --exclude-caches
+        skip_content = any(e.name == "CACHEDIR.TAG" for e in children)
+        for entry in children:
+            child = os.path.normpath(os.path.join(relpath, entry.name))
+            if _excluded(child, excludes):
+                continue
+            if skip_content and entry.name != "CACHEDIR.TAG":
+                continue
+            st = entry.stat(follow_symlinks=False)
+            meta = [st.st_mode & 0o7777, st.st_uid, st.st_gid, st.st_mtime_ns]
+            if stat.S_ISDIR(st.st_mode):
+                entries.append([child, DIRECTORY] + meta + [None])
+                if st.st_dev == root_dev:
+                    # --one-file-system
+                    _walk(child)
+            elif stat.S_ISLNK(st.st_mode):
+                entries.append([child, SYMLINK] + meta + [os.readlink(entry.path)])
+            elif stat.S_ISREG(st.st_mode):
+                if st.st_nlink > 1 and (st.st_dev, st.st_ino) in inodes:
+                    entries.append([child, HARDLINK] + meta + [inodes[(st.st_dev, st.st_ino)]])
+                    continue
+                inodes[(st.st_dev, st.st_ino)] = child
+                entries.append([child, FILE] + meta + [add_file(entry.path, st)])
+            else:
+                entries.append([child, SPECIAL] + meta + [[st.st_mode, st.st_rdev]])
+
+    _walk(".")
+    return entries
+
+
+def _apply_tree(entries, root, create_file):
+    """
+    Re-create the tree ENTRIES in ROOT, CREATE_FILE(data, dst) creates the
+    regular files.
+    """
+    directories = []
+    for path, kind, mode, uid, gid, mtime_ns, data in entries:
+        dst = os.path.join(root, path)
+        if kind == DIRECTORY:
+            os.makedirs(dst, exist_ok=True)
+            directories.append((dst, mode, uid, gid, mtime_ns))
+            continue
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            # unpacking over existing tree, like tar does
+            file_util.rmtree(dst)
+        else:
+            file_util.unlink_if_exists(dst)
+        if kind == FILE:
+            create_file(data, dst)
+        elif kind == HARDLINK:
+            os.link(os.path.join(root, data), dst)
+        elif kind == SYMLINK:
+            os.symlink(data, dst)
+            os.lchown(dst, uid, gid)
+            os.utime(dst, ns=(mtime_ns, mtime_ns), follow_symlinks=False)
+        else:
+            os.mknod(dst, data[0], data[1])
+            os.chown(dst, uid, gid)
+            os.chmod(dst, mode)
+
+    # directory metadata at the end, once the content is created
+    for dst, mode, uid, gid, mtime_ns in reversed(directories):
+        os.chown(dst, uid, gid)
+        os.chmod(dst, mode)
+        os.utime(dst, ns=(mtime_ns, mtime_ns))
+
+
+@traceLog()
+def pack(store, root, tree_file, excludes=()):
+    """
+    Put the ROOT directory into the STORE, and describe it in TREE_FILE.
+    EXCLUDES is a list of relative (./foo) paths not to be stored.
+    """
+    with store.locked():
+        entries = _walk_tree(root, excludes, store.add)
+        tmp = tree_file + ".tmp"
+        with gzip.open(tmp, "wt") as f:
+            json.dump({"version": TREE_VERSION, "entries": entries}, f,
+                      separators=(",", ":"))
+        os.replace(tmp, tree_file)
+        store.register(os.path.abspath(tree_file))
+
+
+@traceLog()
+def unpack(store, tree_file, root):
+    """ Re-create the ROOT directory from the STORE, as described in TREE_FILE """
+    tree = read_tree(tree_file)
+    with store.locked():
+        _apply_tree(tree["entries"], root, store.materialize)
+
+
+@traceLog()
+def clone_tree(src, dst, linker, excludes=()):
+    """
+    Populate DST with the content of the SRC directory, the regular files are
+    created by LINKER (reflinked, hardlinked or copied).
+    """
+    entries = _walk_tree(src, excludes, lambda path, st: path)
+    os.makedirs(dst, exist_ok=True)
+    _apply_tree(entries, dst, linker.link)
+
+
+def reflink_supported(directory):
+    """ Detect whether the filesystem of DIRECTORY supports reflinks """
+    src = os.path.join(directory, ".reflink-test-{0}".format(os.getpid()))
+    dst = src + ".clone"
+    try:
+        with open(src, "wb") as f:
+            f.write(b"mock")
+        file_util.reflink(src, dst)
+        return True
+    except OSError:
+        return False
+    finally:
+        file_util.unlink_if_exists(src)
+        file_util.unlink_if_exists(dst)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+Host-wide pool of the RPM packages downloaded by the package managers, shared
+by the package manager caches of all the configs (see the yum_cache plugin).
+
+The packages are stored by the checksum taken from the repository metadata,
+so the pool doesn't depend on the repo ids or URLs: the same noarch package
+downloaded for fedora-rawhide-x86_64 is found for fedora-rawhide-i386, for
+the bootstrap chroot and for any --uniqueext.  Before the package manager
+runs, the packages listed in the cached repo metadata and present in the
+pool are hardlinked into the per-config cache (where DNF verifies their
+checksum and doesn't download them again) - once for each version of the
+repo metadata, not on each package manager call.  After it runs, the newly
+downloaded packages are added to the pool.
+
+Layout of the pool:
+
+    <pool>/<checksum type>/ab/abcdef...   the packages
+    <pool>/pool.lock                      shared by expose/collect, exclusive by gc
+
+Packages not linked from any config cache (st_nlink == 1) are removed by gc.
+"""
+
+import bz2
+import contextlib
+import errno
+import fcntl
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import re
+import shutil
+import subprocess
+from xml.etree import ElementTree
+
+from . import file_util
+from .trace_decorator import getLog, traceLog
+
+REPO_NS = "{http://linux.duke.edu/metadata/repo}"
+COMMON_NS = "{http://linux.duke.edu/metadata/common}"
+
+# cache of the parsed primary metadata, in the repo cache directory
+MAP_FILE = "mock-rpm-pool.json"
+
+# checksum types in the metadata => hashlib names
+HASHES = {"sha": "sha1"}
+
+_KEY_RE = re.compile(r"^[a-z0-9]+/[0-9a-f]+$")
+
+
+@contextlib.contextmanager
+def _open_metadata(path):
+    """ Open the (possibly compressed) metadata file for reading """
+    if path.endswith(".zst"):
+        proc = subprocess.Popen(["zstd", "-dcq", path], stdout=subprocess.PIPE)
+        try:
+            yield proc.stdout
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        return
+    opener = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}.get(
+        os.path.splitext(path)[1], open)
+    with opener(path, "rb") as f:
+        yield f
+
+
+def primary_path(repodir):
+    """ Path to the primary metadata file of the cached repo in REPODIR """
+    root = ElementTree.parse(os.path.join(repodir, "repodata", "repomd.xml")).getroot()
+    for data in root.iter(REPO_NS + "data"):
+        if data.get("type") == "primary":
+            return os.path.join(repodir, data.find(REPO_NS + "location").get("href"))
+    return None
+
+
+def read_checksums(primary):
+    """ Return {"<checksum type>/<checksum>": "<package file name>"} from PRIMARY """
+    packages = {}
+    with _open_metadata(primary) as f:
+        for _, elem in ElementTree.iterparse(f):
+            if elem.tag != COMMON_NS + "package":
+                continue
+            checksum = elem.find(COMMON_NS + "checksum")
+            location = elem.find(COMMON_NS + "location")
+            if checksum is not None and location is not None:
+                key = "{0}/{1}".format(checksum.get("type"), checksum.text.strip())
+                if _KEY_RE.match(key):
+                    packages[key] = os.path.basename(location.get("href"))
+            elem.clear()
+    return packages
+
+
+class RpmPool:
+    """ The pool of packages shared by all the configs """
+
+    def __init__(self, topdir):
+        self.topdir = topdir
+        self.disabled = False
+        # repodir => primary metadata stamp, already exposed
+        self._exposed = {}
+
+    @contextlib.contextmanager
+    def locked(self, shared=True):
+        """ Lock the pool, shared for expose/collect, exclusive for gc """
+        file_util.mkdirIfAbsent(self.topdir)
+        with open(os.path.join(self.topdir, "pool.lock"), "a+") as lock:
+            fcntl.lockf(lock.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(lock.fileno(), fcntl.LOCK_UN)
+
+    def object_path(self, key):
+        checksum_type, checksum = key.split("/")
+        return os.path.join(self.topdir, checksum_type, checksum[:2], checksum)
+
+    def keys(self):
+        """ Checksums of the packages in the pool """
+        keys = set()
+        with os.scandir(self.topdir) as types:
+            for checksum_type in types:
+                if not checksum_type.is_dir():
+                    continue
+                for prefix in os.listdir(checksum_type.path):
+                    for name in os.listdir(os.path.join(checksum_type.path, prefix)):
+                        keys.add("{0}/{1}".format(checksum_type.name, name))
+        return keys
+
+    @staticmethod
+    def _primary_stamp(repodir):
+        primary = primary_path(repodir)
+        if primary is None:
+            return None, None
+        st = os.stat(primary)
+        return primary, [os.path.basename(primary), st.st_size, st.st_mtime_ns]
+
+    @staticmethod
+    def repo_packages(repodir):
+        """
+        The packages of the repo cached in REPODIR, parsed from the primary
+        metadata once, and stored in REPODIR/mock-rpm-pool.json
+        """
+        primary, stamp = RpmPool._primary_stamp(repodir)
+        if primary is None:
+            return {}
+        map_file = os.path.join(repodir, MAP_FILE)
+        try:
+            with open(map_file) as f:
+                data = json.load(f)
+            if data["primary"] == stamp:
+                return data["packages"]
+        except (OSError, ValueError, KeyError):
+            pass
+        if primary.endswith(".zst") and not shutil.which("zstd"):
+            getLog().debug("zstd not installed, can not read %s", primary)
+            return {}
+        packages = read_checksums(primary)
+        with open(map_file + ".tmp", "w") as f:
+            json.dump({"primary": stamp, "packages": packages}, f)
+        os.replace(map_file + ".tmp", map_file)
+        return packages
+
+    def _link(self, src, dst):
+        try:
+            os.link(src, dst)
+            return True
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                getLog().warning("RPM pool %s is on different filesystem than %s, disabled",
+                                 self.topdir, dst)
+                self.disabled = True
+            elif e.errno not in (errno.EEXIST, errno.ENOENT):
+                raise
+        return False
+
+    @staticmethod
+    def _repos(cache_dir):
+        for name in sorted(os.listdir(cache_dir)):
+            repodir = os.path.join(cache_dir, name)
+            if os.path.exists(os.path.join(repodir, "repodata", "repomd.xml")):
+                yield repodir
+
+    def _repo_packages(self, repodir):
+        try:
+            return self.repo_packages(repodir)
+        except (OSError, ElementTree.ParseError) as e:
+            getLog().debug("can not read metadata of %s: %s", repodir, e)
+            return {}
+
+    @traceLog()
+    def expose(self, cache_dir):
+        """
+        Hardlink the packages from pool into the repo directories in the
+        package manager CACHE_DIR, return the number of linked packages.
+        Repos already exposed with the same metadata are skipped.
+        """
+        linked = 0
+        with self.locked():
+            available = None
+            for repodir in self._repos(cache_dir):
+                try:
+                    stamp = self._primary_stamp(repodir)[1]
+                except (OSError, ElementTree.ParseError) as e:
+                    getLog().debug("can not read metadata of %s: %s", repodir, e)
+                    continue
+                if stamp is None or self._exposed.get(repodir) == stamp:
+                    continue
+                packages = self._repo_packages(repodir)
+                if available is None:
+                    available = self.keys()
+                pkgdir = os.path.join(repodir, "packages")
+                for key in available.intersection(packages):
+                    dst = os.path.join(pkgdir, packages[key])
+                    if self.disabled:
+                        return linked
+                    if os.path.exists(dst):
+                        continue
+                    file_util.mkdirIfAbsent(pkgdir)
+                    linked += self._link(self.object_path(key), dst)
+                self._exposed[repodir] = stamp
+        return linked
+
+    def _add(self, key, path):
+        checksum_type, checksum = key.split("/")
+        try:
+            digest = hashlib.new(HASHES.get(checksum_type, checksum_type))
+        except ValueError:
+            return False
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != checksum:
+            # partial download, or an old package with the same name
+            return False
+        obj = self.object_path(key)
+        file_util.mkdirIfAbsent(os.path.dirname(obj))
+        if self._link(path, obj):
+            return True
+        if os.path.exists(obj):
+            # already pooled by other config, share the pooled copy
+            tmp = path + ".pool"
+            if self._link(obj, tmp):
+                os.replace(tmp, path)
+                return True
+        return False
+
+    @traceLog()
+    def collect(self, cache_dir):
+        """
+        Add the packages downloaded into CACHE_DIR (not hardlinked yet) into
+        the pool, return the number of added packages.
+        """
+        added = 0
+        with self.locked():
+            for repodir in self._repos(cache_dir):
+                pkgdir = os.path.join(repodir, "packages")
+                if not os.path.isdir(pkgdir):
+                    continue
+                names = None
+                with os.scandir(pkgdir) as it:
+                    for entry in it:
+                        if self.disabled:
+                            return added
+                        if not entry.name.endswith(".rpm") or \
+                                entry.stat(follow_symlinks=False).st_nlink != 1:
+                            continue
+                        if names is None:
+                            names = {name: key for key, name in self._repo_packages(repodir).items()}
+                        key = names.get(entry.name)
+                        if key is not None:
+                            added += self._add(key, entry.path)
+        return added
+
+    @traceLog()
+    def gc(self):
+        """ Remove the packages not linked from any config cache """
+        removed = 0
+        with self.locked(shared=False):
+            for key in self.keys():
+                obj = self.object_path(key)
+                if os.stat(obj).st_nlink == 1:
+                    os.unlink(obj)
+                    removed += 1
+        getLog().debug("RPM pool gc: %s packages removed", removed)
+        return removed
@@ -1,10 +1,36 @@
 # -*- coding: utf-8 -*-
 # vim: noai:ts=4:sw=4:expandtab
 
+import json
+import os
+import resource
+import time
+
 from .exception import StateError
 from .trace_decorator import getLog
 
 
+def _cpu_times():
+    """ user and system CPU seconds of mock and its (finished) subprocesses """
+    mock = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return mock.ru_utime + children.ru_utime, mock.ru_stime + children.ru_stime
+
+
+def _io_counters():
+    """ read_bytes and write_bytes of mock (including the waited subprocesses) """
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in ("read_bytes", "write_bytes"):
+                    counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
 class State(object):
     def __init__(self, bootstrap=None):
         self._state = []
@@ -12,6 +38,9 @@ class State(object):
         self.result = "unknown"
         self.bootstrap = bootstrap
         self.state_log = getLog("mockbuild.Root.state")
+        # timing records of the started states, in the order of start()
+        self.timings = []
+        self._timing_stack = []
 
     def state(self):
         if not len(self._state):
@@ -22,6 +51,17 @@ class State(object):
         if state is None:
             raise StateError("start called with None State")
         self._state.append(state)
+        record = {
+            "name": state,
+            "bootstrap": bool(self.bootstrap),
+            "depth": len(self._state) - 1,
+            "start": time.monotonic(),
+            "end": None,
+        }
+        record["_cpu"] = _cpu_times()
+        record["_io"] = _io_counters()
+        self.timings.append(record)
+        self._timing_stack.append(record)
         if self.bootstrap:
             self.state_log.info("Start(bootstrap): %s", state)
         else:
@@ -31,6 +71,7 @@ class State(object):
         if len(self._state) == 0:
             raise StateError("finish called on empty state list")
         current = self._state.pop()
+        self._finish_timing(self._timing_stack.pop())
         if state != current:
             raise StateError("state finish mismatch: current: %s, state: %s" % (current, state))
         if self.bootstrap:
@@ -38,6 +79,70 @@ class State(object):
         else:
             self.state_log.info("Finish: %s", state)
 
+    @staticmethod
+    def _finish_timing(record):
+        record["end"] = time.monotonic()
+        record["duration"] = record["end"] - record["start"]
+        user, system = _cpu_times()
+        record["cpu_user"] = user - record["_cpu"][0]
+        record["cpu_system"] = system - record["_cpu"][1]
+        io = _io_counters()
+        for key, value in record["_io"].items():
+            record[key] = io.get(key, value) - value
+
+    def drop_finished_timings(self):
+        """ Forget the timings of the finished states (already dumped) """
+        self.timings = [record for record in self.timings if record["end"] is None]
+
     def alldone(self):
         if len(self._state) != 0:
             raise StateError("alldone called with pending states: %s" % ",".join(self._state))
+
+
+def write_timings(states, resultdir, finished_only=False):
+    """
+    Dump the timings of the STATES (main and bootstrap State) into RESULTDIR,
+    as 'timings.json' and as 'timings.trace.json' in the Chrome trace event
+    format (open it in chrome://tracing or https://ui.perfetto.dev).
+    States not finished yet (e.g. because of an exception) are closed now,
+    and marked as unfinished - or skipped with FINISHED_ONLY (e.g. the 'run'
+    state when dumping the timings of one --chain package).
+    """
+    records = []
+    for state in states:
+        if finished_only:
+            records += [record for record in state.timings if record["end"] is not None]
+            continue
+        for record in state._timing_stack:  # pylint: disable=protected-access
+            if record["end"] is None:
+                State._finish_timing(record)  # pylint: disable=protected-access
+                record["unfinished"] = True
+        records += state.timings
+    if not records:
+        return
+    origin = min(record["start"] for record in records)
+
+    timings = []
+    events = []
+    for record in sorted(records, key=lambda r: r["start"]):
+        data = {key: value for key, value in record.items() if not key.startswith("_")}
+        data["start"] = record["start"] - origin
+        data["end"] = record["end"] - origin
+        timings.append(data)
+        events.append({
+            "name": record["name"],
+            "cat": "bootstrap" if record["bootstrap"] else "buildroot",
+            "ph": "X",
+            "ts": int(data["start"] * 1e6),
+            "dur": int(record["duration"] * 1e6),
+            "pid": os.getpid(),
+            "tid": 2 if record["bootstrap"] else 1,
+            "args": {key: data[key] for key in
+                     ("cpu_user", "cpu_system", "read_bytes", "write_bytes", "unfinished")
+                     if key in data},
+        })
+
+    with open(os.path.join(resultdir, "timings.json"), "w") as f:
+        json.dump(timings, f, indent=2)
+    with open(os.path.join(resultdir, "timings.trace.json"), "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
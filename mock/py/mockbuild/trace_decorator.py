@@ -4,29 +4,47 @@
 # Written by Michael Brown
 # Copyright (C) 2007 Michael E Brown <mebrown@michaels-house.net>
 
+import atexit
+import collections
 import functools
-import inspect
 import logging
 import os
 import sys
+import time
 
 
 # defaults to module verbose log
 # does a late binding on log. Forwards all attributes to logger.
 # works around problem where reconfiguring the logging module means loggers
 # configured before reconfig dont output.
+# The instances are cached per logger name, so getLog() is cheap enough to be
+# called in the frequently called functions.
 class getLog(object):
     # pylint: disable=unused-argument,too-few-public-methods
-    def __init__(self, name=None, prefix="", *args, **kargs):
-        if name is None:
-            frame = inspect.getouterframes(inspect.currentframe())[1][0]
-            name = frame.f_globals["__name__"]
+    _instances = {}
 
-        self.name = prefix + name
+    def __new__(cls, name=None, prefix="", *args, **kargs):
+        if name is None:
+            # pylint: disable=protected-access
+            name = sys._getframe(1).f_globals["__name__"]
+        name = prefix + name
+        instance = cls._instances.get(name)
+        if instance is None:
+            instance = super().__new__(cls)
+            instance.name = name
+            instance._logger = None
+            cls._instances[name] = instance
+        return instance
 
     def __getattr__(self, name):
-        logger = logging.getLogger(self.name)
-        return getattr(logger, name)
+        if self._logger is None:
+            self._logger = logging.getLogger(self.name)
+        value = getattr(self._logger, name)
+        if callable(value):
+            # bound methods of the logger (debug, info, ...), skip the
+            # __getattr__ next time
+            setattr(self, name, value)
+        return value
 
 
 # emulates logic in logging module to ensure we only log
@@ -49,11 +67,61 @@ def safe_repr(arg):
     except AttributeError:
         return str(type(arg))
 
+# Ring buffer of the (function, enter time, leave time, raised) records, used
+# by traceLog() when MOCK_TRACE_LOG=ring.  Dumped at exit, see flush_trace().
+_TRACE_BUFFER = collections.deque(
+    maxlen=int(os.environ.get("MOCK_TRACE_BUFFER_SIZE", "65536")))
+
+
+def flush_trace(output=None):
+    """
+    Write the traceLog() ring buffer into the OUTPUT file (MOCK_TRACE_FILE
+    environment variable by default), one tab separated
+    "function  enter  leave  raised" line per call, the times are
+    time.monotonic() seconds.  Without output file the records go to the
+    "trace" logger.
+    """
+    output = output or os.environ.get("MOCK_TRACE_FILE")
+    records, fmt = list(_TRACE_BUFFER), "%s\t%.6f\t%.6f\t%s"
+    _TRACE_BUFFER.clear()
+    if output:
+        with open(output, "w") as f:
+            for record in records:
+                f.write(fmt % record + "\n")
+        return
+    log = logging.getLogger("trace")
+    for record in records:
+        log.info(fmt, *record)
+
+
 def traceLog(logger=None):
     def noop(func):
         return func
 
+    def ring(func):
+        name = "%s.%s" % (func.__module__, func.__qualname__)
+        append = _TRACE_BUFFER.append
+        clock = time.monotonic
+
+        @functools.wraps(func)
+        def trace(*args, **kw):
+            enter = clock()
+            try:
+                result = func(*args, **kw)
+            except BaseException:
+                append((name, enter, clock(), True))
+                raise
+            append((name, enter, clock(), False))
+            return result
+        return trace
+
     def decorator(func):
+        # computed once, not on every call
+        filename = os.path.normcase(func.__code__.co_filename)
+        lineno = func.__code__.co_firstlineno
+        func_name = func.__name__
+        default_logger = logging.getLogger("trace.%s" % func.__module__)
+
         @functools.wraps(func)
         def trace(*args, **kw):
             # default to logger that was passed by module, but
@@ -61,19 +129,16 @@ def traceLog(logger=None):
             # make sure this doesn't conflict with one of the parameters
             # you are expecting
 
-            filename = os.path.normcase(inspect.getsourcefile(func))
-            func_name = func.__name__
-            if hasattr(func, 'func_code'):
-                lineno = func.func_code.co_firstlineno
-            else:
-                lineno = func.__code__.co_firstlineno
-
             l2 = kw.get('logger', logger)
             if l2 is None:
-                l2 = logging.getLogger("trace.%s" % func.__module__)
+                l2 = default_logger
             if isinstance(l2, str):
                 l2 = logging.getLogger(l2)
 
+            if l2.manager.disable >= logging.INFO or not l2.isEnabledFor(logging.INFO):
+                # nothing would be logged, don't format the arguments
+                return func(*args, **kw)
+
             message = "ENTER %s("
             message = message + ', '.join([safe_repr(arg) for arg in args])
             if args and kw:
@@ -82,9 +147,10 @@ def traceLog(logger=None):
                 message = message + "%s=%s" % (k, safe_repr(v))
             message = message + ")"
 
-            frame = inspect.getouterframes(inspect.currentframe())[1][0]
+            # pylint: disable=protected-access
+            frame = sys._getframe(1)
             doLog(l2, logging.INFO, os.path.normcase(frame.f_code.co_filename),
-                  frame.f_lineno, message, args=[func_name], exc_info=None,
+                  frame.f_lineno, message, args=(func_name,), exc_info=None,
                   func=frame.f_code.co_name)
             try:
                 result = "Bad exception raised: Exception was not a derived "\
@@ -94,27 +160,35 @@ def traceLog(logger=None):
                 except (KeyboardInterrupt, Exception) as e:
                     result = "EXCEPTION RAISED"
                     doLog(l2, logging.INFO, filename, lineno,
-                          "EXCEPTION: %s\n", args=[e],
+                          "EXCEPTION: %s\n", args=(e,),
                           exc_info=sys.exc_info(), func=func_name)
                     raise
             finally:
                 doLog(l2, logging.INFO, filename, lineno,
-                      "LEAVE %s --> %s\n", args=[func_name, result],
+                      "LEAVE %s --> %s\n", args=(func_name, result),
                       exc_info=None, func=func_name)
 
             return result
         return trace
         #end of trace()
 
-    if os.environ.get("MOCK_TRACE_LOG", "false") == "false":
+    mode = os.environ.get("MOCK_TRACE_LOG", "false")
+    if mode == "false":
         return noop
 
+    if mode == "ring":
+        return ring
+
     if logging.getLogger("trace").propagate:
         return decorator
     else:
         return noop
 
 
+if os.environ.get("MOCK_TRACE_LOG") == "ring":
+    atexit.register(flush_trace)
+
+
 # unit tests...
 if __name__ == "__main__":
     logging.basicConfig(
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:textwidth=0:
+# License: GPL2 or later see COPYING
+
+"""
+Deferred removal of the old buildroots (config_opts['deferred_cleanup']).
+
+Instead of removing the whole chroot before the new build can start, the
+old directory is atomically renamed into the ".trash" directory next to it
+(so on the same filesystem), and removed later by a detached "reaper"
+process running with idle I/O priority.  The reaper is started by each mock
+process which puts something into the trash, or which finds the trash not
+empty and no reaper running (e.g. after a reboot).
+"""
+
+import argparse
+import errno
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from . import file_util
+from .exception import Error
+from .trace_decorator import getLog
+
+TRASH_DIRNAME = ".trash"
+LOCK_FILE = ".reaper.lock"
+
+
+def trash_dir(path):
+    """ The trash directory for PATH, on the same filesystem """
+    return os.path.join(os.path.dirname(os.path.normpath(path)), TRASH_DIRNAME)
+
+
+def move_to_trash(path):
+    """
+    Atomically move the directory PATH into the trash, return the trash
+    directory, or None if not possible (e.g. PATH is a mountpoint or not on
+    the same filesystem as its parent directory).
+    """
+    trash = trash_dir(path)
+    target = os.path.join(trash, "{0}.{1}.{2}".format(
+        os.path.basename(os.path.normpath(path)), int(time.time()), os.getpid()))
+    try:
+        file_util.mkdirIfAbsent(trash)
+        os.rename(path, target)
+    except (OSError, Error) as e:
+        if getattr(e, "errno", None) == errno.ENOENT:
+            return trash
+        getLog().debug("can not move %s to trash: %s", path, e)
+        return None
+    getLog().info("moved %s to %s, it will be removed in background", path, target)
+    return trash
+
+
+def pending(trash):
+    """ True if there's something in the TRASH directory to remove """
+    try:
+        return any(name != LOCK_FILE for name in os.listdir(trash))
+    except FileNotFoundError:
+        return False
+
+
+def start_reaper(trash, selinux=False):
+    """
+    Start the detached process removing the content of the TRASH directory,
+    with the idle I/O (and lowest CPU) priority.  Does nothing if a reaper
+    is already running.
+    """
+    if _locked(trash):
+        return
+    cmd = [sys.executable, "-m", "mockbuild.trash", trash]
+    if selinux:
+        cmd.append("--selinux")
+    cmd = ["nice", "-n", "19"] + cmd
+    if shutil.which("ionice"):
+        cmd = ["ionice", "-c", "3"] + cmd
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, env=env, start_new_session=True,
+                     close_fds=True)
+
+
+def _locked(trash):
+    """ True if there's a reaper running for TRASH """
+    try:
+        with open(os.path.join(trash, LOCK_FILE), "a+") as lock:
+            fcntl.lockf(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    return False
+
+
+def reap(trash, selinux=False):
+    """
+    Remove everything in the TRASH directory, until it is empty.  Only one
+    reaper works on the TRASH at a time, return False if another one is
+    running.
+    """
+    with open(os.path.join(trash, LOCK_FILE), "a+") as lock:
+        try:
+            fcntl.lockf(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        failed = set([LOCK_FILE])
+        while True:
+            entries = [name for name in os.listdir(trash) if name not in failed]
+            if not entries:
+                return True
+            for name in entries:
+                path = os.path.join(trash, name)
+                try:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        file_util.rmtree(path, selinux=selinux, parallel=True)
+                    else:
+                        file_util.unlink_if_exists(path)
+                except OSError as e:
+                    # e.g. forgotten mountpoint, try again next time
+                    getLog().error("can not remove %s: %s", path, e)
+                    failed.add(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="mockbuild.trash", description=__doc__)
+    parser.add_argument("trash")
+    parser.add_argument("--selinux", action="store_true")
+    args = parser.parse_args()
+    reap(args.trash, args.selinux)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,26 @@ import atexit
 import ctypes
 import errno
 import grp
+import json
 import multiprocessing
 import os
 import pwd
 import sys
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import contextmanager
 
-from .trace_decorator import traceLog
+from .trace_decorator import getLog, traceLog
 
 _libc = ctypes.CDLL(None, use_errno=True)
 
+# threads used by the recursive changeOwner(); like the tree removal, this
+# mostly waits for the filesystem
+CHOWN_WORKERS = min(8, (os.cpu_count() or 1) * 4)
+
+# changeOwner(..., marker=True) remembers the mtime of the fixed directories
+# in this file, in the top directory
+CHOWN_MARKER = ".mock-chown.json"
+
 
 @traceLog()
 def setup_uid_manager():
@@ -135,19 +144,21 @@ class UidManager(object):
         setresuid(uid, uid, 0)
 
     @traceLog()
-    def changeOwner(self, path, uid=None, gid=None, recursive=False):
+    def changeOwner(self, path, uid=None, gid=None, recursive=False, marker=False):
+        """
+        Change owner of PATH (to the unprivileged user by default).  With
+        RECURSIVE the whole tree is fixed by chown_tree(), see there for
+        MARKER.
+        """
         self._elevatePrivs()
         if uid is None:
             uid = self.unprivUid
         if gid is None:
             gid = self.unprivGid
-        self._tolerant_chown(path, uid, gid)
         if recursive:
-            for root, dirs, files in os.walk(path):
-                for d in dirs:
-                    self._tolerant_chown(os.path.join(root, d), uid, gid)
-                for f in files:
-                    self._tolerant_chown(os.path.join(root, f), uid, gid)
+            chown_tree(path, uid, gid, marker=marker)
+        else:
+            self._tolerant_chown(path, uid, gid)
 
     @staticmethod
     def _tolerant_chown(path, uid, gid):
@@ -199,6 +210,102 @@ class UidManager(object):
                                      method, *args, **kwargs)
             return future.result()
 
+
+def _lchown_entry(path, st, uid, gid):
+    """ lchown() PATH with stat ST, unless already owned by UID:GID """
+    if st.st_uid == uid and st.st_gid == gid:
+        return
+    try:
+        os.lchown(path, uid, gid)
+    except FileNotFoundError:
+        pass
+
+
+def _chown_directory(directory, rel, uid, gid, known):
+    """
+    Fix ownership of the entries in DIRECTORY (RELative to the top of the
+    tree).  When the directory is KNOWN to have the mtime it had after the
+    last fix, its entries are the same as then and only the subdirectories
+    are looked at.  Return the list of (path, rel, stat) of subdirectories.
+    """
+    subdirs = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if known and not entry.is_dir(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                _lchown_entry(entry.path, st, uid, gid)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append((entry.path, os.path.join(rel, entry.name), st))
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return subdirs
+
+
+def chown_tree(path, uid, gid, marker=False):
+    """
+    Recursively change owner of PATH to UID:GID.  Entries already owned
+    correctly are not touched, and the directories are processed in parallel
+    by CHOWN_WORKERS threads.
+
+    With MARKER, the mtimes of the fixed directories are remembered in
+    PATH/.mock-chown.json.  Directories with unchanged mtime have the same
+    entries as after the last run (only the subdirectories need a look), so
+    a tree which is already correct costs one readdir() per directory.
+    Meant for trees written only by UID (e.g. ccache), where the entries
+    are not chowned to somebody else in place.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    _lchown_entry(path, st, uid, gid)
+    if not os.path.isdir(path) or os.path.islink(path):
+        return
+
+    marker_path = os.path.join(path, CHOWN_MARKER)
+    known = {}
+    if marker:
+        try:
+            with open(marker_path) as f:
+                data = json.load(f)
+            if data["uid"] == uid and data["gid"] == gid:
+                known = data["dirs"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        if not os.path.exists(marker_path):
+            # create it now, so the new mtime of PATH is recorded below
+            with open(marker_path, "a"):
+                pass
+            st = os.lstat(path)
+
+    fixed = {}
+    level = [(path, ".", st)]
+    with ThreadPoolExecutor(CHOWN_WORKERS) as executor:
+        while level:
+            for _, rel, dir_st in level:
+                fixed[rel] = dir_st.st_mtime_ns
+            results = executor.map(
+                lambda d: _chown_directory(d[0], d[1], uid, gid,
+                                           known.get(d[1]) == d[2].st_mtime_ns),
+                level)
+            level = [subdir for subdirs in results for subdir in subdirs]
+
+    if marker:
+        try:
+            # rewritten in place, not to change the mtime of PATH
+            with open(marker_path, "r+") as f:
+                f.truncate()
+                json.dump({"uid": uid, "gid": gid, "dirs": fixed}, f)
+            _lchown_entry(marker_path, os.lstat(marker_path), uid, gid)
+        except OSError as e:
+            getLog().debug("can not write %s: %s", marker_path, e)
+
+
 def getresuid():
     ruid = ctypes.c_long()
     euid = ctypes.c_long()
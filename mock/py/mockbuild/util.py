@@ -8,6 +8,7 @@
 from __future__ import print_function
 
 import atexit
+import codecs
 import contextlib
 import ctypes
 import errno
@@ -99,7 +100,11 @@ def cmd_pretty(cmd, env=None):
 
 
 @traceLog()
-def get_proxy_environment(config):
+def get_proxy_environment(config, package_manager=False):
+    """
+    Return the proxy variables for the environment, the caching proxy is
+    used only by the PACKAGE_MANAGER (not by the build itself)
+    """
     env = {}
     for proto in ('http', 'https', 'ftp', 'no'):
         key = '%s_proxy' % proto
@@ -108,6 +113,9 @@ def get_proxy_environment(config):
             env[key] = value
         elif os.getenv(key):
             env[key] = os.getenv(key)
+    if package_manager and config.get('caching_proxy'):
+        # the caching proxy forwards to the configured http_proxy itself
+        env['http_proxy'] = "http://127.0.0.1:{0}/".format(config['caching_proxy_port'])
     return env
 
 
@@ -170,32 +178,177 @@ def get_pid_cmdline(pid):
         return f"ERROR: Can not read {pid} file {e}"
 
 
+CGROUP_MOUNT = "/sys/fs/cgroup"
+
+
+@contextlib.contextmanager
+def _root_privileges():
+    """ Temporarily regain root, raises OSError if not possible """
+    saved = (os.getuid(), os.geteuid())
+    setresuid(0, 0, 0)
+    try:
+        yield
+    finally:
+        setresuid(*saved)
+
+
+# cgroup v2 directory collecting the processes spawned by this mock process,
+# None if not initialized yet, False if not available
+_TRACKING_CGROUP = None
+
+
+def tracking_cgroup():
+    """
+    Return the cgroup v2 directory where the processes spawned by mock (see
+    ChildPreExec) are moved, and so where any leftover process started in
+    a chroot ends up.  It is a sub-group of the mock's own cgroup, created
+    lazily.  None if cgroup v2 isn't available (or not writable, e.g. not
+    running as root).
+    """
+    global _TRACKING_CGROUP
+    if _TRACKING_CGROUP is None:
+        _TRACKING_CGROUP = False
+        try:
+            if not os.path.exists(os.path.join(CGROUP_MOUNT, "cgroup.controllers")):
+                return None
+            with open("/proc/self/cgroup") as f:
+                own = [line[3:].strip() for line in f if line.startswith("0::")]
+            if not own:
+                return None
+            path = os.path.join(CGROUP_MOUNT, own[0].lstrip("/"), "mock-%d" % os.getpid())
+            with _root_privileges():
+                os.mkdir(path)
+        except OSError as e:
+            getLog().debug("cgroup process tracking not available: %s", e)
+            return None
+        _TRACKING_CGROUP = path
+        atexit.register(_remove_tracking_cgroup, path)
+    return _TRACKING_CGROUP or None
+
+
+def _remove_tracking_cgroup(path):
+    try:
+        with _root_privileges():
+            os.rmdir(path)
+    except OSError:
+        # processes still running there, the kernel keeps the group
+        pass
+
+
+def _tracked_pids():
+    """ PIDs of the processes in the tracking cgroup, None if not available """
+    cgroup = _TRACKING_CGROUP
+    if not cgroup:
+        return None
+    try:
+        with open(os.path.join(cgroup, "cgroup.procs")) as f:
+            return [int(line) for line in f]
+    except OSError:
+        # removed under our hands
+        return None
+
+
+def _pidfd(pid):
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def _kill_pids(pids, rootToKill):
+    """
+    Kill the processes PIDS, SIGTERM first and SIGKILL those still running
+    after a short grace period.  The pidfds are used (if supported), so no
+    recycled PID can be hit.  When the remaining processes are the whole
+    tracking cgroup, it is killed at once by cgroup.kill.
+    """
+    pidfds = {pid: _pidfd(pid) for pid in pids}
+    try:
+        for pid in pids:
+            getLog().warning("Leftover process %s is being killed with signal %s: %s",
+                             pid, signal.SIGTERM, get_pid_cmdline(pid))
+            try:
+                if pidfds[pid] is not None:
+                    signal.pidfd_send_signal(pidfds[pid], signal.SIGTERM)
+                else:
+                    os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        running = [fd for fd in pidfds.values() if fd is not None]
+        deadline = time.monotonic() + 1
+        while running and time.monotonic() < deadline:
+            ready, _, _ = select.select(running, [], [], deadline - time.monotonic())
+            running = [fd for fd in running if fd not in ready]
+
+        survivors = [pid for pid in pids
+                     if pidfds[pid] is None or pidfds[pid] in running]
+        if not survivors:
+            return
+        tracked = _tracked_pids()
+        if tracked is not None and set(tracked) == set(survivors) and \
+                os.path.exists(os.path.join(_TRACKING_CGROUP, "cgroup.kill")):
+            getLog().warning("Killing leftover processes %s in %s with cgroup.kill",
+                             survivors, rootToKill)
+            try:
+                with _root_privileges(), \
+                        open(os.path.join(_TRACKING_CGROUP, "cgroup.kill"), "w") as f:
+                    f.write("1")
+                return
+            except OSError as e:
+                getLog().debug("cgroup.kill failed: %s", e)
+        for pid in survivors:
+            getLog().warning("Leftover process %s is being killed with signal %s: %s",
+                             pid, signal.SIGKILL, get_pid_cmdline(pid))
+            try:
+                if pidfds[pid] is not None:
+                    signal.pidfd_send_signal(pidfds[pid], signal.SIGKILL)
+                else:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+            except OSError:
+                pass
+    finally:
+        for fd in pidfds.values():
+            if fd is not None:
+                os.close(fd)
+
+
 @traceLog()
-def orphansKill(rootToKill, manual_forced=False):
+def orphansKill(rootToKill, manual_forced=False, tracked_only=False):
     """
     Kill off anything that is still chrooted.
 
     When USE_NSPAWN==False, this method manually detects the running processes
-    in chroot by reading the /proc file-system.  When USE_NSPAWN==True, it just
-    relies on '/bin/machinectl terminate' call.
+    in chroot.  When USE_NSPAWN==True, it just relies on '/bin/machinectl
+    terminate' call.
 
-    When manual_forced==True, the manual kill based on /proc is enforced.
+    When manual_forced==True, the manual kill is enforced.
+
+    When tracked_only==True, only the processes in the cgroup tracking the
+    processes spawned by this mock process (see tracking_cgroup()) are
+    looked up, which are typically just a few.  Otherwise (or if cgroup v2
+    tracking isn't available) the whole /proc file-system is scanned, so
+    also the processes started by anyone else are found.
     """
     getLog().debug("kill orphans in chroot %s", rootToKill)
     if USE_NSPAWN is False or manual_forced:
+        pids = _tracked_pids() if tracked_only else None
+        if pids is None:
+            pids = [int(d) for d in os.listdir("/proc") if d.isdigit()]
         path_cache = {}
-        for killsig in [signal.SIGTERM, signal.SIGKILL]:
-            for fn in [d for d in os.listdir("/proc") if d.isdigit()]:
-                try:
-                    root = os.readlink("/proc/%s/root" % fn)
-                    if compare_two_paths_cached(root, rootToKill, path_cache):
-                        pid = int(fn, 10)
-                        getLog().warning("Leftover process %s is being killed with signal %s: %s",
-                                         pid, killsig, get_pid_cmdline(pid))
-                        os.kill(pid, killsig)
-                        os.waitpid(pid, 0)
-                except OSError:
-                    pass
+        chrooted = []
+        for pid in pids:
+            try:
+                root = os.readlink("/proc/%s/root" % pid)
+                if compare_two_paths_cached(root, rootToKill, path_cache):
+                    chrooted.append(pid)
+            except OSError:
+                pass
+        if chrooted:
+            _kill_pids(chrooted, rootToKill)
     else:
         m_uuid = get_machinectl_uuid(rootToKill)
         if m_uuid:
@@ -315,6 +468,16 @@ def condChdir(cwd):
         os.chdir(cwd)
 
 
+def condTrackProcess(cgroup):
+    """ Move the current process into the tracking CGROUP (if any) """
+    if cgroup:
+        try:
+            with _root_privileges(), open(os.path.join(cgroup, "cgroup.procs"), "w") as f:
+                f.write("0")
+        except OSError:
+            pass
+
+
 def condDropPrivs(uid, gid):
     if gid is not None:
         os.setregid(gid, gid)
@@ -382,100 +545,167 @@ def process_input(line):
     return ''.join(out)
 
 
+_ANSI_ESCAPE = re.compile(r'\x1b\[([0-9]{1,2}(;[0-9]{1,2})?)?[m|K]\x0f?')
+
+
+# max. number of reads from one output stream per logOutput() wakeup, so
+# a very chatty child can't starve the timeout check
+_READS_PER_WAKEUP = 16
+
+# how long logOutput() keeps reading after the child exited, the output of
+# its children (still having the pipes open) may still come
+_CHILD_DEAD_GRACE = 0.5
+
+
+def _read_available(fd):
+    """
+    Slurp what is ready in the non-blocking FD (at most _READS_PER_WAKEUP
+    chunks), return (data, eof).
+    """
+    chunks = []
+    while len(chunks) < _READS_PER_WAKEUP:
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return b''.join(chunks), False
+        except OSError as e:
+            # the other side of pty was closed
+            if e.errno != errno.EIO:
+                raise
+            data = b''
+        if not data:
+            return b''.join(chunks), True
+        chunks.append(data)
+    return b''.join(chunks), False
+
+
 def logOutput(fdout, fderr, logger, returnOutput=1, start=0, timeout=0, printOutput=False,
               child=None, chrootPath=None, pty=False, returnStderr=True):
-    output = ""
-    done = False
-    fds = [fdout, fderr]
-
-    # set all fds to nonblocking
-    for fd in fds:
+    """
+    Pump the output of the FDOUT and FDERR files into LOGGER (line by line,
+    DEBUG level) and optionally to our stdout, till both are closed (or the
+    child is dead for _CHILD_DEAD_GRACE seconds, or the timeout expires).
+    Returns the collected output if RETURNOUTPUT.
+
+    The loop is driven by epoll, the output is collected in a list and joined
+    once, and the logger handlers (and stdout) are flushed once per wakeup
+    instead of once per line.
+    """
+    output = []
+    streams = {}
+    poller = select.epoll()
+    for f in (fdout, fderr):
+        if f.closed:
+            continue
+        fd = f.fileno()
         flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-        if not fd.closed:
-            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        poller.register(fd, select.EPOLLIN)
+        streams[fd] = {
+            "stderr": f is fderr,
+            "decoder": codecs.getincrementaldecoder(text.encoding)('replace'),
+            "tail": "",
+        }
 
     mockbuild_logger = logging.getLogger('mockbuild')
     stored_propagate = mockbuild_logger.propagate
+    stderr_line_prefix = getattr(mockbuild_logger, "mock_stderr_line_prefix", "")
+    log_lines = logger is not None and logger.isEnabledFor(logging.DEBUG)
+    stdout_buffer = getattr(sys.stdout, 'buffer', None)
     if printOutput:
         # prevent output being printed twice when log propagates to stdout
         mockbuild_logger.propagate = 0
         sys.stdout.flush()
+
+    def _log(stream, lines):
+        for line in lines:
+            if line != '':
+                line = _ANSI_ESCAPE.sub('', line)
+                if stream["stderr"] and not line.startswith('+ '):
+                    logger.debug("%s%s", stderr_line_prefix, line)
+                else:
+                    logger.debug(line)
+
+    def _process(stream, raw):
+        if printOutput:
+            if stdout_buffer is not None:
+                # python3 would print binary strings ugly
+                stdout_buffer.write(raw)
+            else:
+                print(raw, end='')
+
+        if returnStderr is False and stream["stderr"]:
+            return
+
+        lines = stream["decoder"].decode(raw).split("\n")
+        lines[0] = stream["tail"] + lines[0]
+        # we may not have all of the last line
+        stream["tail"] = lines.pop()
+        if not lines:
+            return
+        if pty:
+            lines = [process_input(line) for line in lines]
+        if log_lines:
+            _log(stream, lines)
+        if returnOutput:
+            output.append('\n'.join(lines) + '\n')
+
+    def _finish(stream):
+        # incomplete multibyte sequence at the end => replacement character
+        tail = stream["tail"] + stream["decoder"].decode(b"", final=True)
+        if not tail:
+            return
+        if pty:
+            tail = process_input(tail) + '\n'
+        if log_lines:
+            logger.debug(tail)
+        if returnOutput:
+            output.append(tail)
+
     try:
-        tail = ""
-        ansi_escape = re.compile(r'\x1b\[([0-9]{1,2}(;[0-9]{1,2})?)?[m|K]\x0f?')
-        while not done:
+        drain_until = None
+        while streams:
             if (time.time() - start) > timeout and timeout != 0:
-                done = True
                 break
 
-            i_rdy, o_rdy, e_rdy = select.select(fds, [], [], 1)
-
-            if not i_rdy and not o_rdy and not e_rdy:
-                if child and child.poll() is not None:
+            if drain_until is None and child is not None and child.poll() is not None:
+                drain_until = time.monotonic() + _CHILD_DEAD_GRACE
+            if drain_until is None:
+                events = poller.poll(1)
+            else:
+                # the child is dead, read till EOF or the grace period end
+                remaining = drain_until - time.monotonic()
+                events = poller.poll(remaining) if remaining > 0 else []
+            if not events:
+                if drain_until is not None:
                     logger.info("Child pid '%s' is dead", child.pid)
-                    done = True
                     if chrootPath:
                         logger.info("Child dead, killing orphans")
                         orphansKill(chrootPath)
-                    continue
-
-            for s in i_rdy:
-                # slurp as much input as is ready
-                raw = s.read()
-                if not raw:
-                    done = True
                     break
-                if printOutput:
-                    if hasattr(sys.stdout, 'buffer'):
-                        # python3 would print binary strings ugly
-                        # pylint: disable=no-member
-                        sys.stdout.buffer.write(raw)
-                    else:
-                        print(raw, end='')
-                    sys.stdout.flush()
-
-                if returnStderr is False and s == fderr:
-                    continue
-
-                txt_input = raw.decode(text.encoding, 'replace')
-                lines = txt_input.split("\n")
-                if tail:
-                    lines[0] = tail + lines[0]
-                # we may not have all of the last line
-                tail = lines.pop()
-                if not lines:
-                    continue
-                if pty:
-                    lines = [process_input(line) for line in lines]
-                processed_input = '\n'.join(lines) + '\n'
-                if "mock_stderr_line_prefix" in dir(mockbuild_logger):
-                    mock_stderr_line_prefix = mockbuild_logger.mock_stderr_line_prefix
-                else:
-                    mock_stderr_line_prefix = ""
-                if logger is not None:
-                    for line in lines:
-                        if line != '':
-                            line = ansi_escape.sub('', line)
-                            if fderr is s and not line.startswith('+ '):
-                                logger.debug("%s%s", mock_stderr_line_prefix, line)
-                            else:
-                                logger.debug(line)
-                    for h in logger.handlers:
-                        h.flush()
-                if returnOutput:
-                    output += processed_input
-
-        if tail:
-            if pty:
-                tail = process_input(tail) + '\n'
-            if logger is not None:
-                logger.debug(tail)
-            if returnOutput:
-                output += tail
+                continue
+
+            for fd, _ in events:
+                raw, eof = _read_available(fd)
+                if raw:
+                    _process(streams[fd], raw)
+                if eof:
+                    poller.unregister(fd)
+                    _finish(streams.pop(fd))
+
+            if printOutput:
+                sys.stdout.flush()
+            if log_lines:
+                for h in logger.handlers:
+                    h.flush()
+
+        for stream in streams.values():
+            _finish(stream)
     finally:
+        poller.close()
         mockbuild_logger.propagate = stored_propagate
 
-    return output
+    return ''.join(output)
 
 
 @traceLog()
@@ -515,6 +745,83 @@ def do(*args, **kargs):
     """ returns output of the command. Arguments are the same as for do_with_status() """
     return do_with_status(*args, **kargs)[0]
 
+
+def _wait_pid(child, timeout):
+    """
+    Wait up to TIMEOUT seconds for CHILD to exit, return True if it did.
+    Sleeps on pidfd (if the kernel supports it), instead of polling.
+    """
+    if child.poll() is not None:
+        # already reaped, its PID might belong to another process now; if
+        # not, the zombie keeps the PID ours till child.wait()
+        return True
+    if timeout > 0 and hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(child.pid)
+        except OSError:
+            # ENOSYS on old kernels, ESRCH if already reaped
+            pidfd = None
+        if pidfd is not None:
+            try:
+                select.select([pidfd], [], [], timeout)
+            finally:
+                os.close(pidfd)
+            timeout = 0
+    try:
+        child.wait(timeout=max(timeout, 0))
+        return True
+    except subprocess.TimeoutExpired:
+        return False
+
+
+def wait_any(processes):
+    """
+    Wait till any of the PROCESSES (subprocess.Popen objects) finishes, and
+    return it.  Sleeps on their pidfds (if the kernel supports them), or in
+    waitid(), instead of polling.
+    """
+    while True:
+        for process in processes:
+            if process.poll() is not None:
+                return process
+        pidfds = [_pidfd(process.pid) for process in processes]
+        try:
+            if None not in pidfds:
+                select.select(pidfds, [], [])
+                continue
+        finally:
+            for fd in pidfds:
+                if fd is not None:
+                    os.close(fd)
+        # no pidfd support, wait for any child without reaping it
+        info = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOWAIT)
+        if info is not None and info.si_pid not in [process.pid for process in processes]:
+            # some other (forgotten) child, don't let it wake us up again
+            os.waitpid(info.si_pid, 0)
+
+
+def _wait_for_child(child, start, timeout):
+    """
+    Wait for CHILD to finish.  If it runs longer than TIMEOUT seconds since
+    START, its process group is sent SIGTERM, and SIGKILL one second later.
+    Returns False if the child had to be killed.
+    """
+    if timeout == 0:
+        child.wait()
+        return True
+    if _wait_pid(child, start + timeout - time.time()):
+        return True
+    for sig, grace in ((signal.SIGTERM, 1), (signal.SIGKILL, None)):
+        try:
+            os.killpg(child.pid, sig)
+        except ProcessLookupError:
+            pass
+        if grace is None:
+            child.wait()
+        elif _wait_pid(child, grace):
+            break
+    return False
+
 # logger =
 # output = [1|0]
 # chrootPath
@@ -566,7 +873,11 @@ def do_with_status(command, shell=False, chrootPath=None, cwd=None, timeout=0, r
                 stderr=subprocess.PIPE,
                 preexec_fn=preexec,
             )
-            if not pty:
+            if pty:
+                # the child has its copy, ours would keep the pty open (no EOF)
+                os.close(sub_pty)
+                sub_pty = None
+            else:
                 stdout = child.stdout
             with child.stderr:
                 # use select() to poll for output so we dont block
@@ -587,22 +898,14 @@ def do_with_status(command, shell=False, chrootPath=None, cwd=None, timeout=0, r
         raise
     finally:
         if pty:
-            os.close(sub_pty)
+            if sub_pty is not None:
+                os.close(sub_pty)
             reader.close()
         if stdout:
             stdout.close()
 
     # wait until child is done, kill it if it passes timeout
-    niceExit = 1
-    while child.poll() is None:
-        if (time.time() - start) > timeout and timeout != 0:
-            niceExit = 0
-            os.killpg(child.pid, 15)
-        if (time.time() - start) > (timeout + 1) and timeout != 0:
-            niceExit = 0
-            os.killpg(child.pid, 9)
-
-    if not niceExit:
+    if not _wait_for_child(child, start, timeout):
         raise exception.commandTimeoutExpired("Timeout(%s) expired for command:\n # %s\n%s" %
                                               (timeout, cmd_pretty(command, env), output))
 
@@ -632,9 +935,11 @@ class ChildPreExec(object):
         self.unshare_ipc = unshare_ipc
         self.unshare_net = unshare_net
         self.no_setsid = no_setsid
+        self.cgroup = tracking_cgroup()
         getLog().debug("child environment: %s", env)
 
     def __call__(self, *args, **kargs):
+        condTrackProcess(self.cgroup)
         if not self.shell and not self.no_setsid:
             os.setsid()
         os.umask(DEFAULT_UMASK)
@@ -934,13 +1239,75 @@ def find_btrfs_in_chroot(mockdir, chroot_path):
 
 
 @traceLog()
-def createrepo(config_opts, path):
-    """ Create repository in given path. """
+def createrepo(config_opts, path, cachedir=None, atomic=False):
+    """
+    Create repository in given path.
+
+    When the metadata already exist, they are updated incrementally
+    (--update), and CACHEDIR (if set) keeps the checksums of the already
+    processed packages.  With ATOMIC=True the new metadata are generated
+    aside and published by switching the 'repodata' symlink, so concurrent
+    readers never see a half-written (or missing) repodata directory.
+    """
     cmd = shlex.split(config_opts["createrepo_command"])
-    if os.path.exists(os.path.join(path, 'repodata/repomd.xml')):
+    if cachedir:
+        file_util.mkdirIfAbsent(cachedir)
+        cmd += ['--cachedir', cachedir]
+    repodata = os.path.join(path, 'repodata')
+    if os.path.exists(os.path.join(repodata, 'repomd.xml')):
         cmd.append('--update')
-    cmd.append(path)
-    return do(cmd)
+    if not atomic:
+        cmd.append(path)
+        return do(cmd)
+
+    outputdir = _mkdtemp_repodata(path)
+    if os.path.exists(os.path.join(repodata, 'repomd.xml')):
+        cmd += ['--update-md-path', repodata]
+    cmd += ['--outputdir', outputdir, path]
+    try:
+        output = do(cmd)
+    except exception.Error:
+        file_util.rmtree(outputdir)
+        raise
+    _publish_repodata(path, outputdir)
+    return output
+
+
+def _mkdtemp_repodata(path):
+    """
+    New metadata generation directory in PATH, with the umask based mode
+    (not the 0700 of mkdtemp) so the repository stays readable by others
+    """
+    dirname = tempfile.mkdtemp(prefix='.repodata-', dir=path)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(dirname, 0o777 & ~umask)
+    return dirname
+
+
+def _publish_repodata(path, outputdir):
+    """ Atomically point PATH/repodata to OUTPUTDIR/repodata """
+    repodata = os.path.join(path, 'repodata')
+    previous = None
+    if os.path.islink(repodata):
+        previous = os.readlink(repodata).split('/')[0]
+    elif os.path.isdir(repodata):
+        # first switch from a plain directory, can not be done atomically
+        previous = _mkdtemp_repodata(path)
+        os.rename(repodata, os.path.join(previous, 'repodata'))
+        previous = os.path.basename(previous)
+    link = os.path.join(path, '.repodata.link')
+    if os.path.lexists(link):
+        os.unlink(link)
+    os.symlink(os.path.join(os.path.basename(outputdir), 'repodata'), link)
+    os.replace(link, repodata)
+
+    # Keep the previous generation around for readers that opened it just
+    # before the switch, drop the older ones.
+    keep = {os.path.basename(outputdir), previous}
+    for entry in os.listdir(path):
+        if entry.startswith('.repodata-') and entry not in keep:
+            file_util.rmtree(os.path.join(path, entry))
 
 
 REPOS_ID = []
@@ -0,0 +1,102 @@
+#! /usr/bin/python3
+
+"""
+Keep pools of warm, pre-initialized mock buildroots and build SRPMs in them
+on request (see mockbuild/daemon.py).
+"""
+
+# pylint: disable=invalid-name
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from mockbuild import daemon
+from mockbuild import exception
+
+
+def _default_socket():
+    # never a shared directory like /tmp
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "/run/user/{0}".format(os.getuid()))
+    if not os.path.isdir(runtime_dir):
+        return None
+    return os.path.join(runtime_dir, "mockd.sock")
+
+
+def _argparser():
+    parser = argparse.ArgumentParser(prog="mockd", description=__doc__)
+    parser.add_argument("--socket", default=_default_socket(),
+                        help="UNIX socket to listen on / connect to, default: %(default)s")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    serve = subparsers.add_parser("serve", help="run the daemon")
+    serve.add_argument("-r", "--root", action="append", dest="configs", required=True,
+                       help="mock config to keep the warm buildroots for, "
+                            "can be specified multiple times")
+    serve.add_argument("--pool-size", type=int, default=2,
+                       help="number of buildroots per config, default: %(default)s")
+    serve.add_argument("--mock", default="mock",
+                       help="mock executable, default: %(default)s")
+
+    build = subparsers.add_parser("build", help="rebuild SRPM in a warm buildroot")
+    build.add_argument("-r", "--root", dest="config", required=True)
+    build.add_argument("--resultdir", default=".")
+    build.add_argument("srpm")
+    build.add_argument("mock_args", nargs="*",
+                       help="additional mock options (after '--')")
+
+    subparsers.add_parser("status", help="print the state of the pools")
+    return parser
+
+
+def main():
+    """ The entry point """
+    parser = _argparser()
+    args = parser.parse_args()
+    if args.socket is None:
+        parser.error("XDG_RUNTIME_DIR is not set, specify --socket")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.command == "serve":
+        pools = {config: daemon.BuildrootPool(config, args.pool_size, [args.mock])
+                 for config in args.configs}
+        try:
+            server = daemon.MockDaemon(args.socket, pools)
+        except exception.Error as e:
+            logging.error("%s", e)
+            return e.resultcode
+        for pool in pools.values():
+            pool.start()
+        logging.info("mockd listening on %s", args.socket)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(args.socket)
+        return 0
+
+    if args.command == "status":
+        print(json.dumps(daemon.request(args.socket, {"command": "status"}), indent=4))
+        return 0
+
+    reply = daemon.request(args.socket, {
+        "command": "build",
+        "config": args.config,
+        "srpm": os.path.abspath(args.srpm),
+        "resultdir": os.path.abspath(args.resultdir),
+        "mock_args": args.mock_args,
+    })
+    if "error" in reply:
+        logging.error(reply["error"])
+    else:
+        logging.info("built in %s (%.1f s)", reply["slot"], reply["elapsed"])
+    return reply["returncode"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/python3 -tt
+#
+# Measure the CPU time mock spends per MB of the build output pumped through
+# mockbuild.util.logOutput() (e.g. the rpmbuild output logged into build.log).
+#
+# Usage: PYTHONPATH=py scripts/logoutput-benchmark.py [--size-mb 100]
+#
+
+import argparse
+import logging
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "py"))
+
+# pylint: disable=wrong-import-position
+from mockbuild import util
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(size_mb, line_length, logger, stderr=False):
+    line = "x" * (line_length - 1)
+    redirect = " >&2" if stderr else ""
+    cmd = "yes {0} | head -c {1}{2}".format(line, size_mb * 2**20, redirect)
+    wall = time.monotonic()
+    cpu = cpu_time()
+    util.do(cmd, shell=True, logger=logger, returnOutput=True)
+    return cpu_time() - cpu, time.monotonic() - wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--line-length", type=int, default=80)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("mockbuild.benchmark")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.FileHandler(os.devnull))
+
+    quiet = logging.getLogger("mockbuild.benchmark.quiet")
+    quiet.propagate = False
+    quiet.setLevel(logging.INFO)
+
+    print("{0:28} {1:>12} {2:>10}".format("scenario", "CPU [ms/MB]", "wall [s]"))
+    for name, log, stderr in [("stdout, logged", logger, False),
+                              ("stderr, logged", logger, True),
+                              ("stdout, not logged", quiet, False)]:
+        cpu, wall = run(args.size_mb, args.line_length, log, stderr)
+        print("{0:28} {1:12.2f} {2:10.2f}".format(name, 1000 * cpu / args.size_mb, wall))
+
+
+if __name__ == "__main__":
+    main()
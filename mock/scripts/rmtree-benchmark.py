@@ -0,0 +1,61 @@
+#!/usr/bin/python3 -tt
+#
+# Compare the sequential and the parallel (dir_fd based) engines of
+# mockbuild.file_util.rmtree() on a synthetic chroot-like tree.
+#
+# Usage: scripts/rmtree-benchmark.py [--files 200000] [--dir /var/tmp]
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "py"))
+
+# pylint: disable=wrong-import-position
+from mockbuild import file_util
+
+
+def create_tree(top, files, per_dir=50, fanout=10):
+    """ FILES small files, PER_DIR in each directory, FANOUT subdirs per level """
+    directories = [top]
+    created = 0
+    index = 0
+    while created < files:
+        directory = directories[index]
+        index += 1
+        for i in range(fanout):
+            sub = os.path.join(directory, "d{0}".format(i))
+            os.mkdir(sub)
+            directories.append(sub)
+        for i in range(min(per_dir, files - created)):
+            with open(os.path.join(directory, "f{0}".format(i)), "w") as f:
+                f.write("x")
+        created += per_dir
+
+
+def measure(args, parallel):
+    top = tempfile.mkdtemp(prefix="rmtree-benchmark-", dir=args.dir)
+    create_tree(top, args.files)
+    os.sync()
+    start = time.monotonic()
+    file_util.rmtree(top, parallel=parallel)
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200000)
+    parser.add_argument("--dir", default="/var/tmp")
+    args = parser.parse_args()
+
+    print("{0:32} {1:>10}".format("engine", "time [s]"))
+    print("{0:32} {1:10.2f}".format("sequential", measure(args, False)))
+    print("{0:32} {1:10.2f}".format(
+        "parallel, {0} threads".format(file_util.RMTREE_WORKERS), measure(args, True)))
+
+
+if __name__ == "__main__":
+    main()
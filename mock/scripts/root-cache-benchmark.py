@@ -0,0 +1,74 @@
+#!/usr/bin/python3 -tt
+"""
+Compare pack/unpack speed and archive size of the root_cache compressors.
+
+Usage: root-cache-benchmark.py /var/lib/mock/fedora-rawhide-x86_64/root
+
+Run as root on a real (populated) chroot to get meaningful numbers.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+THREADS = os.cpu_count() or 1
+
+# name, compress program (as passed to tar), extension
+METHODS = [
+    ("gzip", "gzip", ".gz"),
+    ("pigz", "pigz", ".gz"),
+    ("zstd", "zstd -q -T{0} -3".format(THREADS), ".zst"),
+    ("pzstd", "pzstd -q -p {0} -3".format(THREADS), ".zst"),
+]
+
+
+def timed(cmd):
+    start = time.monotonic()
+    subprocess.run(cmd, check=True)
+    return time.monotonic() - start
+
+
+def benchmark(chroot, workdir, name, program, extension):
+    archive = os.path.join(workdir, "cache.tar" + extension)
+    target = os.path.join(workdir, "unpacked-" + name)
+    os.mkdir(target)
+    try:
+        pack = timed(["tar", "--one-file-system", "--use-compress-program", program,
+                      "-cf", archive, "-C", chroot, "."])
+        unpack = timed(["tar", "--use-compress-program", program,
+                        "-xf", archive, "-C", target])
+        return pack, unpack, os.path.getsize(archive)
+    finally:
+        shutil.rmtree(target)
+        if os.path.exists(archive):
+            os.unlink(archive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chroot", help="directory to archive (e.g. mock chroot)")
+    parser.add_argument("--workdir", default="/var/tmp",
+                        help="where to put the temporary archives")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="root-cache-benchmark-", dir=args.workdir)
+    print("{0:8} {1:>10} {2:>10} {3:>12}".format("method", "pack [s]", "unpack [s]", "size [MiB]"))
+    try:
+        for name, program, extension in METHODS:
+            if not shutil.which(program.split()[0]):
+                print("{0:8} not available".format(name))
+                continue
+            pack, unpack, size = benchmark(args.chroot, workdir, name, program, extension)
+            print("{0:8} {1:10.2f} {2:10.2f} {3:12.1f}".format(name, pack, unpack, size / 2**20))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
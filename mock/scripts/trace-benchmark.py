@@ -0,0 +1,67 @@
+#!/usr/bin/python3 -tt
+#
+# Measure the per-call overhead of mockbuild.trace_decorator: getLog() in
+# a frequently called function, and the traceLog() decorator with tracing
+# off (the default), with the ring buffer backend (MOCK_TRACE_LOG=ring) and
+# with the verbose logging backend (MOCK_TRACE_LOG=true, --trace).
+#
+# Usage: scripts/trace-benchmark.py [--calls 200000]
+#
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "py"))
+
+# pylint: disable=wrong-import-position
+from mockbuild import trace_decorator
+
+
+def decorated(mode):
+    os.environ["MOCK_TRACE_LOG"] = mode
+
+    @trace_decorator.traceLog()
+    def func(arg, other=None):
+        return arg
+
+    return func
+
+
+def per_call(stmt, calls):
+    """ nanoseconds per call, the best of 5 runs """
+    return min(timeit.repeat(stmt, number=calls, repeat=5)) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    trace = logging.getLogger("trace")
+    trace.setLevel(logging.INFO)
+    trace.addHandler(logging.FileHandler(os.devnull))
+
+    def plain(arg, other=None):
+        return arg
+
+    def with_getlog():
+        trace_decorator.getLog().debug("not logged")
+
+    scenarios = [
+        ("plain call", lambda: plain(1, other=2)),
+        ("getLog().debug(), disabled", with_getlog),
+        ("traceLog, off", lambda f=decorated("false"): f(1, other=2)),
+        ("traceLog, ring buffer", lambda f=decorated("ring"): f(1, other=2)),
+        ("traceLog, logged", lambda f=decorated("true"): f(1, other=2)),
+    ]
+    print("{0:32} {1:>12}".format("scenario", "ns / call"))
+    for name, stmt in scenarios:
+        print("{0:32} {1:12.0f}".format(name, per_call(stmt, args.calls)))
+    trace_decorator._TRACE_BUFFER.clear()  # pylint: disable=protected-access
+
+
+if __name__ == "__main__":
+    main()
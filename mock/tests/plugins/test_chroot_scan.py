@@ -0,0 +1,115 @@
+"""Test the chroot_scan plugin."""
+
+import os
+import re
+import tarfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from mockbuild.plugins.chroot_scan import ChrootScan, scan
+
+
+def _chroot(tmp_path):
+    chroot = tmp_path / "root"
+    for relpath in ("builddir/build/BUILD/foo/config.log",
+                    "builddir/build/BUILD/foo/sub/CMakeError.log",
+                    "builddir/build/BUILD/foo/main.c",
+                    "usr/share/doc/foo/install.log",
+                    "proc/1/some.log"):
+        path = chroot / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(relpath)
+    os.chmod(chroot / "builddir/build/BUILD/foo/config.log", 0o444)
+    os.symlink("/etc/shadow", chroot / "builddir/build/BUILD/foo/evil.log")
+    return chroot
+
+
+def _plugin(tmp_path, chroot, write_tar=False):
+    buildroot = MagicMock()
+    buildroot.make_chroot_path.return_value = str(chroot)
+    buildroot.resultdir = str(tmp_path / "results")
+    buildroot.uid_manager.unprivUid = os.getuid()
+    buildroot.uid_manager.unprivGid = os.getgid()
+    buildroot.state.result = "fail"
+    os.makedirs(buildroot.resultdir)
+    conf = {"regexes": [r"\.log$"], "only_failed": True, "write_tar": write_tar,
+            "include_roots": ["/builddir"]}
+    return ChrootScan(MagicMock(), conf, buildroot)
+
+
+class TestChrootScan:
+    """Test the chroot scanning."""
+
+    def test_scan(self, tmp_path):
+        """Only regular files below include roots, /proc pruned."""
+        chroot = _chroot(tmp_path)
+        regex = re.compile(r"\.log$")
+        found = [os.path.relpath(path, str(chroot)) for path, _ in scan(str(chroot), regex)]
+        assert found == ["builddir/build/BUILD/foo/config.log",
+                         "builddir/build/BUILD/foo/sub/CMakeError.log",
+                         "usr/share/doc/foo/install.log"]
+        found = [os.path.relpath(path, str(chroot)) for path, _ in
+                 scan(str(chroot), regex, ["/builddir/build", "/builddir"])]
+        assert found == ["builddir/build/BUILD/foo/config.log",
+                         "builddir/build/BUILD/foo/sub/CMakeError.log"]
+
+    def test_copy(self, tmp_path):
+        """Files are copied with full path, writable."""
+        chroot = _chroot(tmp_path)
+        plugin = _plugin(tmp_path, chroot)
+        plugin._scanChroot()  # pylint: disable=protected-access
+        copied = plugin.resultdir + str(chroot / "builddir/build/BUILD/foo/config.log")
+        with open(copied) as f:
+            assert f.read() == "builddir/build/BUILD/foo/config.log"
+        assert os.stat(copied).st_mode & 0o777 == 0o644
+        assert os.path.exists(plugin.resultdir + str(chroot / "builddir/build/BUILD/foo/sub/CMakeError.log"))
+        assert not os.path.exists(plugin.resultdir + str(chroot / "usr"))
+
+    def test_tarball(self, tmp_path):
+        """Files are streamed into tarball, no directory is created."""
+        chroot = _chroot(tmp_path)
+        plugin = _plugin(tmp_path, chroot, write_tar=True)
+        plugin._scanChroot()  # pylint: disable=protected-access
+        assert not os.path.exists(plugin.resultdir)
+        with tarfile.open(plugin.resultdir + ".tar.gz") as tar:
+            names = sorted(tar.getnames())
+            prefix = plugin.resultdir.lstrip("/") + str(chroot)
+            assert names == [prefix + "/builddir/build/BUILD/foo/config.log",
+                             prefix + "/builddir/build/BUILD/foo/sub/CMakeError.log"]
+            member = tar.getmember(names[0])
+            assert member.mode & 0o777 == 0o644
+            assert tar.extractfile(member).read() == b"builddir/build/BUILD/foo/config.log"
+
+    @pytest.mark.parametrize("swapped", ["builddir/build/BUILD/foo/config.log", "builddir/build/BUILD"])
+    def test_swapped_for_symlink(self, tmp_path, swapped):
+        """A file or directory swapped for a symlink after the scan is not followed."""
+        chroot = _chroot(tmp_path)
+        outside = tmp_path / "outside"
+        (outside / "foo").mkdir(parents=True)
+        (outside / "foo" / "config.log").write_text("host file")
+        os.chmod(outside / "foo" / "config.log", 0o600)
+        plugin = _plugin(tmp_path, chroot)
+        found = list(scan(str(chroot), re.compile(r"config\.log$")))
+        os.rename(chroot / swapped, tmp_path / "moved")
+        os.symlink(outside / "foo" / "config.log" if swapped.endswith(".log") else outside,
+                   chroot / swapped)
+        with patch("mockbuild.plugins.chroot_scan.scan", return_value=found):
+            plugin._scanChroot()  # pylint: disable=protected-access
+        copied = plugin.resultdir + str(chroot / "builddir/build/BUILD/foo/config.log")
+        assert not os.path.lexists(copied)
+        assert os.stat(outside / "foo" / "config.log").st_mode & 0o777 == 0o600
+
+    def test_tarball_file_shrinks(self, tmp_path):
+        """A file truncated after the scan doesn't break the tarball."""
+        chroot = _chroot(tmp_path)
+        plugin = _plugin(tmp_path, chroot, write_tar=True)
+        found = list(scan(str(chroot), re.compile(r"\.log$"), ["/builddir"]))
+        with open(found[0][0], "w") as f:
+            f.write("short")
+        with patch("mockbuild.plugins.chroot_scan.scan", return_value=found):
+            plugin._scanChroot()  # pylint: disable=protected-access
+        with tarfile.open(plugin.resultdir + ".tar.gz") as tar:
+            members = tar.getmembers()
+            assert [tar.extractfile(member).read() for member in members] == [
+                b"short", b"builddir/build/BUILD/foo/sub/CMakeError.log"]
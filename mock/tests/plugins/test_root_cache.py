@@ -0,0 +1,112 @@
+"""Test the root_cache plugin with the tar and zstd formats."""
+
+import json
+import os
+import shutil
+from unittest.mock import MagicMock
+
+import pytest
+
+from mockbuild.plugins.root_cache import RootCache
+from mockbuild.util import clean_env
+
+
+def _plugin(tmp_path, fmt="tar", compress_program="gzip", extension=".gz", tar="gnutar"):
+    chroot = tmp_path / "root"
+    buildroot = MagicMock()
+    buildroot.make_chroot_path.side_effect = lambda *paths: os.path.join(
+        str(chroot), *[path.lstrip("/") for path in paths])
+    buildroot.chroot_was_initialized = False
+    buildroot.mounts.get_mountpoints.return_value = []
+    buildroot.pkg_manager.init_install_output = "installed\n"
+    buildroot.config = {
+        "tar": tar,
+        "tar_binary": "tar",
+        "config_paths": [],
+        "cache_alterations": False,
+        "plugin_conf": {"tmpfs_enable": False},
+    }
+    conf = {
+        "dir": str(tmp_path / "cache"),
+        "format": fmt,
+        "compress_program": compress_program,
+        "extension": extension,
+        "exclude_dirs": ["./proc"],
+        "age_check": True,
+        "max_age_days": 15,
+        "zstd_threads": 1,
+    }
+    os.makedirs(conf["dir"], exist_ok=True)
+    return RootCache(MagicMock(), conf, buildroot)
+
+
+def _create_chroot(tmp_path):
+    chroot = tmp_path / "root"
+    (chroot / "etc").mkdir(parents=True)
+    (chroot / "etc" / "os-release").write_text("NAME=test\n")
+    (chroot / "proc").mkdir()
+    (chroot / "proc" / "ignored").write_text("x")
+
+
+def _create_cache(plugin):
+    # the preinit hook opens the lock file, the postinit hook packs the cache
+    plugin._unpack_root_cache()  # pylint: disable=protected-access
+    plugin._rebuild_root_cache()  # pylint: disable=protected-access
+
+
+def _manifest(plugin):
+    with open(plugin.rootCacheManifest) as f:
+        return json.load(f)
+
+
+class TestRootCache:
+    """Packing, unpacking and invalidating the root cache."""
+
+    @pytest.mark.skipif(not shutil.which("zstd", path=clean_env()["PATH"]),
+                        reason="zstd not installed")
+    def test_zstd_roundtrip(self, tmp_path):
+        """The zstd format packs into cache.tar.zst, and unpacks it"""
+        _create_chroot(tmp_path)
+        plugin = _plugin(tmp_path, fmt="zstd")
+        _create_cache(plugin)
+        assert plugin.rootCacheFile == str(tmp_path / "cache" / "cache.tar.zst")
+        with open(plugin.rootCacheFile, "rb") as f:
+            assert f.read(4) == b"\x28\xb5\x2f\xfd"
+        manifest = _manifest(plugin)
+        assert (manifest["format"], manifest["file"]) == ("zstd", "cache.tar.zst")
+
+        shutil.rmtree(tmp_path / "root")
+        plugin._unpack_root_cache()  # pylint: disable=protected-access
+        assert (tmp_path / "root" / "etc" / "os-release").read_text() == "NAME=test\n"
+        assert os.listdir(tmp_path / "root" / "proc") == []
+        assert plugin.buildroot.chrootWasCached is True
+
+    def test_manifest_invalidation(self, tmp_path):
+        """A cache created with different settings is rebuilt"""
+        _create_chroot(tmp_path)
+        plugin = _plugin(tmp_path)
+        _create_cache(plugin)
+        assert _manifest(plugin)["tar"] == "gnutar"
+
+        # the same settings, the cache is used
+        shutil.rmtree(tmp_path / "root")
+        plugin._unpack_root_cache()  # pylint: disable=protected-access
+        assert os.path.exists(plugin.rootCacheFile)
+        assert (tmp_path / "root" / "etc" / "os-release").exists()
+
+        plugin = _plugin(tmp_path, tar="bsdtar")
+        shutil.rmtree(tmp_path / "root")
+        plugin._unpack_root_cache()  # pylint: disable=protected-access
+        assert not os.path.exists(plugin.rootCacheFile)
+        assert not (tmp_path / "root" / "etc").exists()
+
+    def test_other_format_removed(self, tmp_path):
+        """The archive of the previously used format is removed with the new cache"""
+        _create_chroot(tmp_path)
+        _create_cache(_plugin(tmp_path))
+        assert os.path.exists(tmp_path / "cache" / "cache.tar.gz")
+        plugin = _plugin(tmp_path, compress_program="", extension="")
+        _create_cache(plugin)
+        assert sorted(os.listdir(tmp_path / "cache")) == \
+            ["cache.json", "cache.log", "cache.tar", "rootcache.lock"]
+        assert _manifest(plugin)["file"] == "cache.tar"
@@ -0,0 +1,120 @@
+"""Test the package manager cache index of the yum_cache plugin."""
+
+import os
+import time
+from unittest.mock import patch
+
+from mockbuild.plugins.yum_cache import CacheIndex, RepoCacheIndex, YumCache
+
+DAY = 24 * 60 * 60
+
+
+def _file(top, relpath, size, used=None):
+    path = top / relpath
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    if used is not None:
+        os.utime(path, (used, used))
+    return path
+
+
+class TestCacheIndex:
+    """Test the CacheIndex class."""
+
+    def test_update_incremental(self, tmp_path):
+        """Only the changed directories are re-scanned."""
+        top = tmp_path / "dnf_cache"
+        _file(top, "fedora/packages/a.rpm", 10)
+        _file(top, "updates/packages/b.rpm", 20)
+        index = CacheIndex(str(top), str(tmp_path / "index.json"))
+        index.update()
+        index.save()
+        assert index.size() == 30
+
+        # unchanged directory => the file is not stat()ed again
+        index = CacheIndex(str(top), str(tmp_path / "index.json"))
+        index.files["fedora/packages/a.rpm"][0] = 1000
+        _file(top, "updates/packages/c.rpm", 5)
+        os.unlink(top / "updates/packages/b.rpm")
+        index.update()
+        assert sorted(index.files) == ["fedora/packages/a.rpm", "updates/packages/c.rpm"]
+        assert index.size() == 1005
+
+    def test_update_unchanged_dirs(self, tmp_path):
+        """Unchanged directories are only stat()ed, not read again."""
+        top = tmp_path / "dnf_cache"
+        _file(top, "fedora/packages/a.rpm", 10)
+        _file(top, "updates/packages/b.rpm", 20)
+        index = CacheIndex(str(top), str(tmp_path / "index.json"))
+        index.update()
+        with patch("os.scandir", wraps=os.scandir) as scandir:
+            index.update()
+            assert scandir.call_count == 0
+            _file(top, "updates/packages/c.rpm", 5)
+            index.update()
+            assert [call.args[0] for call in scandir.call_args_list] == \
+                [str(top / "updates/packages")]
+        assert index.size() == 35
+
+    def test_hardlinks(self, tmp_path):
+        """Hardlinked files are counted once."""
+        top = tmp_path / "dnf_cache"
+        _file(top, "fedora/packages/a.rpm", 10)
+        os.makedirs(top / "fedora-2/packages")
+        os.link(top / "fedora/packages/a.rpm", top / "fedora-2/packages/a.rpm")
+        index = CacheIndex(str(top), str(tmp_path / "index.json"))
+        index.update()
+        assert len(index.files) == 2
+        assert index.size() == 10
+
+    def test_prune_age(self, tmp_path):
+        """Old metadata are removed sooner than the old packages."""
+        top = tmp_path / "dnf_cache"
+        _file(top, "fedora/repodata/primary.xml.gz", 10)
+        _file(top, "fedora/packages/a.rpm", 10)
+        index = CacheIndex(str(top), str(tmp_path / "index.json"))
+        index.update()
+        for entry in index.files.values():
+            entry[1] -= 10 * DAY
+        removed, freed = index.prune(30, 7, YumCache.METADATA_EXTS)
+        assert (removed, freed) == (1, 10)
+        assert os.listdir(top / "fedora/repodata") == []
+        assert list(index.files) == ["fedora/packages/a.rpm"]
+
+    def test_prune_lru(self, tmp_path):
+        """Least recently used files are evicted to fit into the budget."""
+        top = tmp_path / "dnf_cache"
+        now = time.time()
+        _file(top, "p/old.rpm", 100, used=now - 3 * DAY)
+        _file(top, "p/used.rpm", 100, used=now - 2 * DAY)
+        _file(top, "p/new.rpm", 100, used=now - 1 * DAY)
+        index = CacheIndex(str(top), str(tmp_path / "index.json"))
+        index.update()
+
+        # accessed after the index update
+        os.utime(top / "p/used.rpm", (now, now - 2 * DAY))
+        removed, freed = index.prune(30, 30, YumCache.METADATA_EXTS, max_size=150)
+        assert (removed, freed) == (2, 200)
+        assert os.listdir(top / "p") == ["used.rpm"]
+
+    def test_prune_lru_repos(self, tmp_path):
+        """Whole repositories are evicted, not single files."""
+        top = tmp_path / "dnf_cache"
+        now = time.time()
+        _file(top, "fedora-1234/repodata/repomd.xml", 10, used=now - 3 * DAY)
+        _file(top, "fedora-1234/packages/a.rpm", 100, used=now - 1 * DAY)
+        _file(top, "updates-5678/repodata/repomd.xml", 10, used=now - 2 * DAY)
+        _file(top, "updates-5678/packages/b.rpm", 100, used=now - 2 * DAY)
+        _file(top, "expired_repos.json", 1, used=now - 4 * DAY)
+        index = RepoCacheIndex(str(top), str(tmp_path / "index.json"))
+        index.update()
+        assert index.unit("fedora-1234/packages/a.rpm") == "fedora-1234"
+        assert index.unit("expired_repos.json") == "expired_repos.json"
+        removed, freed = index.prune(30, 30, YumCache.METADATA_EXTS, max_size=150)
+        assert (removed, freed) == (3, 111)
+        assert sorted(os.listdir(top)) == ["fedora-1234"]
+        assert sorted(index.files) == ["fedora-1234/packages/a.rpm", "fedora-1234/repodata/repomd.xml"]
+        index.save()
+        index = RepoCacheIndex(str(top), str(tmp_path / "index.json"))
+        index.update()
+        assert index.size() == 110
@@ -3,7 +3,9 @@
 
 import os
 import stat
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
+
+import rpm
 
 from mockbuild.backend import Commands
 
@@ -81,3 +83,96 @@ class TestCopySrpmIntoChroot:
         cmd = _make_commands(tmp_path)
         result = cmd.copy_srpm_into_chroot(str(srpm))
         assert result == "/builddir/originals/test.src.rpm"
+
+
+class TestBuildrequiresSatisfied:
+    """installSrpmDeps() skips the package manager when nothing is missing."""
+
+    @staticmethod
+    def _commands(tmp_path, missing):
+        cmd = _make_commands(tmp_path)
+        cmd.config = {"skip_satisfied_buildrequires": True}
+        cmd.uid_manager = MagicMock()
+        cmd.more_buildreqs = {}
+        cmd.buildroot.preexisting_deps = []
+        cmd.buildroot.missing_provides.return_value = missing
+        return cmd
+
+    @staticmethod
+    def _header(requires, conflicts=()):
+        hdr = {rpm.RPMTAG_CONFLICTNAME: list(conflicts)}
+        return hdr, ["R " + req for req in requires]
+
+    def _run(self, tmp_path, missing, requires, conflicts=()):
+        cmd = self._commands(tmp_path, missing)
+        hdr, ds = self._header(requires, conflicts)
+        with patch("mockbuild.backend.util.yieldSrpmHeaders", return_value=[hdr]), \
+                patch("mockbuild.backend.rpm.ds", return_value=ds):
+            cmd.installSrpmDeps("foo.src.rpm")
+        return cmd
+
+    def test_satisfied(self, tmp_path):
+        """Nothing missing, no builddep."""
+        cmd = self._run(tmp_path, [], ["gcc", "make >= 4", "rpmlib(CompressedFileNames) <= 3.0.4-1"])
+        cmd.buildroot.missing_provides.assert_called_once_with(["gcc", "make >= 4"])
+        cmd.buildroot.pkg_manager.builddep.assert_not_called()
+
+    def test_missing(self, tmp_path):
+        """Missing dependency, builddep called."""
+        cmd = self._run(tmp_path, ["make >= 4"], ["gcc", "make >= 4"])
+        cmd.buildroot.pkg_manager.builddep.assert_called_once_with("foo.src.rpm", check=True)
+
+    def test_rich_dependency(self, tmp_path):
+        """Rich dependencies are left to the package manager."""
+        cmd = self._run(tmp_path, [], ["(gcc or clang)"])
+        cmd.buildroot.missing_provides.assert_not_called()
+        cmd.buildroot.pkg_manager.builddep.assert_called_once_with("foo.src.rpm", check=True)
+
+    def test_conflicts(self, tmp_path):
+        """BuildConflicts are left to the package manager."""
+        cmd = self._run(tmp_path, [], ["gcc"], conflicts=["foo"])
+        cmd.buildroot.pkg_manager.builddep.assert_called_once_with("foo.src.rpm", check=True)
+
+
+class TestDynamicBuildrequires:
+    """The dynamic BuildRequires loop in rebuild_package()."""
+
+    @staticmethod
+    def _commands(tmp_path, generated, fingerprints):
+        cmd = _make_commands(tmp_path)
+        cmd.config = {"dynamic_buildrequires_max_loops": 10, "print_main_output": False}
+        cmd.state = MagicMock()
+        cmd.private_network = True
+        cmd.buildroot.doChroot.return_value = ("", 11)
+        cmd.buildroot.rpmdb_fingerprint.side_effect = fingerprints
+        cmd.installSrpmDeps = MagicMock()
+        cmd._generated_buildrequires = MagicMock(side_effect=generated)
+        return cmd
+
+    def _run(self, cmd):
+        with patch("mockbuild.backend.glob.glob", return_value=[]):
+            cmd._resolve_dynamic_buildrequires(lambda mode: ["rpmbuild"] + mode, "/builddir", 0, False)
+
+    def test_same_requires_converge(self, tmp_path):
+        """Nothing new generated, the package manager is not called again."""
+        cmd = self._commands(tmp_path, [{"a", "b"}, {"a", "b"}], [1, 2])
+        self._run(cmd)
+        assert cmd.buildroot.doChroot.call_count == 2
+        assert cmd.installSrpmDeps.call_count == 1
+        cmd.state.start.assert_any_call("dynamic buildrequires round 2")
+        assert cmd.state.start.call_count == cmd.state.finish.call_count == 2
+
+    def test_new_requires(self, tmp_path):
+        """New requires are installed, until nothing changes."""
+        cmd = self._commands(tmp_path, [{"a"}, {"a", "b"}, {"a", "b", "c"}], [1, 2, 2, 3, 3, 3])
+        self._run(cmd)
+        # round 3: 'c' was installed already (rpmdb unchanged), converged
+        assert cmd.buildroot.doChroot.call_count == 3
+        assert cmd.installSrpmDeps.call_count == 3
+
+    def test_max_loops(self, tmp_path):
+        """The loop ends after dynamic_buildrequires_max_loops rounds."""
+        cmd = self._commands(tmp_path, [{str(i)} for i in range(3)], range(100))
+        cmd.config["dynamic_buildrequires_max_loops"] = 3
+        self._run(cmd)
+        assert cmd.buildroot.doChroot.call_count == 3
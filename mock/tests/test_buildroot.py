@@ -22,3 +22,48 @@ def test_module_config():
 
     _check([("info", "")], [["module", "info"]])
     _check([("info", None)], [["module", "info"]])
+
+
+def _rpmdb_buildroot(tmp_path):
+    br = buildroot.Buildroot.__new__(buildroot.Buildroot)
+    br.rootdir = str(tmp_path)
+    br.config = {"rpm_command": "rpm"}
+    br._chroot_packages = None  # pylint: disable=protected-access
+    br.nuke_rpm_db = MagicMock()
+    br.doOutChroot = MagicMock(return_value=("foo-1-1.noarch\nbar-1-1.noarch\n", 0))
+    return br
+
+
+def test_rpmdb_fingerprint(tmp_path):
+    """ rpmdb changes are detected without calling rpm """
+    br = _rpmdb_buildroot(tmp_path)
+    dbdir = tmp_path / "usr/lib/sysimage/rpm"
+    dbdir.mkdir(parents=True)
+    (dbdir / "rpmdb.sqlite").write_bytes(b"x" * 10)
+    before = br.rpmdb_fingerprint()
+    (dbdir / "rpmdb.sqlite-shm").write_bytes(b"read")
+    (dbdir / ".rpm.lock").write_bytes(b"")
+    assert br.rpmdb_fingerprint() == before
+    (dbdir / "rpmdb.sqlite").write_bytes(b"x" * 20)
+    assert br.rpmdb_fingerprint() != before
+    br.doOutChroot.assert_not_called()
+
+
+def test_all_chroot_packages_cached(tmp_path):
+    """ rpm -qa is only called when rpmdb changed """
+    br = _rpmdb_buildroot(tmp_path)
+    dbdir = tmp_path / "var/lib/rpm"
+    dbdir.mkdir(parents=True)
+    (dbdir / "Packages").write_bytes(b"x")
+    assert br.all_chroot_packages() == {"foo-1-1.noarch", "bar-1-1.noarch"}
+    assert br.all_chroot_packages() == {"foo-1-1.noarch", "bar-1-1.noarch"}
+    assert br.doOutChroot.call_count == 1
+    (dbdir / "Packages").write_bytes(b"xx")
+    br.all_chroot_packages()
+    assert br.doOutChroot.call_count == 2
+
+
+def test_rpmdb_fingerprint_no_rpmdb(tmp_path):
+    """ without the known rpmdb files, the package set is used """
+    br = _rpmdb_buildroot(tmp_path)
+    assert br.rpmdb_fingerprint() == frozenset({"foo-1-1.noarch", "bar-1-1.noarch"})
@@ -0,0 +1,201 @@
+""" Tests for the mockbuild.caching_proxy, against a local stand-in repo """
+
+import functools
+import json
+import os
+import pwd
+import socket
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from unittest import mock
+
+import pytest
+
+from mockbuild import util
+from mockbuild.caching_proxy import (CachingProxy, ProxyCache, ensure_running, is_running,
+                                     listener_uid, parse_range)
+
+
+class _Repo(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RepoHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        time.sleep(0.2)  # slow enough to overlap the concurrent requests
+        super().do_GET()
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture(name="proxy")
+def fixture_proxy(tmp_path):
+    """ Stand-in repo, and the proxy in front of it """
+    (tmp_path / "repo" / "repodata").mkdir(parents=True)
+    (tmp_path / "repo" / "foo.rpm").write_bytes(b"0123456789")
+    (tmp_path / "repo" / "repodata" / "repomd.xml").write_text("<repomd/>")
+    repo = _serve(_Repo(("127.0.0.1", 0), functools.partial(
+        _RepoHandler, directory=str(tmp_path / "repo"))))
+    repo.requests = []
+    server = _serve(CachingProxy(("127.0.0.1", 0), ProxyCache(str(tmp_path / "cache"))))
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler(
+        {"http": "http://127.0.0.1:{0}".format(server.server_address[1])}))
+    base = "http://127.0.0.1:{0}/".format(repo.server_address[1])
+    yield opener, base, repo, server
+    server.shutdown()
+    repo.shutdown()
+    server.server_close()
+    repo.server_close()
+
+
+def _get(opener, url, **headers):
+    request = urllib.request.Request(url, headers=headers)
+    with opener.open(request) as response:
+        return response.getcode(), response.headers, response.read()
+
+
+class TestCachingProxy:
+    """ Requests through the proxy """
+
+    def test_hit_and_miss(self, proxy):
+        """ Packages are downloaded once, metadata are passed through """
+        opener, base, repo, server = proxy
+        code, headers, body = _get(opener, base + "foo.rpm")
+        assert (code, headers["X-Cache"], body) == (200, "MISS", b"0123456789")
+        code, headers, body = _get(opener, base + "foo.rpm")
+        assert (code, headers["X-Cache"], body) == (200, "HIT", b"0123456789")
+        for _ in range(2):
+            assert _get(opener, base + "repodata/repomd.xml")[1]["X-Cache"] == "PASS"
+        assert repo.requests == ["/foo.rpm", "/repodata/repomd.xml", "/repodata/repomd.xml"]
+
+        stats = json.loads(urllib.request.urlopen(
+            "http://127.0.0.1:{0}/stats".format(server.server_address[1])).read())
+        assert (stats["hits"], stats["misses"], stats["uncached"]) == (1, 1, 2)
+
+    def test_range(self, proxy):
+        """ Range requests are served from the cached file """
+        opener, base, repo, _ = proxy
+        code, headers, body = _get(opener, base + "foo.rpm", Range="bytes=2-4")
+        assert (code, headers["Content-Range"], body) == (206, "bytes 2-4/10", b"234")
+        assert _get(opener, base + "foo.rpm", Range="bytes=-3")[2] == b"789"
+        assert repo.requests == ["/foo.rpm"]
+
+    def test_concurrent(self, proxy):
+        """ Concurrent requests of one URL result in a single fetch """
+        opener, base, repo, server = proxy
+        bodies = []
+        threads = [threading.Thread(target=lambda: bodies.append(
+            _get(opener, base + "foo.rpm")[2])) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert bodies == [b"0123456789"] * 5
+        assert repo.requests == ["/foo.rpm"]
+        assert server.cache.stats["misses"] == 1
+
+    def test_changed_upstream(self, proxy, tmp_path):
+        """ A package changed on the server (e.g. rebuilt with the same NVR) is fetched again """
+        opener, base, repo, server = proxy
+        assert _get(opener, base + "foo.rpm")[2] == b"0123456789"
+        (tmp_path / "repo" / "foo.rpm").write_bytes(b"rebuilt")
+        code, headers, body = _get(opener, base + "foo.rpm")
+        assert (code, headers["X-Cache"], body) == (200, "MISS", b"rebuilt")
+        assert _get(opener, base + "foo.rpm")[1]["X-Cache"] == "HIT"
+        assert repo.requests == ["/foo.rpm", "/foo.rpm"]
+        assert server.cache.stats["stale"] == 1
+
+    def test_eviction(self, proxy, tmp_path):
+        """ The least recently used objects are evicted to fit into max_size """
+        opener, base, _, server = proxy
+        cache = server.cache
+        for i, name in enumerate(["old.rpm", "new.rpm"]):
+            (tmp_path / "repo" / name).write_bytes(b"x" * 1000)
+            _get(opener, base + name)
+            used = time.time() - 3600 * (2 - i)
+            for path in (cache.object_path(base + name), cache.object_path(base + name) + ".json"):
+                os.utime(path, (used, used))
+        cache.max_size = 1500
+        cache.prune()
+        assert cache.lookup(base + "old.rpm") is None
+        assert cache.lookup(base + "new.rpm") is not None
+        assert cache.index.size() <= 1500
+        assert cache.stats["evicted_files"] == 2
+
+    def test_not_found(self, proxy):
+        """ Upstream errors are forwarded, and not cached """
+        opener, base, _, _ = proxy
+        with pytest.raises(urllib.error.HTTPError) as error:
+            _get(opener, base + "missing.rpm")
+        assert error.value.code == 404
+
+
+def test_parse_range():
+    """ Range header parsing """
+    assert parse_range(None, 10) is None
+    assert parse_range("bytes=0-", 10) == (0, 9)
+    assert parse_range("bytes=5-100", 10) == (5, 9)
+    assert parse_range("bytes=-20", 10) == (0, 9)
+    assert parse_range("bytes=10-", 10) is False
+    assert parse_range("bytes=0-1,3-4", 10) is None
+
+
+class TestEnsureRunning:
+    """ Only the proxy run by the caching_proxy_user is used """
+
+    @staticmethod
+    def _config(tmp_path, port):
+        return {"caching_proxy_port": port, "caching_proxy_dir": str(tmp_path / "cache"),
+                "caching_proxy_user": pwd.getpwuid(os.getuid()).pw_name}
+
+    def test_listener_uid(self):
+        """ The owner of the listening socket is found """
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+            assert listener_uid(port) is None
+            sock.listen()
+            assert listener_uid(port) == os.getuid()
+            assert is_running(port, os.getuid())
+            assert not is_running(port, os.getuid() + 1)
+
+    def test_foreign_listener(self, tmp_path):
+        """ A listener owned by another user is not used, and not replaced """
+        uid_manager = mock.MagicMock()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.listen()
+            config = self._config(tmp_path, sock.getsockname()[1])
+            assert ensure_running(config, uid_manager)
+            with mock.patch("mockbuild.caching_proxy.listener_uid", return_value=os.getuid() + 1):
+                assert not ensure_running(config, uid_manager)
+        uid_manager.elevated_privileges.assert_not_called()
+
+    def test_error(self, tmp_path):
+        """ Direct downloads if the proxy can not be set up """
+        config = self._config(tmp_path, 0)
+        with mock.patch("os.makedirs", side_effect=PermissionError(13, "Permission denied")):
+            assert not ensure_running(config, mock.MagicMock())
+        config["caching_proxy_user"] = "no-such-user-for-mock-tests"
+        assert not ensure_running(config, mock.MagicMock())
+
+
+def test_proxy_environment():
+    """ Only the package manager uses the caching proxy """
+    config = {"caching_proxy": True, "caching_proxy_port": 3129, "http_proxy": "http://upstream:8080/"}
+    with mock.patch.dict(os.environ, clear=True):
+        assert util.get_proxy_environment(config) == {"http_proxy": "http://upstream:8080/"}
+        assert util.get_proxy_environment(config, package_manager=True) == {
+            "http_proxy": "http://127.0.0.1:3129/"}
@@ -0,0 +1,73 @@
+"""Tests for the --chain build scheduler"""
+
+import sys
+
+from mockbuild.chain import ChainScheduler, child_mock_command
+
+
+def _scheduler(*packages):
+    scheduler = ChainScheduler()
+    for name, requires in packages:
+        scheduler.add(name + "-1-1.src.rpm", name, requires)
+    scheduler.resolve()
+    return scheduler
+
+
+def _names(nodes):
+    return [node.name for node in nodes]
+
+
+class TestChainScheduler:
+    """Dependency ordering of the chain builds"""
+
+    def test_dependencies_by_name(self):
+        """foo-devel and foo-libs are provided by the foo SRPM"""
+        scheduler = _scheduler(
+            ("app", ["foo-devel", "gcc", "foo-bar-devel"]),
+            ("foo", ["gcc"]),
+            ("foo-bar", ["foo-libs"]),
+        )
+        app, foo, foobar = scheduler.nodes
+        assert app.deps == {foo, foobar}
+        assert foo.deps == set()
+        assert foobar.deps == {foo}
+
+    def test_independent_packages_start_together(self):
+        """Everything without in-chain dependencies is ready at once"""
+        scheduler = _scheduler(("a", []), ("b", ["a-devel"]), ("c", []))
+        assert _names(scheduler.ready()) == ["a", "c"]
+
+    def test_package_waits_for_dependency(self):
+        """Package is released only once its dependencies finished"""
+        scheduler = _scheduler(("a", []), ("b", ["a"]))
+        a, b = scheduler.nodes
+        scheduler.start(a)
+        assert scheduler.ready() == []
+        scheduler.finish(a, True)
+        assert scheduler.ready() == [b]
+        scheduler.start(b)
+        scheduler.finish(b, False)
+        assert scheduler.done()
+        assert scheduler.failed() == [b]
+        scheduler.retry_failed()
+        assert scheduler.ready() == [b]
+
+    def test_cycle_is_broken(self):
+        """Dependency cycle doesn't block the chain forever"""
+        scheduler = _scheduler(("a", ["b"]), ("b", ["a"]))
+        a, b = scheduler.nodes
+        assert scheduler.ready() == [a]
+        scheduler.start(a)
+        assert scheduler.ready() == []
+        scheduler.finish(a, True)
+        assert scheduler.ready() == [b]
+
+
+def test_child_mock_command():
+    """Chain-only options and the SRPMs are not passed to the child mock"""
+    argv = ["-r", "fedora-rawhide-x86_64", "--chain", "--chain-jobs", "4",
+            "--recurse", "--localrepo=/tmp/repo", "--config-opts=foo=bar",
+            "a.src.rpm", "-c", "b.src.rpm"]
+    cmd = child_mock_command(argv, ["a.src.rpm", "b.src.rpm"])
+    assert cmd[0] == sys.executable
+    assert cmd[2:] == ["-r", "fedora-rawhide-x86_64", "--config-opts=foo=bar"]
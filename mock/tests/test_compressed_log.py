@@ -0,0 +1,116 @@
+""" Tests for the mockbuild.compressed_log """
+
+import gzip
+import logging
+import lzma
+import os
+import shutil
+from unittest import mock
+
+import pytest
+
+from mockbuild import compressed_log
+from mockbuild.compressed_log import CompressedFileHandler
+
+
+def _logger(handler):
+    log = logging.getLogger("mockbuild.test.compressed_log")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    for old in log.handlers[:]:
+        log.removeHandler(old)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    return log
+
+
+class TestCompressedFileHandler:
+    """ Compressed log files written by the logging handler """
+
+    @pytest.mark.parametrize("compression, opener", [("gzip", gzip.open), ("xz", lzma.open)])
+    def test_flush_points(self, tmp_path, compression, opener):
+        """ Each flush point appends a member, the file is readable meanwhile """
+        handler = CompressedFileHandler(str(tmp_path / "build.log"), compression,
+                                        flush_interval=3600, flush_size=100)
+        log = _logger(handler)
+        log.info("first line")
+        # buffered, nothing written yet
+        assert os.path.getsize(handler.baseFilename) == 0
+        for i in range(20):
+            log.info("line %d", i)
+        with opener(handler.baseFilename, "rt") as f:
+            partial = f.read()
+        assert partial.startswith("first line\nline 0\n")
+        handler.close()
+        with opener(handler.baseFilename, "rt") as f:
+            assert f.read() == "first line\n" + "".join("line {0}\n".format(i) for i in range(20))
+
+    def test_flush_interval(self, tmp_path):
+        """ Records older than flush_interval are written by the flusher """
+        handler = CompressedFileHandler(str(tmp_path / "root.log"), "gzip", flush_interval=0)
+        log = _logger(handler)
+        log.info("hello")
+        handler.flush(only_expired=True)
+        with gzip.open(handler.baseFilename, "rt") as f:
+            assert f.read() == "hello\n"
+        handler.close()
+
+    def test_append(self, tmp_path):
+        """ Re-opened log (e.g. resetLogging(force=True)) is appended """
+        for line in ("one", "two"):
+            handler = CompressedFileHandler(str(tmp_path / "state.log"), "xz")
+            _logger(handler).info(line)
+            handler.close()
+        with lzma.open(str(tmp_path / "state.log.xz"), "rt") as f:
+            assert f.read() == "one\ntwo\n"
+
+    @pytest.mark.skipif(not shutil.which("zstd"), reason="zstd not installed")
+    def test_zstd(self, tmp_path):
+        """ zstd frames """
+        handler = CompressedFileHandler(str(tmp_path / "build.log"), "zstd")
+        _logger(handler).info("zstd line")
+        handler.close()
+        assert handler.baseFilename.endswith(".log.zst")
+        with open(handler.baseFilename, "rb") as f:
+            assert f.read(4) == b"\x28\xb5\x2f\xfd"
+
+    def test_unknown(self, tmp_path):
+        """ Unsupported compression """
+        with pytest.raises(ValueError):
+            CompressedFileHandler(str(tmp_path / "build.log"), "lz4")
+
+    def test_zstd_missing(self, tmp_path):
+        """ Without zstd support the handler can not be created """
+        with mock.patch("mockbuild.compressed_log.zstd", None), \
+                mock.patch.dict(os.environ, {"PATH": str(tmp_path)}):
+            with pytest.raises(ValueError):
+                CompressedFileHandler(str(tmp_path / "build.log"), "zstd")
+        assert not os.path.exists(str(tmp_path / "build.log.zst"))
+
+    def test_failed_flush(self, tmp_path):
+        """ The records are kept buffered until the compression succeeds """
+        handler = CompressedFileHandler(str(tmp_path / "build.log"), "gzip", flush_interval=0)
+        log = _logger(handler)
+        log.info("kept")
+        with mock.patch.object(handler, "_compress", side_effect=OSError("failed")):
+            with pytest.raises(OSError):
+                handler.flush()
+            log.info("also kept")
+        handler.close()
+        with gzip.open(handler.baseFilename, "rt") as f:
+            assert f.read() == "kept\nalso kept\n"
+
+    def test_flusher_survives(self, tmp_path):
+        """ A failing handler doesn't stop the periodic flushing of the others """
+        broken = CompressedFileHandler(str(tmp_path / "broken.log"), "gzip", flush_interval=0)
+        broken.flush = mock.Mock(side_effect=OSError("failed"))
+        handler = CompressedFileHandler(str(tmp_path / "build.log"), "gzip", flush_interval=0)
+        _logger(handler).info("flushed")
+        with mock.patch("time.sleep", side_effect=[None, KeyboardInterrupt]):
+            with pytest.raises(KeyboardInterrupt):
+                compressed_log._flush_loop(0)  # pylint: disable=protected-access
+        with gzip.open(handler.baseFilename, "rt") as f:
+            assert f.read() == "flushed\n"
+        handler.close()
+        del broken.flush
+        broken.close()
@@ -12,7 +12,8 @@ import shutil
 import tempfile
 
 from unittest import mock
-from mockbuild.config import simple_load_config
+import mockbuild.config
+from mockbuild.config import simple_load_config, _is_static_config
 
 
 class TestConfigLoader:
@@ -50,3 +51,97 @@ class TestConfigLoader:
 
     def teardown_method(self):
         shutil.rmtree(self.homedir)
+
+
+class TestConfigCache:
+    def setup_method(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='mock-test-config-cache')
+        self.configdir = os.path.join(self.tmpdir, "etc")
+        self.homedir = os.path.join(self.tmpdir, "home")
+        os.makedirs(os.path.join(self.configdir, "templates"))
+        os.makedirs(self.homedir)
+        self._write("site-defaults.cfg", "config_opts['site'] = 'site'\n")
+        self._write("templates/base.tpl", "config_opts['template'] = 'base-{{ root }}'\n")
+        self._write("test-1-x86_64.cfg", "include('templates/base.tpl')\n"
+                                         "config_opts['root'] = 'test-1-x86_64'\n")
+
+    def _write(self, name, content):
+        with open(os.path.join(self.configdir, name), "w") as f:
+            f.write(content)
+        # make sure the mtime differs, the cache must not depend on it
+        os.utime(os.path.join(self.configdir, name), (0, 0))
+
+    def _load(self, name='test-1-x86_64'):
+        with mock.patch("mockbuild.config.os.path.expanduser") as patch, \
+                mock.patch.dict(os.environ, {"MOCK_CONFIG_CACHE": "1"}), \
+                mock.patch("mockbuild.config.update_config_from_file",
+                           wraps=mockbuild.config.update_config_from_file) as update:
+            patch.side_effect = lambda x: x.replace("~", self.homedir + "/")
+            config = simple_load_config(name, self.configdir)
+        return config, update.call_count
+
+    def _cache_files(self):
+        cachedir = os.path.join(self.homedir, self.username, ".cache", "mock", "configs")
+        return os.listdir(cachedir) if os.path.exists(cachedir) else []
+
+    @property
+    def username(self):
+        return pwd.getpwuid(os.getuid())[0]
+
+    def test_cache_hit(self):
+        config, loaded = self._load()
+        assert loaded == 2
+        assert len(self._cache_files()) == 1
+        cached, loaded = self._load()
+        assert loaded == 0
+        assert cached["template"] == "base-test-1-x86_64"
+        assert cached["site"] == "site"
+        assert sorted(cached["config_paths"]) == sorted(config["config_paths"])
+        assert cached["mock_run_uuid"] != config["mock_run_uuid"]
+
+    def test_included_file_changed(self):
+        self._load()
+        self._write("templates/base.tpl", "config_opts['template'] = 'changed'\n")
+        config, loaded = self._load()
+        assert loaded == 2
+        assert config["template"] == "changed"
+
+    def test_symlink_retargeted(self):
+        self._write("test-2-x86_64.cfg", "include('templates/base.tpl')\n"
+                                         "config_opts['root'] = 'test-2-x86_64'\n")
+        default = os.path.join(self.configdir, "default.cfg")
+        os.symlink("test-1-x86_64.cfg", default)
+        config, _ = self._load("default")
+        assert config["root"] == "test-1-x86_64"
+        os.unlink(default)
+        os.symlink("test-2-x86_64.cfg", default)
+        config, loaded = self._load("default")
+        assert loaded == 2
+        assert config["root"] == "test-2-x86_64"
+
+    def test_new_user_config(self):
+        self._load()
+        os.makedirs(os.path.join(self.homedir, self.username, ".config"))
+        with open(os.path.join(self.homedir, self.username, ".config", "mock.cfg"), "w") as f:
+            f.write("config_opts['site'] = 'user'\n")
+        config, _ = self._load()
+        assert config["site"] == "user"
+
+    def test_dynamic_config_not_cached(self):
+        self._write("site-defaults.cfg", "config_opts['site'] = os.environ.get('SITE', 'site')\n")
+        self._load()
+        assert self._cache_files() == []
+        _, loaded = self._load()
+        assert loaded == 2
+
+    def test_static_config(self):
+        assert _is_static_config("config_opts['a'] = 'b'\n"
+                                 "config_opts['c'] += ['d']\n"
+                                 "config_opts['plugin_conf']['x'].update({'y': len('z')})\n"
+                                 "include('templates/foo.tpl')\n")
+        assert not _is_static_config("import os\nconfig_opts['a'] = os.getcwd()\n")
+        assert not _is_static_config("config_opts['a'] = os.environ['HOME']\n")
+        assert not _is_static_config("config_opts['a'] = open('/etc/foo').read()\n")
+
+    def teardown_method(self):
+        shutil.rmtree(self.tmpdir)
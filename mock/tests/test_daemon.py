@@ -0,0 +1,122 @@
+"""Tests for the mockd warm buildroot pool"""
+
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from mockbuild import daemon
+from mockbuild import exception
+
+FAKE_MOCK = """#!/bin/sh
+echo "$@" >> {log}
+case "$*" in
+  *--snapshot*) exit {snapshot_rc} ;;
+esac
+exit 0
+"""
+
+
+def _fake_mock(tmp_path, snapshot_rc=0):
+    script = tmp_path / "mock"
+    script.write_text(FAKE_MOCK.format(log=tmp_path / "calls.log", snapshot_rc=snapshot_rc))
+    script.chmod(0o755)
+    return [str(script)]
+
+
+def _calls(tmp_path):
+    return (tmp_path / "calls.log").read_text().splitlines()
+
+
+class TestBuildrootPool:
+    """Acquiring and resetting the warm buildroots"""
+
+    def test_build_in_snapshotted_buildroot(self, tmp_path):
+        """Build doesn't clean, and the buildroot is rolled back afterwards"""
+        pool = daemon.BuildrootPool("cfg", 1, _fake_mock(tmp_path))
+        pool.start()
+        reply = pool.build("/x.src.rpm", "/results")
+        assert reply["returncode"] == 0
+        assert reply["slot"] == "mockd-0"
+        # wait for the rollback
+        assert pool.acquire() is pool.slots[0]
+        calls = _calls(tmp_path)
+        assert calls[0] == "-r cfg --uniqueext mockd-0 --init"
+        assert calls[1] == "-r cfg --uniqueext mockd-0 --snapshot mockd-postinit"
+        assert calls[2].startswith("-r cfg --uniqueext mockd-0 --rebuild /x.src.rpm")
+        assert "--no-clean" in calls[2]
+        assert calls[3] == "-r cfg --uniqueext mockd-0 --rollback-to mockd-postinit"
+
+    def test_no_snapshot_support(self, tmp_path):
+        """Without snapshots, mock cleans the buildroot itself"""
+        pool = daemon.BuildrootPool("cfg", 1, _fake_mock(tmp_path, snapshot_rc=1))
+        pool.start()
+        pool.build("/x.src.rpm", "/results")
+        pool.acquire()
+        assert not any("--no-clean" in call for call in _calls(tmp_path))
+
+    def test_reset_failure(self, tmp_path):
+        """Buildroot failing to reset is marked broken, not stuck in resetting"""
+        pool = daemon.BuildrootPool("cfg", 1, _fake_mock(tmp_path))
+        pool.start()
+        slot = pool.acquire()
+        with patch.object(pool, "_mock", side_effect=OSError("mock not found")):
+            pool.release(slot)
+            assert pool.acquire() is None
+        assert pool.status() == {"mockd-0": daemon.BROKEN}
+
+
+@pytest.mark.parametrize("mock_args, allowed", [
+    ([], True),
+    (["--with", "tests", "--without=docs", "--define", "dist .fc42", "--nocheck"], True),
+    (["--with"], False),
+    (["--nocheck=1"], False),
+    (["--enable-network"], False),
+    (["--chain", "--localrepo", "/etc"], False),
+    ("--nocheck", False),
+])
+def test_check_mock_args(mock_args, allowed):
+    """Only the whitelisted mock options are accepted"""
+    if allowed:
+        assert daemon.check_mock_args(mock_args) == mock_args
+    else:
+        with pytest.raises(ValueError):
+            daemon.check_mock_args(mock_args)
+
+
+def test_daemon_roundtrip(tmp_path):
+    """Requests are served over the UNIX socket"""
+    sock = str(tmp_path / "mockd.sock")
+    pool = daemon.BuildrootPool("cfg", 2, _fake_mock(tmp_path))
+    pool.start()
+    server = daemon.MockDaemon(sock, {"cfg": pool})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        reply = daemon.request(sock, {"config": "cfg", "srpm": "x.src.rpm",
+                                      "resultdir": str(tmp_path)})
+        assert reply["returncode"] == 0
+        reply = daemon.request(sock, {"config": "other", "srpm": "x.src.rpm",
+                                      "resultdir": str(tmp_path)})
+        assert "not served" in reply["error"]
+        reply = daemon.request(sock, {"config": "cfg", "srpm": "x.src.rpm",
+                                      "resultdir": str(tmp_path), "mock_args": ["--enable-network"]})
+        assert "not allowed" in reply["error"]
+        status = daemon.request(sock, {"command": "status"})
+        assert set(status["pools"]["cfg"]) == {"mockd-0", "mockd-1"}
+        assert os.stat(sock).st_mode & 0o777 == 0o600
+        with patch("mockbuild.daemon._peer_uid", return_value=os.getuid() + 1000):
+            assert daemon.request(sock, {"command": "status"})["error"] == "permission denied"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_shared_socket_dir(tmp_path):
+    """The socket is never created in a directory writable by others"""
+    shared = tmp_path / "tmp"
+    shared.mkdir()
+    shared.chmod(0o1777)
+    with pytest.raises(exception.Error):
+        daemon.MockDaemon(str(shared / "mockd.sock"), {})
@@ -374,3 +374,57 @@ class TestRmtree:
         assert (temp_dir / "keepdir empty").exists()
         assert (temp_dir / "keepdir").exists()
         assert (temp_dir / "keepdir" / "file.txt").exists()
+
+
+class TestParallelRmtree:
+    """Tests for file_util.rmtree(..., parallel=True)"""
+
+    @staticmethod
+    def _tree(base: Path, width=6, depth=3):
+        for i in range(width):
+            (base / "file{0}".format(i)).write_text("data")
+            (base / "link{0}".format(i)).symlink_to("file{0}".format(i))
+        if depth:
+            for i in range(width):
+                sub = base / "dir{0}".format(i)
+                sub.mkdir()
+                TestParallelRmtree._tree(sub, width, depth - 1)
+
+    @patch("mockbuild.file_util.RMTREE_WORKERS", 4)
+    def test_large_tree(self, temp_dir):
+        """The whole tree is removed"""
+        self._tree(temp_dir)
+        file_util.rmtree(str(temp_dir), parallel=True)
+        assert not temp_dir.exists()
+
+    @patch("mockbuild.file_util.RMTREE_WORKERS", 4)
+    def test_exclude(self, temp_dir):
+        """Excluded paths are kept, at any level"""
+        self._tree(temp_dir)
+        exclude = [str(temp_dir / "dir1"), str(temp_dir / "dir2" / "dir3" / "dir4" / "file5")]
+        file_util.rmtree(str(temp_dir), parallel=True, exclude=exclude)
+        assert (temp_dir / "dir1" / "dir0" / "file0").exists()
+        assert (temp_dir / "dir2" / "dir3" / "dir4" / "file5").exists()
+        assert sorted(os.listdir(temp_dir)) == ["dir1", "dir2"]
+        assert os.listdir(temp_dir / "dir2" / "dir3" / "dir4") == ["file5"]
+
+    @patch("mockbuild.file_util.RMTREE_WORKERS", 4)
+    def test_symlink_out(self, temp_dir):
+        """Symlinked directories are not followed"""
+        (temp_dir / "keep").mkdir()
+        (temp_dir / "keep" / "file.txt").write_text("keep")
+        (temp_dir / "to rm").mkdir()
+        self._tree(temp_dir / "to rm", depth=2)
+        (temp_dir / "to rm" / "dir0" / "link to dir").symlink_to(str(temp_dir / "keep"))
+        file_util.rmtree(str(temp_dir / "to rm"), parallel=True)
+        assert not (temp_dir / "to rm").exists()
+        assert (temp_dir / "keep" / "file.txt").exists()
+
+    @patch("mockbuild.file_util.RMTREE_WORKERS", 4)
+    def test_falls_back_on_error(self, temp_dir):
+        """Unexpected errors are handled by the sequential engine"""
+        self._tree(temp_dir, depth=1)
+        with patch("mockbuild.file_util._fd_rmtree_contents",
+                   side_effect=OSError(errno.EBUSY, "busy")):
+            file_util.rmtree(str(temp_dir), parallel=True)
+        assert not temp_dir.exists()
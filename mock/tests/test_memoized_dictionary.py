@@ -0,0 +1,125 @@
+""" Tests for the mockbuild.memoized_dictionary """
+
+import json
+import pickle
+
+import pytest
+
+from mockbuild.memoized_dictionary import MemoizedTemplatedDictionary
+
+
+def _stats(config):
+    return {entry["key"]: (entry["renders"], entry["memo_hits"]) for entry in config.render_stats()}
+
+
+class TestMemoizedTemplatedDictionary:
+    """ Memoized Jinja expansion of the config options """
+
+    def test_memoized(self):
+        """ Rendered once, then the memoized value is returned """
+        config = MemoizedTemplatedDictionary()
+        config['a'] = 'test'
+        config['b'] = '{{ a }} {{ a }}'
+        config['c'] = '{{ b + " " + b }}'
+        assert config['c'] == '{{ b + " " + b }}'
+        config['__jinja_expand'] = True
+        for _ in range(3):
+            assert config['c'] == 'test test test test'
+        # '{{ b + " " + b }}' => '{{ a }} {{ a }} {{ a }} {{ a }}' => 'test test test test'
+        assert _stats(config) == {'c': (2, 2)}
+
+    def test_invalidation(self):
+        """ Assigning (or deleting) an option, even transitively used one, invalidates the value """
+        config = MemoizedTemplatedDictionary(alias_spec={'dnf.conf': ['yum.conf']})
+        config['basedir'] = '/var/lib/mock'
+        config['root'] = 'fedora'
+        config['rootdir'] = '{{ basedir }}/{{ root }}'
+        config['chroot'] = '{{ rootdir }}/root'
+        config['dnf.conf'] = '[main]\n'
+        config['repos'] = '{{ dnf.conf }}'
+        config['__jinja_expand'] = True
+        assert config['chroot'] == '/var/lib/mock/fedora/root'
+        config['root'] = 'epel'
+        assert config['chroot'] == '/var/lib/mock/epel/root'
+        config['chroot'] = '{{ rootdir }}/chroot'
+        assert config['chroot'] == '/var/lib/mock/epel/chroot'
+        del config['root']
+        assert config['chroot'] == '/var/lib/mock//chroot'
+        config['root'] = 'centos'
+        assert config['chroot'] == '/var/lib/mock/centos/chroot'
+
+        config['yum.conf'] += '{{ root }}'
+        assert config['dnf.conf'] == '[main]\ncentos'
+        config['root'] = 'fedora'
+        assert config['yum.conf'] == '[main]\nfedora'
+
+    def test_jinja_expand_toggle(self):
+        """ Memoized values are not returned with expansion disabled """
+        config = MemoizedTemplatedDictionary()
+        config['a'] = 'a'
+        config['b'] = '{{ a }}'
+        config['__jinja_expand'] = True
+        assert config['b'] == 'a'
+        config['__jinja_expand'] = False
+        assert config['b'] == '{{ a }}'
+        config['__jinja_expand'] = True
+        assert config['b'] == 'a'
+        assert _stats(config) == {'b': (2, 0)}
+
+    def test_containers_not_memoized(self):
+        """ Values using lists and dicts (mutable in place) are re-rendered """
+        config = MemoizedTemplatedDictionary()
+        config['archmap'] = {'arm7hl': 'armhfp'}
+        config['target_arch'] = 'arm7hl'
+        config['repo_arch'] = '{{ archmap[target_arch] }}'
+        config['__jinja_expand'] = True
+        assert config['repo_arch'] == 'armhfp'
+        config['archmap']['arm7hl'] = 'arm'
+        assert config['repo_arch'] == 'arm'
+
+    def test_no_template(self):
+        """ Strings without Jinja delimiters are not rendered at all """
+        config = MemoizedTemplatedDictionary()
+        config['macros'] = {'%_prefix': '/usr', '%_bindir': '%{_prefix}/bin'}
+        config['string'] = "\n\na\n\n"
+        config['__jinja_expand'] = True
+        assert config['macros'] == {'%_prefix': '/usr', '%_bindir': '%{_prefix}/bin'}
+        assert config['string'] == "\n\na\n\n"
+        assert not config.render_stats()
+
+    def test_too_deep_recursion(self):
+        """ The recursion limit is kept """
+        config = MemoizedTemplatedDictionary()
+        config['a'] = '{{ b }}'
+        config['b'] = '[ {{ a }} ]'
+        config['__jinja_expand'] = True
+        with pytest.raises(ValueError):
+            config['a']  # pylint: disable=pointless-statement
+
+    def test_copy_and_pickle(self):
+        """ Copies have their own memo, the memo is not pickled """
+        config = MemoizedTemplatedDictionary()
+        config['a'] = 'a'
+        config['b'] = '{{ a }}'
+        config['__jinja_expand'] = True
+        assert config['b'] == 'a'
+        for other in (config.copy(), pickle.loads(pickle.dumps(config))):
+            assert isinstance(other, MemoizedTemplatedDictionary)
+            assert sorted(other) == ['__jinja_expand', '_aliases', 'a', 'b']
+            assert not other.render_stats()
+            other['a'] = 'c'
+            assert other['b'] == 'c'
+        assert config['b'] == 'a'
+
+    def test_write_render_stats(self, tmp_path):
+        """ The report is dumped as JSON """
+        config = MemoizedTemplatedDictionary()
+        config['a'] = '{{ b }}'
+        config['b'] = 'b'
+        config['__jinja_expand'] = True
+        assert config['a'] == 'b'
+        config.write_render_stats(str(tmp_path / "config-renders.json"))
+        with open(str(tmp_path / "config-renders.json")) as f:
+            stats = json.load(f)
+        assert [(entry["key"], entry["renders"], entry["memo_hits"]) for entry in stats] == [('a', 1, 0)]
+        assert stats[0]["time"] >= 0
@@ -0,0 +1,87 @@
+""" Tests for the mockbuild.plugin """
+
+import json
+import pstats
+
+from mockbuild.plugin import Plugins
+from mockbuild.state import State
+
+
+def _plugins(profile_hooks=False):
+    config = {
+        "plugins": [],
+        "plugin_conf": {},
+        "plugin_dir": "/nonexistent",
+        "profile_hooks": profile_hooks,
+    }
+    return Plugins(config, State())
+
+
+class _Plugin:
+    def __init__(self):
+        self.called = 0
+
+    def hook(self):
+        self.called += 1
+
+
+class TestHookStats:
+    """ Plugins.call_hooks() instrumentation """
+
+    def test_counts_and_summary(self, tmp_path):
+        """ Each hook is counted per stage, the summary lands in resultdir """
+        plugins = _plugins()
+        plugin = _Plugin()
+        plugins.add_hook("postyum", plugin.hook)
+        plugins.add_hook("postbuild", plugin.hook)
+        plugins.call_hooks("postyum")
+        plugins.call_hooks("postyum")
+        plugins.call_hooks("postbuild")
+        assert plugin.called == 3
+
+        plugins.write_hook_stats(str(tmp_path))
+        summary = json.loads((tmp_path / "hooks.json").read_text())
+        calls = {(entry["stage"], entry["hook"]): entry["calls"] for entry in summary}
+        name = "{0}._Plugin.hook".format(__name__)
+        assert calls == {("postyum", name): 2, ("postbuild", name): 1}
+        assert not (tmp_path / "hooks-profile").exists()
+
+    def test_failing_hook_is_counted(self):
+        """ The time is recorded even when the hook raises """
+        plugins = _plugins()
+
+        def failing():
+            raise RuntimeError("boom")
+
+        plugins.add_hook("prebuild", failing)
+        try:
+            plugins.call_hooks("prebuild")
+        except RuntimeError:
+            pass
+        assert [stats[0] for stats in plugins.hook_stats.values()] == [1]
+
+    def test_profile(self, tmp_path):
+        """ With profile_hooks, cProfile data are dumped per hook """
+        plugins = _plugins(profile_hooks=True)
+        plugin = _Plugin()
+        plugins.add_hook("postyum", plugin.hook)
+        plugins.call_hooks("postyum")
+        plugins.write_hook_stats(str(tmp_path), prefix="bootstrap-")
+        summary = json.loads((tmp_path / "bootstrap-hooks.json").read_text())
+        assert pstats.Stats(summary[0]["profile"]).total_calls > 0
+
+    def test_profile_nested_hooks(self, tmp_path):
+        """ Hook calling other hooks is profiled, the nested ones are just timed """
+        plugins = _plugins(profile_hooks=True)
+        plugin = _Plugin()
+        plugins.add_hook("preyum", plugin.hook)
+        plugins.add_hook("pre_srpm_build", lambda: plugins.call_hooks("preyum"))
+        plugins.call_hooks("pre_srpm_build")
+        plugins.call_hooks("preyum")
+        assert plugin.called == 2
+        plugins.write_hook_stats(str(tmp_path))
+        summary = json.loads((tmp_path / "hooks.json").read_text())
+        assert sorted((entry["stage"], entry["calls"]) for entry in summary) == \
+            [("pre_srpm_build", 1), ("preyum", 2)]
+        for entry in summary:
+            assert pstats.Stats(entry["profile"]).total_calls > 0
@@ -0,0 +1,100 @@
+"""Tests for the content-addressed root cache store"""
+
+import errno
+import os
+from unittest.mock import patch
+
+from mockbuild import root_cache_store
+
+
+def _create_chroot(root):
+    (root / "usr" / "bin").mkdir(parents=True)
+    (root / "usr" / "bin" / "tool").write_text("#!/bin/sh\n")
+    (root / "usr" / "bin" / "tool").chmod(0o755)
+    os.link(root / "usr" / "bin" / "tool", root / "usr" / "bin" / "tool-link")
+    (root / "usr" / "bin" / "sym").symlink_to("tool")
+    (root / "etc").mkdir()
+    (root / "etc" / "os-release").write_text("NAME=test\n")
+    (root / "proc").mkdir()
+    (root / "proc" / "ignored").write_text("x")
+    (root / "var" / "cache" / "dnf").mkdir(parents=True)
+    (root / "var" / "cache" / "dnf" / "CACHEDIR.TAG").write_text("tag")
+    (root / "var" / "cache" / "dnf" / "ignored").write_text("x")
+
+
+def test_pack_unpack_roundtrip(tmp_path):
+    """Chroot is restored from the store, including hardlinks and symlinks"""
+    store = root_cache_store.ObjectStore(str(tmp_path / "store"))
+    src = tmp_path / "src"
+    _create_chroot(src)
+    tree = str(tmp_path / "cache.tree.json.gz")
+    root_cache_store.pack(store, str(src), tree, excludes=["./proc/ignored"])
+
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    root_cache_store.unpack(store, tree, str(dst))
+
+    assert (dst / "usr" / "bin" / "tool").read_text() == "#!/bin/sh\n"
+    assert os.stat(dst / "usr" / "bin" / "tool").st_mode & 0o777 == 0o755
+    assert os.path.samefile(dst / "usr" / "bin" / "tool", dst / "usr" / "bin" / "tool-link")
+    assert os.readlink(dst / "usr" / "bin" / "sym") == "tool"
+    assert (dst / "proc").is_dir()
+    assert not (dst / "proc" / "ignored").exists()
+    assert os.listdir(dst / "var" / "cache" / "dnf") == ["CACHEDIR.TAG"]
+    assert os.stat(dst / "etc").st_mtime_ns == os.stat(src / "etc").st_mtime_ns
+
+
+def test_deduplication_and_gc(tmp_path):
+    """Same files of two chroots are stored once, unused objects are removed"""
+    store = root_cache_store.ObjectStore(str(tmp_path / "store"))
+    trees = []
+    for name in ["one", "two"]:
+        src = tmp_path / name
+        _create_chroot(src)
+        mtime = os.stat(tmp_path / "one" / "etc" / "os-release").st_mtime_ns
+        for path in ["etc/os-release", "usr/bin/tool", "proc/ignored",
+                     "var/cache/dnf/CACHEDIR.TAG"]:
+            os.utime(src / path, ns=(mtime, mtime))
+        trees.append(str(tmp_path / (name + ".json.gz")))
+        root_cache_store.pack(store, str(src), trees[-1])
+
+    def _objects():
+        return sum(len(files) for _, _, files in os.walk(store.objects))
+
+    assert _objects() == 4
+    assert store.gc() == 0
+    os.unlink(trees[0])
+    (tmp_path / "two" / "etc" / "os-release").write_text("NAME=changed\n")
+    root_cache_store.pack(store, str(tmp_path / "two"), trees[1])
+    assert store.gc() == 1
+    assert _objects() == 4
+
+
+def test_clone_tree(tmp_path):
+    """Pristine tree is cloned into a new buildroot"""
+    src = tmp_path / "pristine"
+    _create_chroot(src)
+    dst = tmp_path / "buildroot"
+    root_cache_store.clone_tree(str(src), str(dst), root_cache_store.FileLinker("copy"),
+                                excludes=["./proc/ignored"])
+    assert (dst / "etc" / "os-release").read_text() == "NAME=test\n"
+    assert not os.path.samefile(dst / "etc" / "os-release", src / "etc" / "os-release")
+    assert os.path.samefile(dst / "usr" / "bin" / "tool", dst / "usr" / "bin" / "tool-link")
+    assert not (dst / "proc" / "ignored").exists()
+
+    hardlinked = tmp_path / "hardlinked"
+    root_cache_store.clone_tree(str(src), str(hardlinked), root_cache_store.FileLinker("hardlink"))
+    assert os.path.samefile(hardlinked / "etc" / "os-release", src / "etc" / "os-release")
+
+
+def test_auto_never_hardlinks(tmp_path):
+    """Without reflink support, "auto" copies the files"""
+    src = tmp_path / "pristine"
+    _create_chroot(src)
+    dst = tmp_path / "buildroot"
+    linker = root_cache_store.FileLinker("auto")
+    with patch("mockbuild.file_util.reflink", side_effect=OSError(errno.EOPNOTSUPP, "reflink")):
+        root_cache_store.clone_tree(str(src), str(dst), linker)
+    assert not os.path.samefile(dst / "etc" / "os-release", src / "etc" / "os-release")
+    (dst / "etc" / "os-release").write_text("NAME=modified\n")
+    assert (src / "etc" / "os-release").read_text() == "NAME=test\n"
@@ -0,0 +1,100 @@
+""" Tests for the mockbuild.rpm_pool """
+
+import gzip
+import hashlib
+import os
+from unittest.mock import patch
+
+from mockbuild.rpm_pool import RpmPool
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <location href="repodata/abc-primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+PACKAGE = """
+  <package type="rpm">
+    <name>{name}</name>
+    <checksum type="sha256" pkgid="YES">{checksum}</checksum>
+    <location href="Packages/{name}.rpm"/>
+  </package>"""
+
+
+def _repo(cache_dir, repo, packages):
+    """ Fake the DNF cache of REPO with PACKAGES {name: content} """
+    repodir = cache_dir / repo
+    (repodir / "repodata").mkdir(parents=True)
+    (repodir / "repodata" / "repomd.xml").write_text(REPOMD)
+    primary = '<metadata xmlns="http://linux.duke.edu/metadata/common">'
+    for name, content in packages.items():
+        primary += PACKAGE.format(name=name, checksum=hashlib.sha256(content).hexdigest())
+    primary += "</metadata>"
+    with gzip.open(repodir / "repodata" / "abc-primary.xml.gz", "wt") as f:
+        f.write(primary)
+    (repodir / "packages").mkdir()
+    return repodir
+
+
+class TestRpmPool:
+    """ Packages shared among the package manager caches """
+
+    def test_share(self, tmp_path):
+        """ A package downloaded by one config is linked into the other """
+        pool = RpmPool(str(tmp_path / "pool"))
+        packages = {"foo": b"foo content", "bar": b"bar content"}
+        x86_64 = _repo(tmp_path / "x86_64" / "dnf_cache", "fedora-1234", packages)
+        i386 = _repo(tmp_path / "i386" / "dnf_cache", "fedora-5678", packages)
+
+        # "downloaded", and a partial download
+        (x86_64 / "packages" / "foo.rpm").write_bytes(b"foo content")
+        (x86_64 / "packages" / "bar.rpm").write_bytes(b"bar")
+        assert pool.collect(str(tmp_path / "x86_64" / "dnf_cache")) == 1
+        assert os.stat(x86_64 / "packages" / "foo.rpm").st_nlink == 2
+
+        assert pool.expose(str(tmp_path / "i386" / "dnf_cache")) == 1
+        assert os.listdir(i386 / "packages") == ["foo.rpm"]
+        assert os.path.samefile(i386 / "packages" / "foo.rpm", x86_64 / "packages" / "foo.rpm")
+        # the parsed metadata are cached
+        assert (i386 / "mock-rpm-pool.json").exists()
+
+    def test_gc(self, tmp_path):
+        """ Packages not used by any config are removed """
+        pool = RpmPool(str(tmp_path / "pool"))
+        repodir = _repo(tmp_path / "dnf_cache", "fedora-1234", {"foo": b"foo"})
+        (repodir / "packages" / "foo.rpm").write_bytes(b"foo")
+        pool.collect(str(tmp_path / "dnf_cache"))
+        assert pool.gc() == 0
+        os.unlink(repodir / "packages" / "foo.rpm")
+        assert pool.gc() == 1
+        assert not pool.keys()
+
+    def test_expose_once(self, tmp_path):
+        """ The pool is not listed again for already exposed repo metadata """
+        pool = RpmPool(str(tmp_path / "pool"))
+        x86_64 = _repo(tmp_path / "x86_64" / "dnf_cache", "fedora-1234", {"foo": b"foo"})
+        (x86_64 / "packages" / "foo.rpm").write_bytes(b"foo")
+        pool.collect(str(tmp_path / "x86_64" / "dnf_cache"))
+
+        i386 = _repo(tmp_path / "i386" / "dnf_cache", "fedora-5678", {"foo": b"foo"})
+        assert pool.expose(str(tmp_path / "i386" / "dnf_cache")) == 1
+        os.unlink(i386 / "packages" / "foo.rpm")
+        with patch.object(RpmPool, "keys", side_effect=AssertionError("pool listed")), \
+                patch.object(RpmPool, "repo_packages", side_effect=AssertionError("map loaded")):
+            assert pool.expose(str(tmp_path / "i386" / "dnf_cache")) == 0
+
+        # new metadata downloaded
+        primary = i386 / "repodata" / "abc-primary.xml.gz"
+        os.utime(primary, ns=(0, 0))
+        assert pool.expose(str(tmp_path / "i386" / "dnf_cache")) == 1
+
+    def test_zstd_missing(self, tmp_path):
+        """ Repo with zstd compressed metadata is skipped without zstd """
+        repodir = _repo(tmp_path / "dnf_cache", "fedora-1234", {"foo": b"foo"})
+        (repodir / "repodata" / "repomd.xml").write_text(REPOMD.replace(".gz", ".zst"))
+        os.rename(repodir / "repodata" / "abc-primary.xml.gz", repodir / "repodata" / "abc-primary.xml.zst")
+        with patch("shutil.which", return_value=None), \
+                patch("subprocess.Popen", side_effect=AssertionError("zstd executed")):
+            assert not RpmPool.repo_packages(str(repodir))
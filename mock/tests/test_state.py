@@ -0,0 +1,71 @@
+""" Tests for the mockbuild.state """
+
+import json
+
+import pytest
+
+from mockbuild.exception import StateError
+from mockbuild.state import State, write_timings
+
+
+class TestStateTimings:
+    """ Per-phase timings recorded by State.start()/finish() """
+
+    def test_nested_states(self, tmp_path):
+        """ Finished states have duration and depth, and are dumped in order """
+        state = State()
+        bootstrap = State(bootstrap=True)
+        state.start("run")
+        bootstrap.start("chroot init")
+        bootstrap.finish("chroot init")
+        state.start("build phase")
+        state.finish("build phase")
+        state.finish("run")
+        state.alldone()
+
+        write_timings([state, bootstrap], str(tmp_path))
+        timings = json.loads((tmp_path / "timings.json").read_text())
+        assert [t["name"] for t in timings] == ["run", "chroot init", "build phase"]
+        assert [t["depth"] for t in timings] == [0, 0, 1]
+        assert [t["bootstrap"] for t in timings] == [False, True, False]
+        assert timings[0]["start"] == 0
+        for timing in timings:
+            assert timing["duration"] >= 0
+            assert "cpu_user" in timing
+            assert "unfinished" not in timing
+
+        trace = json.loads((tmp_path / "timings.trace.json").read_text())
+        events = trace["traceEvents"]
+        assert [e["tid"] for e in events] == [1, 2, 1]
+        assert all(e["ph"] == "X" for e in events)
+
+    def test_unfinished_state(self, tmp_path):
+        """ States interrupted by an exception are closed when dumped """
+        state = State()
+        state.start("run")
+        state.start("rpmbuild foo.src.rpm")
+        with pytest.raises(StateError):
+            state.finish("run")
+        write_timings([state], str(tmp_path))
+        timings = json.loads((tmp_path / "timings.json").read_text())
+        assert [t.get("unfinished") for t in timings] == [True, None]
+        assert timings[1]["duration"] >= 0
+
+    def test_chain_package(self, tmp_path):
+        """ Finished phases of one --chain package are dumped and dropped """
+        state = State()
+        state.start("run")
+        state.start("build phase")
+        state.finish("build phase")
+        write_timings([state], str(tmp_path), finished_only=True)
+        timings = json.loads((tmp_path / "timings.json").read_text())
+        assert [t["name"] for t in timings] == ["build phase"]
+        state.drop_finished_timings()
+        assert [t["name"] for t in state.timings] == ["run"]
+        state.finish("run")
+        assert state.timings[0]["duration"] >= 0
+
+    def test_no_states(self, tmp_path):
+        """ Nothing started, nothing written """
+        write_timings([State()], str(tmp_path))
+        assert not list(tmp_path.iterdir())
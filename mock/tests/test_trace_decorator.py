@@ -0,0 +1,59 @@
+""" Tests for the mockbuild.trace_decorator """
+
+import logging
+
+import pytest
+
+from mockbuild import trace_decorator
+from mockbuild.trace_decorator import getLog, traceLog
+
+
+class TestGetLog:
+    """ getLog() instances """
+
+    def test_module_name(self):
+        """ Without name, the logger of the calling module is used """
+        assert getLog().name == __name__
+        assert getLog(prefix="trace.").name == "trace." + __name__
+
+    def test_cached(self):
+        """ One instance per logger name, forwarding to the logger """
+        assert getLog("mockbuild.test") is getLog("mockbuild.test")
+        assert getLog("mockbuild.test").getEffectiveLevel() == \
+            logging.getLogger("mockbuild.test").getEffectiveLevel()
+
+
+class TestTraceRing:
+    """ MOCK_TRACE_LOG=ring backend """
+
+    def test_records(self, monkeypatch, tmp_path):
+        """ Calls are recorded into the ring buffer, and flushed to file """
+        monkeypatch.setenv("MOCK_TRACE_LOG", "ring")
+        trace_decorator._TRACE_BUFFER.clear()  # pylint: disable=protected-access
+
+        @traceLog()
+        def func(value):
+            if value is None:
+                raise ValueError("none")
+            return value
+
+        assert func(42) == 42
+        with pytest.raises(ValueError):
+            func(None)
+
+        output = tmp_path / "trace.tsv"
+        trace_decorator.flush_trace(str(output))
+        lines = [line.split("\t") for line in output.read_text().splitlines()]
+        assert [(line[0].rsplit(".", 1)[-1], line[3]) for line in lines] == \
+            [("func", "False"), ("func", "True")]
+        assert all(float(line[1]) <= float(line[2]) for line in lines)
+        assert not trace_decorator._TRACE_BUFFER  # pylint: disable=protected-access
+
+    def test_off(self, monkeypatch):
+        """ Tracing off returns the function itself """
+        monkeypatch.setenv("MOCK_TRACE_LOG", "false")
+
+        def func():
+            pass
+
+        assert traceLog()(func) is func
@@ -0,0 +1,70 @@
+""" Tests for the mockbuild.trash """
+
+import fcntl
+import os
+
+from mockbuild import trash
+
+
+def _make_tree(path):
+    os.makedirs(os.path.join(path, "root", "usr", "lib"))
+    for i in range(10):
+        with open(os.path.join(path, "root", "usr", "lib", str(i)), "w") as f:
+            f.write("x")
+    os.symlink("usr/lib", os.path.join(path, "root", "lib"))
+
+
+class TestTrash:
+    """ Deferred removal of the buildroots """
+
+    def test_move_and_reap(self, tmp_path):
+        """ The tree is moved into trash next to it, and the reaper empties it """
+        basedir = str(tmp_path / "fedora-rawhide-x86_64")
+        _make_tree(basedir)
+        trash_dir = trash.move_to_trash(basedir)
+        assert trash_dir == str(tmp_path / trash.TRASH_DIRNAME)
+        assert not os.path.exists(basedir)
+        assert trash.pending(trash_dir)
+        assert len(os.listdir(trash_dir)) == 1
+
+        assert trash.reap(trash_dir)
+        assert not trash.pending(trash_dir)
+        assert os.listdir(trash_dir) == [trash.LOCK_FILE]
+
+    def test_move_missing(self, tmp_path):
+        """ Nothing to move is not a failure """
+        assert trash.move_to_trash(str(tmp_path / "missing")) == str(tmp_path / trash.TRASH_DIRNAME)
+        assert not trash.pending(str(tmp_path / trash.TRASH_DIRNAME))
+
+    def test_pending_no_trash(self, tmp_path):
+        """ No trash directory, nothing pending """
+        assert not trash.pending(str(tmp_path / trash.TRASH_DIRNAME))
+
+    def test_one_reaper(self, tmp_path):
+        """ Only one reaper works on the trash at a time """
+        basedir = str(tmp_path / "epel-9-x86_64")
+        _make_tree(basedir)
+        trash_dir = trash.move_to_trash(basedir)
+        assert not trash._locked(trash_dir)  # pylint: disable=protected-access
+
+        read_end, write_end = os.pipe()
+        read_end2, write_end2 = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # lockf() locks are per-process, hold it in a child
+            with open(os.path.join(trash_dir, trash.LOCK_FILE), "a+") as lock:
+                fcntl.lockf(lock.fileno(), fcntl.LOCK_EX)
+                os.write(write_end, b"x")
+                os.read(read_end2, 1)
+            os._exit(0)
+        os.close(write_end)
+        os.read(read_end, 1)
+        try:
+            assert trash._locked(trash_dir)  # pylint: disable=protected-access
+            assert not trash.reap(trash_dir)
+            assert trash.pending(trash_dir)
+        finally:
+            os.write(write_end2, b"x")
+            os.waitpid(pid, 0)
+        assert trash.reap(trash_dir)
+        assert not trash.pending(trash_dir)
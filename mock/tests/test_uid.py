@@ -0,0 +1,65 @@
+""" Tests for the mockbuild.uid """
+
+import os
+from unittest import mock
+
+from mockbuild import uid
+
+
+def _make_tree(path):
+    for sub in ("a", "b/c"):
+        os.makedirs(os.path.join(path, sub))
+        for i in range(3):
+            with open(os.path.join(path, sub, "file{0}".format(i)), "w") as f:
+                f.write("x")
+    os.symlink("a/file0", os.path.join(path, "link"))
+
+
+def _chowned(path, marker=False, gid=None):
+    """ Run chown_tree(), return the set of paths lchown()ed, relative to PATH """
+    with mock.patch("mockbuild.uid.os.lchown") as lchown:
+        uid.chown_tree(path, os.getuid(), os.getgid() if gid is None else gid, marker=marker)
+    return {os.path.relpath(call[0][0], path) for call in lchown.call_args_list}
+
+
+class TestChownTree:
+    """ Recursive UidManager.changeOwner() """
+
+    def test_already_owned(self, tmp_path):
+        """ Entries owned correctly are not touched """
+        _make_tree(str(tmp_path))
+        assert _chowned(str(tmp_path)) == set()
+
+    def test_wrong_owner(self, tmp_path):
+        """ All the entries, symlinks not followed """
+        _make_tree(str(tmp_path))
+        assert _chowned(str(tmp_path), gid=os.getgid() + 1) == {
+            ".", "a", "b", "b/c", "link",
+            "a/file0", "a/file1", "a/file2",
+            "b/c/file0", "b/c/file1", "b/c/file2",
+        }
+
+    def test_marker(self, tmp_path):
+        """ Unchanged directories are not rescanned """
+        path = str(tmp_path)
+        _make_tree(path)
+        gid = os.getgid() + 1
+        first = _chowned(path, marker=True, gid=gid)
+        assert "a/file0" in first
+        assert uid.CHOWN_MARKER in first
+        # lchown() was mocked, so everything still has a "wrong" owner, but
+        # only the directories (and the rewritten marker) are looked at
+        assert _chowned(path, marker=True, gid=gid) == {".", "a", "b", "b/c", uid.CHOWN_MARKER}
+
+        with open(os.path.join(path, "b", "c", "new"), "w") as f:
+            f.write("x")
+        assert _chowned(path, marker=True, gid=gid) == {
+            ".", "a", "b", "b/c", uid.CHOWN_MARKER,
+            "b/c/file0", "b/c/file1", "b/c/file2", "b/c/new"}
+
+        # different owner requested, the marker doesn't apply
+        assert "a/file0" in _chowned(path, marker=True, gid=gid + 1)
+
+    def test_missing(self, tmp_path):
+        """ Missing path is not an error """
+        assert _chowned(str(tmp_path / "missing")) == set()
@@ -0,0 +1,213 @@
+"""Tests for the mockbuild.util module"""
+
+import logging
+import os
+import resource
+import signal
+import subprocess
+import time
+from unittest.mock import patch
+
+import pytest
+
+from mockbuild import exception
+from mockbuild import util
+
+
+def _fake_createrepo(cmd, *_args, **_kwargs):
+    outputdir = cmd[cmd.index('--outputdir') + 1]
+    os.makedirs(os.path.join(outputdir, 'repodata'))
+    with open(os.path.join(outputdir, 'repodata', 'repomd.xml'), 'w') as fd:
+        fd.write(outputdir)
+    return ""
+
+
+@patch("mockbuild.util.do", side_effect=_fake_createrepo)
+def test_createrepo_atomic(do, tmp_path):
+    """Metadata are published by switching the repodata symlink"""
+    config = {"createrepo_command": "/usr/bin/createrepo_c -d -q"}
+    (tmp_path / "repodata").mkdir()
+    (tmp_path / "repodata" / "repomd.xml").write_text("old")
+
+    umask = os.umask(0o022)
+    os.umask(umask)
+    generations = []
+    for _ in range(3):
+        util.createrepo(config, str(tmp_path), atomic=True,
+                        cachedir=str(tmp_path / ".cache"))
+        cmd = do.call_args[0][0]
+        assert "--update" in cmd
+        assert cmd[cmd.index("--cachedir") + 1] == str(tmp_path / ".cache")
+        repodata = tmp_path / "repodata"
+        assert repodata.is_symlink()
+        generations.append(os.readlink(repodata).split("/")[0])
+        assert (repodata / "repomd.xml").read_text().endswith(generations[-1])
+        # readable by others, not the mkdtemp() 0700
+        assert os.stat(tmp_path / generations[-1]).st_mode & 0o777 == 0o777 & ~umask
+
+    # the current and the previous generation is kept
+    assert sorted(e for e in os.listdir(tmp_path) if e.startswith(".repodata-")) \
+        == sorted(generations[-2:])
+
+
+class TestDoWithStatus:
+    """Waiting for the executed commands"""
+
+    def test_child_closes_output_early(self):
+        """Child closing its stdout/stderr early is waited for without spinning"""
+        cpu = sum(resource.getrusage(resource.RUSAGE_SELF)[:2])
+        start = time.time()
+        output, returncode = util.do_with_status(
+            ["sh", "-c", "echo early; exec >&- 2>&-; sleep 1; exit 3"],
+            raiseExc=False, returnOutput=True)
+        assert time.time() - start >= 1
+        assert returncode == 3
+        assert output == "early\n"
+        assert sum(resource.getrusage(resource.RUSAGE_SELF)[:2]) - cpu < 0.5
+
+    def test_pty_no_stall(self):
+        """Command on pty is done as soon as it exits, no extra poll round"""
+        start = time.time()
+        output, returncode = util.do_with_status(["sh", "-c", "echo hello"], pty=True,
+                                                 returnOutput=True)
+        assert (output, returncode) == ("hello\n", 0)
+        assert time.time() - start < 0.9
+
+    def test_chatty_child_timeout(self):
+        """Child flooding the output doesn't starve the timeout check"""
+        start = time.time()
+        with pytest.raises(exception.Error):
+            util.do_with_status(["yes"], timeout=1)
+        assert time.time() - start < 10
+
+    def test_timeout_kills_child(self):
+        """SIGTERM is sent when timeout expires, SIGKILL one second later"""
+        start = time.time()
+        with pytest.raises(exception.commandTimeoutExpired):
+            util.do_with_status(["sh", "-c", "trap '' TERM; exec >&- 2>&-; sleep 30"],
+                                timeout=1)
+        assert time.time() - start < 10
+
+    def test_reaped_child_not_waited(self):
+        """An already reaped child is not waited for through its (maybe reused) PID"""
+        with subprocess.Popen(["true"]) as child:
+            child.wait()
+            with patch("os.pidfd_open", side_effect=AssertionError("pidfd opened")):
+                assert util._wait_pid(child, 5)  # pylint: disable=protected-access
+
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+
+def _pump(script, **kwargs):
+    """Run the shell SCRIPT through logOutput(), return (output, logged lines)"""
+    logger = logging.getLogger("mockbuild.test.pump")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    records = _Records()
+    logger.addHandler(records)
+    try:
+        with subprocess.Popen(["sh", "-c", script], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE) as child:
+            output = util.logOutput(child.stdout, child.stderr, logger, child=child, **kwargs)
+    finally:
+        logger.removeHandler(records)
+    return output, [line for line in records.lines if not line.startswith("Child ")]
+
+
+class TestLogOutput:
+    """Pumping the command output into the log"""
+
+    def test_stderr_prefix(self):
+        """stderr lines are prefixed, except the shell trace"""
+        mockbuild_logger = logging.getLogger("mockbuild")
+        with patch.object(mockbuild_logger, "mock_stderr_line_prefix", "E: ", create=True):
+            output, lines = _pump("echo out; echo err >&2; sleep 0.1; echo '+ trace' >&2")
+        assert lines == ["out", "E: err", "+ trace"]
+        assert output == "out\nerr\n+ trace\n"
+
+    def test_ansi_stripped(self):
+        """ANSI colors are stripped from the log, not from the output"""
+        output, lines = _pump(r"printf '\033[31mred\033[0m\n'")
+        assert lines == ["red"]
+        assert output == "\x1b[31mred\x1b[0m\n"
+
+    def test_multibyte_split(self):
+        """Multibyte characters split between reads, and cut at the end"""
+        output, lines = _pump(r"printf 'a\305'; sleep 0.2; printf '\241b\nend\305'")
+        assert lines == ["a\u0161b", "end\ufffd"]
+        assert output == "a\u0161b\nend\ufffd"
+
+    def test_no_stderr(self):
+        """returnStderr=False drops stderr from both the output and the log"""
+        output, lines = _pump("echo out; echo err >&2", returnStderr=False)
+        assert lines == ["out"]
+        assert output == "out\n"
+
+    def test_grandchild_output(self):
+        """Output of the children coming after the child exited is read"""
+        start = time.time()
+        output, _ = _pump("(sleep 0.2; echo late) & echo early")
+        assert output == "early\nlate\n"
+        assert time.time() - start < 5
+
+
+class TestWaitAny:
+    """Waiting for the first of several children"""
+
+    @pytest.mark.parametrize("pidfd_error", [None, OSError("ENOSYS")])
+    def test_first_finished(self, pidfd_error):
+        """The first finished child is returned as soon as it exits, with or without pidfds"""
+        with subprocess.Popen(["sleep", "30"]) as slow, \
+                subprocess.Popen(["sh", "-c", "sleep 0.2; exit 2"]) as fast:
+            start = time.time()
+            with patch("os.pidfd_open", wraps=os.pidfd_open, side_effect=pidfd_error):
+                assert util.wait_any([slow, fast]) is fast
+            assert time.time() - start < 0.9
+            assert fast.returncode == 2
+            assert slow.poll() is None
+            slow.kill()
+
+
+class TestOrphansKill:
+    """Killing the leftover processes in chroot"""
+
+    def test_tracked_processes(self, tmp_path):
+        """Only the processes in the tracking cgroup are considered, if asked to"""
+        with subprocess.Popen(["sleep", "30"]) as sleeper:
+            (tmp_path / "cgroup.procs").write_text("{0}\n".format(sleeper.pid))
+            with patch("mockbuild.util._TRACKING_CGROUP", str(tmp_path)), \
+                    patch("mockbuild.util.USE_NSPAWN", False), \
+                    patch("os.listdir", side_effect=AssertionError("/proc scanned")):
+                util.orphansKill("/", tracked_only=True)
+            assert sleeper.wait(timeout=5) == -signal.SIGTERM
+
+    def test_untracked_processes(self, tmp_path):
+        """Without tracked_only, /proc is scanned for the processes not in the cgroup"""
+        with subprocess.Popen(["sleep", "30"]) as sleeper:
+            (tmp_path / "cgroup.procs").write_text("")
+            with patch("mockbuild.util._TRACKING_CGROUP", str(tmp_path)), \
+                    patch("mockbuild.util.USE_NSPAWN", False), \
+                    patch("os.listdir", return_value=[str(sleeper.pid), "self"]):
+                util.orphansKill("/", tracked_only=True)
+                assert sleeper.poll() is None
+                util.orphansKill("/")
+            assert sleeper.wait(timeout=5) == -signal.SIGTERM
+
+    def test_survivor_killed(self, tmp_path):
+        """Processes ignoring SIGTERM are killed"""
+        with subprocess.Popen(["sh", "-c", "trap '' TERM; echo; sleep 30"],
+                              stdout=subprocess.PIPE) as stubborn:
+            stubborn.stdout.readline()
+            (tmp_path / "cgroup.procs").write_text("{0}\n".format(stubborn.pid))
+            with patch("mockbuild.util._TRACKING_CGROUP", str(tmp_path)), \
+                    patch("mockbuild.util.USE_NSPAWN", False):
+                util.orphansKill("/", tracked_only=True)
+            assert stubborn.wait(timeout=5) == -signal.SIGKILL